@@ -14,7 +14,6 @@ from datetime import timedelta
 import os
 from pathlib import Path
 
-from django.utils import timezone
 import environ
 
 env = environ.Env(
@@ -31,6 +30,10 @@ env = environ.Env(
     RADIUSDESK_DB_URL=(str, None),
     KEYCLOAK_ADMIN_ENABLED=(bool, False),
     KEYCLOAK_ADMIN_REALM=(str, "master"),
+    PING_BACKEND=(str, "fping"),
+    PING_CONCURRENCY=(int, 256),
+    PING_SHARD_SIZE=(int, 500),
+    METRICS_CHUNK_STORAGE=(bool, False),
 )
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -126,6 +129,41 @@ UNIFI_URL = env("UNIFI_URL")
 # Nothing at the moment
 MESH_SETTINGS_DEFAULTS = {}
 
+# Ping config
+# Either "fping" (fping subprocesses) or "asyncio" (in-process ICMP prober)
+PING_BACKEND = env("PING_BACKEND")
+# Maximum number of hosts the asyncio prober probes at the same time
+PING_CONCURRENCY = env("PING_CONCURRENCY")
+# Devices are pinged in a separate task per mesh, large meshes are split
+# into shards of at most this many devices
+PING_SHARD_SIZE = env("PING_SHARD_SIZE")
+
+# Metrics config
+# Pack raw metrics into compressed daily chunks instead of deleting them
+# when they're aggregated, see metrics.chunks
+METRICS_CHUNK_STORAGE = env("METRICS_CHUNK_STORAGE")
+# Days to keep metrics for, per granularity ("RAW" for metrics that haven't
+# been aggregated, "CHUNKS" for packed raw metrics and their partitions), None
+# keeps them forever. Chunks are only archived to partitions once their month
+# has closed, so "CHUNKS" has to be longer than a month to archive anything.
+# Policies for specific metric types are keyed by model name, e.g. "rttmetric",
+# and override the default policy.
+METRICS_RETENTION = {
+    "default": {"RAW": 2, "CHUNKS": 365, "HOURLY": 30, "DAILY": 730, "MONTHLY": None},
+}
+# Expired metrics are deleted in batches of this many rows, each batch in
+# its own transaction so that the database isn't locked for long
+METRICS_RETENTION_BATCH_SIZE = 1000
+# Packed raw metrics of closed months are moved to one file per month in this
+# directory, see metrics.partitions
+METRICS_PARTITION_DIR = BASE_DIR / "metrics-partitions"
+# Buffered metrics (see metrics.buffer) are written in a single transaction
+# once this many are pending, or the oldest has been pending this many seconds
+METRICS_BUFFER_SIZE = 1000
+METRICS_BUFFER_INTERVAL = 5
+# Adding metrics waits on a flush once this many are pending
+METRICS_BUFFER_MAX_SIZE = 20000
+
 WALLET_ENCRYPTION_KEY = env("WALLET_ENCRYPTION_KEY")
 WALLET_CONTRACT_ADDRESS = env("WALLET_CONTRACT_ADDRESS")
 
@@ -134,12 +172,15 @@ TWILIO_ACCOUNT_SID = env("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = env("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUM = env("TWILIO_PHONE_NUM")
 
+# Each check compares a node's value ("key", a field or get_<key>() method) to
+# a setting of its mesh with "op" (the time since the value with "age"). A
+# "func"(value, setting) can be given instead of "op".
 DEVICE_CHECKS = [
     {
         "title": "CPU Usage",
         "key": "cpu",
         "setting": "check_cpu",
-        "func": lambda v, s: v < s,
+        "op": "lt",
         "feedback": {
             "NO_DATA": "No CPU usage recorded",
             "NO_SETTING": "No CPU warning set",
@@ -151,7 +192,7 @@ DEVICE_CHECKS = [
         "title": "Memory Usage",
         "key": "mem",
         "setting": "check_mem",
-        "func": lambda v, s: v < s,
+        "op": "lt",
         "feedback": {
             "NO_DATA": "No memory usage recorded",
             "NO_SETTING": "No memory warning set",
@@ -163,7 +204,8 @@ DEVICE_CHECKS = [
         "title": "Active",
         "key": "last_contact",
         "setting": "check_active",
-        "func": lambda v, s: timezone.now() - v < s,
+        "op": "lt",
+        "age": True,
         "feedback": {
             "NO_DATA": "Device has not contacted the server",
             "NO_SETTING": "No active time warning set",
@@ -175,7 +217,7 @@ DEVICE_CHECKS = [
         "title": "RTT",
         "key": "rtt",
         "setting": "check_rtt",
-        "func": lambda v, s: v < s,
+        "op": "lt",
         "feedback": {
             "NO_DATA": "No RTT data",
             "NO_SETTING": "No RTT warning set",
@@ -319,6 +361,11 @@ CELERY_BEAT_SCHEDULE = {
         # Executes alert generation every 10 mins
         "schedule": timedelta(minutes=10),
     },
+    "alerts_count_schedule": {
+        "task": "monitoring.tasks.count_unresolved_alerts",
+        # Catches up on alerts updated without signals, every day
+        "schedule": timedelta(days=1),
+    },
     "aggregate_hourly": {
         "task": "metrics.tasks.aggregate_all_hourly_metrics",
         "schedule": timedelta(hours=1),
@@ -331,6 +378,14 @@ CELERY_BEAT_SCHEDULE = {
         "task": "metrics.tasks.aggregate_all_monthly_metrics",
         "schedule": timedelta(days=30),
     },
+    "metrics_retention": {
+        "task": "metrics.tasks.enforce_all_retention",
+        "schedule": timedelta(hours=1),
+    },
+    "metrics_partitions": {
+        "task": "metrics.tasks.archive_metric_partitions",
+        "schedule": timedelta(days=1),
+    },
 }
 
 LOGGING = {
@@ -0,0 +1,182 @@
+"""In-process write buffer for metrics.
+
+Metrics added to the buffer are ingested in bulk (skipping metrics that
+already exist), all types in a single transaction, once enough of them are
+pending or the oldest pending metric has waited long enough. This keeps the
+(SQLite) metrics database locked for one short write instead of many small
+ones. Ping results are flushed right away (their health checks need them),
+but are left to the background thread like the others if that fails.
+"""
+
+import atexit
+from collections import defaultdict
+import logging
+import threading
+import time
+from typing import Iterable, Type
+
+from django.conf import settings
+from django.db import OperationalError, connections, router, transaction
+from django.utils import timezone
+
+from .models import Metric
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the background thread
+POLL_INTERVAL = 1
+
+
+class BufferFull(Exception):
+    """Raised when metrics can't be added because the buffer can't be flushed."""
+
+
+class MetricBuffer:
+    """Buffers metrics in memory and writes them in batches.
+
+    The buffer is flushed when at least `size` metrics are pending, or the
+    oldest pending metric was added at least `interval` seconds ago. Once
+    `max_size` metrics are pending (e.g. because the database is locked),
+    adding metrics waits on a flush, and raises BufferFull if it fails.
+    """
+
+    def __init__(self, size: int | None = None, interval: float | None = None, max_size: int | None = None):
+        self.size = size or settings.METRICS_BUFFER_SIZE
+        self.interval = interval if interval is not None else settings.METRICS_BUFFER_INTERVAL
+        self.max_size = max_size or settings.METRICS_BUFFER_MAX_SIZE
+        self.pending: dict[Type[Metric], list[Metric]] = defaultdict(list)
+        self.count = 0
+        self.oldest: float | None = None
+        # Guards the pending metrics
+        self.lock = threading.Lock()
+        # Only one flush at a time, so metrics are written in order
+        self.flush_lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+        self.stopped = threading.Event()
+
+    def add(self, metrics: Iterable[Metric]) -> None:
+        """Add metrics to the buffer, flushes it if due.
+
+        Raises ValueError if a metric misses required fields, since it could
+        never be written.
+        """
+        metrics = list(metrics)
+        now = timezone.now()
+        for metric in metrics:
+            if metric.created is None:
+                metric.created = now
+            missing = missing_fields(metric)
+            if missing:
+                raise ValueError(f"{type(metric).__name__} for {metric.mac} misses {', '.join(missing)}")
+        if self.count + len(metrics) > self.max_size:
+            try:
+                self.flush()
+            except OperationalError as e:
+                raise BufferFull(f"Can't flush {self.count} pending metrics") from e
+        with self.lock:
+            for metric in metrics:
+                self.pending[type(metric)].append(metric)
+            self.count += len(metrics)
+            if self.oldest is None and metrics:
+                self.oldest = time.monotonic()
+        if self.is_due():
+            self.flush(requeue=True)
+
+    def is_due(self) -> bool:
+        """Check whether the buffer should be flushed."""
+        if self.oldest is None:
+            return False
+        return self.count >= self.size or time.monotonic() - self.oldest >= self.interval
+
+    def flush(self, requeue: bool = False) -> int:
+        """Write all pending metrics in a single transaction, returns how many were new.
+
+        :param requeue: Put the metrics back in the buffer, instead of raising,
+            if the database is locked.
+        """
+        with self.flush_lock:
+            with self.lock:
+                pending, count = self.pending, self.count
+                self.pending, self.count, self.oldest = defaultdict(list), 0, None
+            if not count:
+                return 0
+            db = router.db_for_write(Metric)
+            written = 0
+            try:
+                with transaction.atomic(using=db):
+                    for metric_type, metrics in pending.items():
+                        # A failing metric type doesn't hold up the others
+                        try:
+                            with transaction.atomic(using=db):
+                                written += len(metric_type.objects.ingest(metrics))
+                        except OperationalError:
+                            raise
+                        except Exception:
+                            logger.exception("Dropped %d %s metrics", len(metrics), metric_type.__name__)
+            except OperationalError:
+                self.requeue(pending, count)
+                if not requeue:
+                    raise
+                logger.warning("Couldn't flush %d metrics, will retry", count, exc_info=True)
+                return 0
+            logger.debug("Flushed %d metrics, %d new", count, written)
+            return written
+
+    def requeue(self, pending: dict[Type[Metric], list[Metric]], count: int) -> None:
+        """Put metrics that couldn't be written back in front of the pending ones."""
+        with self.lock:
+            for metric_type, metrics in pending.items():
+                self.pending[metric_type][:0] = metrics
+            self.count += count
+            self.oldest = time.monotonic()
+
+    def start(self) -> None:
+        """Start flushing the buffer from a background thread when it's due."""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="metric-buffer", daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        """Flush the buffer whenever it's due, until stopped."""
+        db = router.db_for_write(Metric)
+        try:
+            while not self.stopped.wait(POLL_INTERVAL):
+                if not self.is_due():
+                    continue
+                try:
+                    self.flush(requeue=True)
+                except Exception:
+                    logger.exception("Failed to flush metrics")
+        finally:
+            connections[db].close()
+
+    def stop(self) -> None:
+        """Stop the background thread, and flush the remaining metrics."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+
+def missing_fields(metric: Metric) -> list[str]:
+    """Get the names of required fields that aren't set on a metric."""
+    return [
+        field.name for field in metric._meta.concrete_fields
+        if not field.primary_key and not field.null and not field.has_default()
+        and getattr(metric, field.attname) is None
+    ]
+
+
+_buffer: MetricBuffer | None = None
+
+
+def get_buffer() -> MetricBuffer:
+    """Get the metric buffer of this process, which is flushed when it exits."""
+    global _buffer
+    if _buffer is None:
+        _buffer = MetricBuffer()
+        atexit.register(_buffer.stop)
+    return _buffer
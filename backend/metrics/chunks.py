@@ -0,0 +1,98 @@
+"""Compact storage of raw metrics, packed into compressed chunks.
+
+A chunk holds the raw samples of one metric type for one mac address, with
+delta-encoded timestamps (in microseconds) and one typed array per field:
+float32 for float fields, int64 for everything else. Null values are tracked
+in a per-field mask, which is only stored for fields that have nulls.
+"""
+
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import TYPE_CHECKING, Type
+
+from django.db import models
+
+if TYPE_CHECKING:
+    from .models import Metric
+
+VERSION = 1
+HEADER = struct.Struct("<BI")
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def column_types(metric_type: Type["Metric"]) -> dict[str, str]:
+    """Get the array type code of each field stored in a chunk."""
+    return {
+        fn: "f" if isinstance(metric_type._meta.get_field(fn), models.FloatField) else "q"
+        for fn in sorted(metric_type.rollup_fields())
+    }
+
+
+def to_bytes(values: array) -> bytes:
+    """Serialize an array as little endian."""
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_bytes(typecode: str, data: bytes) -> array:
+    """Deserialize a little endian array."""
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def encode_chunk(metric_type: Type["Metric"], metrics: list["Metric"]) -> bytes:
+    """Pack raw metrics (sorted by creation time) into a compressed chunk."""
+    timestamps = [(m.created - EPOCH) // timedelta(microseconds=1) for m in metrics]
+    deltas = array("q", (t - prev for t, prev in zip(timestamps, [0, *timestamps])))
+    data = bytearray(HEADER.pack(VERSION, len(metrics)))
+    data += to_bytes(deltas)
+    for fn, typecode in column_types(metric_type).items():
+        values = [getattr(m, fn) for m in metrics]
+        nulls = [v is None for v in values]
+        data += struct.pack("<B", any(nulls))
+        if any(nulls):
+            data += bytes(nulls)
+        data += to_bytes(array(typecode, (0 if v is None else v for v in values)))
+    return zlib.compress(bytes(data))
+
+
+def decode_chunk(metric_type: Type["Metric"], data: bytes, mac) -> list["Metric"]:
+    """Unpack a chunk into (unsaved) raw metrics for the given mac address."""
+    data = zlib.decompress(data)
+    version, n = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Unsupported chunk version {version}")
+    offset = HEADER.size
+    timestamps = []
+    total = 0
+    for delta in from_bytes("q", data[offset:offset + 8 * n]):
+        total += delta
+        timestamps.append(total)
+    offset += 8 * n
+    columns = {}
+    for fn, typecode in column_types(metric_type).items():
+        (has_nulls,) = struct.unpack_from("<B", data, offset)
+        offset += 1
+        nulls = data[offset:offset + n] if has_nulls else bytes(n)
+        offset += n if has_nulls else 0
+        size = array(typecode).itemsize * n
+        values = from_bytes(typecode, data[offset:offset + size])
+        offset += size
+        field = metric_type._meta.get_field(fn)
+        columns[fn] = [None if null else field.to_python(v) for v, null in zip(values, nulls)]
+    return [
+        metric_type(
+            mac=mac,
+            created=EPOCH + timedelta(microseconds=ts),
+            **{fn: values[i] for fn, values in columns.items()},
+        )
+        for i, ts in enumerate(timestamps)
+    ]
@@ -0,0 +1,67 @@
+"""Downsampling of metric series, to bound the number of points served.
+
+Series can either be averaged over time buckets (in the database, see
+:meth:`metrics.models.MetricsQuerySet.aggregate_buckets`) or reduced to a
+subset of their points with Largest-Triangle-Three-Buckets, which keeps the
+visual shape of a series (e.g. spikes) when it is plotted.
+"""
+
+import math
+import re
+
+BUCKET_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_bucket(value: str) -> int | None:
+    """Parse a bucket size like '30s', '15m', '1h' or '1d' into seconds."""
+    match = re.fullmatch(r"(\d+)([smhd])", value)
+    if match is None or int(match.group(1)) == 0:
+        return None
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2)]
+
+
+def bucket_interval(span: float, points: int | None, bucket: int | None) -> int:
+    """Get the bucket size (in seconds) for a series spanning `span` seconds.
+
+    Buckets are at least `bucket` seconds wide, and wide enough that there are
+    at most `points` (epoch-aligned) buckets in the series.
+    """
+    interval = bucket or 1
+    if points is not None:
+        # A span of at most (n-1) buckets overlaps with at most n aligned buckets
+        interval = max(interval, math.ceil(span / max(points - 1, 1)))
+    return interval
+
+
+def lttb(xs: list[float], ys: list[float], threshold: int) -> list[int]:
+    """Select the indices of `threshold` points with Largest-Triangle-Three-Buckets.
+
+    See https://skemman.is/handle/1946/15343. The first and last points are
+    always selected, the points in between are split into equal buckets and
+    from each bucket the point forming the largest triangle with the previous
+    selected point and the average of the next bucket is selected.
+    """
+    n = len(xs)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1][:threshold]
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = sum(xs[avg_start:avg_end]) / (avg_end - avg_start)
+        avg_y = sum(ys[avg_start:avg_end]) / (avg_end - avg_start)
+        max_area = -1.0
+        next_a = avg_start - 1
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > max_area:
+                max_area = area
+                next_a = j
+        selected.append(next_a)
+        a = next_a
+    selected.append(n - 1)
+    return selected
@@ -0,0 +1,208 @@
+# Generated by Django 5.1 on 2026-10-18 09:12
+
+import macaddress.fields
+from django.db import migrations, models
+
+# Metric used to be a concrete model that every metric type inherited from
+# (multi-table inheritance), so each metric was split across two tables. It is
+# now an abstract model: each metric type gets a standalone table, which is
+# populated from the old parent & child tables before they are dropped.
+
+METRIC_TYPES = {
+    "DataUsageMetric": ["tx_bytes", "rx_bytes"],
+    "FailuresMetric": ["tx_packets", "rx_packets", "tx_dropped", "rx_dropped", "tx_retries", "tx_errors", "rx_errors"],
+    "ResourcesMetric": ["memory", "cpu"],
+    "RTTMetric": ["rtt_min", "rtt_avg", "rtt_max"],
+    "UptimeMetric": ["reachable", "loss"],
+    "DataRateMetric": ["tx_rate", "rx_rate"],
+}
+COMMON_COLUMNS = ["id", "created", "mac", "granularity"]
+
+
+def copy_to_standalone_tables(apps, schema_editor):
+    """Copy metrics from the parent & child tables to the new standalone tables."""
+    qn = schema_editor.quote_name
+    metric_table = qn(apps.get_model("metrics", "Metric")._meta.db_table)
+    for name, columns in METRIC_TYPES.items():
+        old_table = qn(apps.get_model("metrics", name)._meta.db_table)
+        new_table = qn(apps.get_model("metrics", f"{name}Standalone")._meta.db_table)
+        insert_columns = ", ".join(qn(c) for c in COMMON_COLUMNS + columns)
+        select_columns = ", ".join(
+            [f"m.{qn(c)}" for c in COMMON_COLUMNS] + [f"c.{qn(c)}" for c in columns]
+        )
+        schema_editor.execute(
+            f"INSERT INTO {new_table} ({insert_columns}) "
+            f"SELECT {select_columns} FROM {old_table} c "
+            f"JOIN {metric_table} m ON c.{qn('metric_ptr_id')} = m.{qn('id')}"
+        )
+
+
+def copy_to_inherited_tables(apps, schema_editor):
+    """Copy metrics from the standalone tables back to the parent & child tables."""
+    qn = schema_editor.quote_name
+    metric_table = qn(apps.get_model("metrics", "Metric")._meta.db_table)
+    common_columns = ", ".join(qn(c) for c in COMMON_COLUMNS)
+    for name, columns in METRIC_TYPES.items():
+        old_table = qn(apps.get_model("metrics", name)._meta.db_table)
+        new_table = qn(apps.get_model("metrics", f"{name}Standalone")._meta.db_table)
+        schema_editor.execute(
+            f"INSERT INTO {metric_table} ({common_columns}) "
+            f"SELECT {common_columns} FROM {new_table}"
+        )
+        child_columns = ", ".join(qn(c) for c in columns)
+        schema_editor.execute(
+            f"INSERT INTO {old_table} ({qn('metric_ptr_id')}, {child_columns}) "
+            f"SELECT {qn('id')}, {child_columns} FROM {new_table}"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0003_metric_granularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataUsageMetricStandalone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('mac', macaddress.fields.MACAddressField(integer=True)),
+                ('granularity', models.IntegerField(blank=True, choices=[(3600, 'Hourly'), (86400, 'Daily'), (2678400, 'Monthly')], null=True)),
+                ('tx_bytes', models.BigIntegerField()),
+                ('rx_bytes', models.BigIntegerField()),
+            ],
+            options={
+                'ordering': ['created'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='FailuresMetricStandalone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('mac', macaddress.fields.MACAddressField(integer=True)),
+                ('granularity', models.IntegerField(blank=True, choices=[(3600, 'Hourly'), (86400, 'Daily'), (2678400, 'Monthly')], null=True)),
+                ('tx_packets', models.BigIntegerField()),
+                ('rx_packets', models.BigIntegerField()),
+                ('tx_dropped', models.IntegerField(blank=True, null=True)),
+                ('rx_dropped', models.IntegerField(blank=True, null=True)),
+                ('tx_retries', models.IntegerField(blank=True, null=True)),
+                ('tx_errors', models.IntegerField(blank=True, null=True)),
+                ('rx_errors', models.IntegerField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['created'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ResourcesMetricStandalone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('mac', macaddress.fields.MACAddressField(integer=True)),
+                ('granularity', models.IntegerField(blank=True, choices=[(3600, 'Hourly'), (86400, 'Daily'), (2678400, 'Monthly')], null=True)),
+                ('memory', models.FloatField()),
+                ('cpu', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['created'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='RTTMetricStandalone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('mac', macaddress.fields.MACAddressField(integer=True)),
+                ('granularity', models.IntegerField(blank=True, choices=[(3600, 'Hourly'), (86400, 'Daily'), (2678400, 'Monthly')], null=True)),
+                ('rtt_min', models.FloatField(blank=True, null=True)),
+                ('rtt_avg', models.FloatField(blank=True, null=True)),
+                ('rtt_max', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['created'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='UptimeMetricStandalone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('mac', macaddress.fields.MACAddressField(integer=True)),
+                ('granularity', models.IntegerField(blank=True, choices=[(3600, 'Hourly'), (86400, 'Daily'), (2678400, 'Monthly')], null=True)),
+                ('reachable', models.BooleanField()),
+                ('loss', models.IntegerField()),
+            ],
+            options={
+                'ordering': ['created'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DataRateMetricStandalone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('mac', macaddress.fields.MACAddressField(integer=True)),
+                ('granularity', models.IntegerField(blank=True, choices=[(3600, 'Hourly'), (86400, 'Daily'), (2678400, 'Monthly')], null=True)),
+                ('tx_rate', models.IntegerField(blank=True, null=True)),
+                ('rx_rate', models.IntegerField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['created'],
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(copy_to_standalone_tables, copy_to_inherited_tables),
+        migrations.DeleteModel(
+            name='DataUsageMetric',
+        ),
+        migrations.DeleteModel(
+            name='FailuresMetric',
+        ),
+        migrations.DeleteModel(
+            name='ResourcesMetric',
+        ),
+        migrations.DeleteModel(
+            name='RTTMetric',
+        ),
+        migrations.DeleteModel(
+            name='UptimeMetric',
+        ),
+        migrations.DeleteModel(
+            name='DataRateMetric',
+        ),
+        migrations.DeleteModel(
+            name='Metric',
+        ),
+        migrations.RenameModel(
+            old_name='DataUsageMetricStandalone',
+            new_name='DataUsageMetric',
+        ),
+        migrations.RenameModel(
+            old_name='FailuresMetricStandalone',
+            new_name='FailuresMetric',
+        ),
+        migrations.RenameModel(
+            old_name='ResourcesMetricStandalone',
+            new_name='ResourcesMetric',
+        ),
+        migrations.RenameModel(
+            old_name='RTTMetricStandalone',
+            new_name='RTTMetric',
+        ),
+        migrations.RenameModel(
+            old_name='UptimeMetricStandalone',
+            new_name='UptimeMetric',
+        ),
+        migrations.RenameModel(
+            old_name='DataRateMetricStandalone',
+            new_name='DataRateMetric',
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.1 on 2026-10-18 10:05
+
+import macaddress.fields
+from django.db import migrations, models
+
+# Aggregated fields of each metric type
+ROLLUP_FIELDS = {
+    "datausagemetric": ["tx_bytes", "rx_bytes"],
+    "failuresmetric": ["tx_packets", "rx_packets", "tx_dropped", "rx_dropped", "tx_retries", "tx_errors", "rx_errors"],
+    "resourcesmetric": ["memory", "cpu"],
+    "rttmetric": ["rtt_min", "rtt_avg", "rtt_max"],
+    "uptimemetric": ["reachable", "loss"],
+    "dataratemetric": ["tx_rate", "rx_rate"],
+}
+GRANULARITIES = [3600, 86400, 2678400]
+
+
+def backfill_rollups(apps, schema_editor):
+    """Build rollups from existing metrics that haven't been aggregated yet.
+
+    Each rollup includes all metrics of a finer granularity in its bucket.
+    """
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    qn = schema_editor.quote_name
+    rollup_table = qn(apps.get_model("metrics", "MetricRollup")._meta.db_table)
+    for model_name, fields in ROLLUP_FIELDS.items():
+        table = qn(apps.get_model("metrics", model_name)._meta.db_table)
+        for gran in GRANULARITIES:
+            bucket = f"datetime((CAST(strftime('%%s', created) AS INTEGER) / {gran}) * {gran}, 'unixepoch')"
+            for field in fields:
+                schema_editor.execute(
+                    f"INSERT INTO {rollup_table} (metric, field, mac, granularity, bucket, count, sum, min, max) "
+                    f"SELECT '{model_name}', '{field}', mac, {gran}, {bucket}, "
+                    f"COUNT({qn(field)}), SUM({qn(field)}), MIN({qn(field)}), MAX({qn(field)}) "
+                    f"FROM {table} "
+                    f"WHERE (granularity IS NULL OR granularity < {gran}) AND {qn(field)} IS NOT NULL "
+                    f"GROUP BY mac, {bucket}"
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0004_standalone_metric_tables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(help_text='Model name of the metric type', max_length=32)),
+                ('field', models.CharField(help_text='Name of the aggregated field', max_length=32)),
+                ('mac', macaddress.fields.MACAddressField(integer=True)),
+                ('granularity', models.IntegerField(choices=[(3600, 'Hourly'), (86400, 'Daily'), (2678400, 'Monthly')])),
+                ('bucket', models.DateTimeField(help_text='Start of the time bucket')),
+                ('count', models.BigIntegerField(help_text='Number of (non-null) samples')),
+                ('sum', models.FloatField()),
+                ('min', models.FloatField()),
+                ('max', models.FloatField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('metric', 'granularity', 'mac', 'bucket', 'field'), name='unique_metric_rollup')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0006_metric_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataratemetric',
+            name='sketches',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datausagemetric',
+            name='sketches',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='failuresmetric',
+            name='sketches',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='resourcesmetric',
+            name='sketches',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rttmetric',
+            name='sketches',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='uptimemetric',
+            name='sketches',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
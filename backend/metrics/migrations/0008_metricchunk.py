@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:49
+
+import macaddress.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0007_metric_sketches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(help_text='Model name of the metric type', max_length=32)),
+                ('mac', macaddress.fields.MACAddressField(integer=True)),
+                ('day', models.DateField(help_text='UTC day of the metrics')),
+                ('count', models.PositiveIntegerField(help_text='Number of metrics in the chunk')),
+                ('data', models.BinaryField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('metric', 'mac', 'day'), name='unique_metric_chunk')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0008_metricchunk'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dataratemetric',
+            index=models.Index(fields=['granularity', 'created'], name='dataratemetric_retention'),
+        ),
+        migrations.AddIndex(
+            model_name='datausagemetric',
+            index=models.Index(fields=['granularity', 'created'], name='datausagemetric_retention'),
+        ),
+        migrations.AddIndex(
+            model_name='failuresmetric',
+            index=models.Index(fields=['granularity', 'created'], name='failuresmetric_retention'),
+        ),
+        migrations.AddIndex(
+            model_name='resourcesmetric',
+            index=models.Index(fields=['granularity', 'created'], name='resourcesmetric_retention'),
+        ),
+        migrations.AddIndex(
+            model_name='rttmetric',
+            index=models.Index(fields=['granularity', 'created'], name='rttmetric_retention'),
+        ),
+        migrations.AddIndex(
+            model_name='uptimemetric',
+            index=models.Index(fields=['granularity', 'created'], name='uptimemetric_retention'),
+        ),
+    ]
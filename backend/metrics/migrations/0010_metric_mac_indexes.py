@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0009_metric_retention_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dataratemetric',
+            index=models.Index(fields=['mac', 'granularity', 'created'], name='dataratemetric_mac_gran'),
+        ),
+        migrations.AddIndex(
+            model_name='dataratemetric',
+            index=models.Index(fields=['mac', 'created'], name='dataratemetric_mac_created'),
+        ),
+        migrations.AddIndex(
+            model_name='datausagemetric',
+            index=models.Index(fields=['mac', 'granularity', 'created'], name='datausagemetric_mac_gran'),
+        ),
+        migrations.AddIndex(
+            model_name='datausagemetric',
+            index=models.Index(fields=['mac', 'created'], name='datausagemetric_mac_created'),
+        ),
+        migrations.AddIndex(
+            model_name='failuresmetric',
+            index=models.Index(fields=['mac', 'granularity', 'created'], name='failuresmetric_mac_gran'),
+        ),
+        migrations.AddIndex(
+            model_name='failuresmetric',
+            index=models.Index(fields=['mac', 'created'], name='failuresmetric_mac_created'),
+        ),
+        migrations.AddIndex(
+            model_name='resourcesmetric',
+            index=models.Index(fields=['mac', 'granularity', 'created'], name='resourcesmetric_mac_gran'),
+        ),
+        migrations.AddIndex(
+            model_name='resourcesmetric',
+            index=models.Index(fields=['mac', 'created'], name='resourcesmetric_mac_created'),
+        ),
+        migrations.AddIndex(
+            model_name='rttmetric',
+            index=models.Index(fields=['mac', 'granularity', 'created'], name='rttmetric_mac_gran'),
+        ),
+        migrations.AddIndex(
+            model_name='rttmetric',
+            index=models.Index(fields=['mac', 'created'], name='rttmetric_mac_created'),
+        ),
+        migrations.AddIndex(
+            model_name='uptimemetric',
+            index=models.Index(fields=['mac', 'granularity', 'created'], name='uptimemetric_mac_gran'),
+        ),
+        migrations.AddIndex(
+            model_name='uptimemetric',
+            index=models.Index(fields=['mac', 'created'], name='uptimemetric_mac_created'),
+        ),
+    ]
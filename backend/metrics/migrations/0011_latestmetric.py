@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:07
+
+import macaddress.fields
+from django.db import migrations, models
+
+# Aggregated fields of each metric type, and the ones required in a latest metric
+LATEST_FIELDS = {
+    "datausagemetric": (["tx_bytes", "rx_bytes"], []),
+    "failuresmetric": (["tx_packets", "rx_packets", "tx_dropped", "rx_dropped", "tx_retries", "tx_errors", "rx_errors"], []),
+    "resourcesmetric": (["memory", "cpu"], []),
+    "rttmetric": (["rtt_min", "rtt_avg", "rtt_max"], []),
+    "uptimemetric": (["reachable", "loss"], []),
+    "dataratemetric": (["tx_rate", "rx_rate"], ["tx_rate", "rx_rate"]),
+}
+
+
+def backfill_latest_metrics(apps, schema_editor):
+    """Keep the latest existing metric of each type for each mac address."""
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    qn = schema_editor.quote_name
+    latest_table = qn(apps.get_model("metrics", "LatestMetric")._meta.db_table)
+    for model_name, (fields, required) in LATEST_FIELDS.items():
+        table = qn(apps.get_model("metrics", model_name)._meta.db_table)
+        values = ", ".join(f"'{field}', {qn(field)}" for field in sorted(fields))
+        where = " AND ".join(f"{qn(field)} IS NOT NULL" for field in required) or "1"
+        schema_editor.execute(
+            f"INSERT INTO {latest_table} (metric, mac, created, {qn('values')}) "
+            f"SELECT '{model_name}', mac, created, json_object({values}) FROM ("
+            f"SELECT *, ROW_NUMBER() OVER (PARTITION BY mac ORDER BY created DESC) AS row_number "
+            f"FROM {table} WHERE {where}"
+            f") WHERE row_number = 1"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0010_metric_mac_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(help_text='Model name of the metric type', max_length=32)),
+                ('mac', macaddress.fields.MACAddressField(integer=True)),
+                ('created', models.DateTimeField(help_text='The date & time of the metric')),
+                ('values', models.JSONField(help_text='The aggregated fields of the metric')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('metric', 'mac'), name='unique_latest_metric')],
+            },
+        ),
+        migrations.RunPython(backfill_latest_metrics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 5.1 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+# Aggregated fields of each metric type, see 0005_metricrollup
+ROLLUP_FIELDS = {
+    "datausagemetric": ["tx_bytes", "rx_bytes"],
+    "failuresmetric": ["tx_packets", "rx_packets", "tx_dropped", "rx_dropped", "tx_retries", "tx_errors", "rx_errors"],
+    "resourcesmetric": ["memory", "cpu"],
+    "rttmetric": ["rtt_min", "rtt_avg", "rtt_max"],
+    "uptimemetric": ["reachable", "loss"],
+    "dataratemetric": ["tx_rate", "rx_rate"],
+}
+GRANULARITIES = [3600, 86400, 2678400]
+
+
+def duplicates(table: str) -> str:
+    """SQL condition for all but the first metric of each mac address, creation time & granularity."""
+    return f"{table}.id NOT IN (SELECT MIN(id) FROM {table} GROUP BY mac, created, granularity)"
+
+
+def remove_duplicates_from_rollups(apps, schema_editor):
+    """Subtract duplicate raw metrics from the rollups they were added to.
+
+    Rollups of buckets that have been aggregated already may no longer have
+    all of their raw metrics, so they can't be rebuilt from the metrics
+    tables. Duplicates have the same values as the metric they duplicate,
+    so the min & max of the rollups stay the same.
+    """
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    qn = schema_editor.quote_name
+    rollup_table = qn(apps.get_model("metrics", "MetricRollup")._meta.db_table)
+    for model_name, fields in ROLLUP_FIELDS.items():
+        table = qn(apps.get_model("metrics", model_name)._meta.db_table)
+        for gran in GRANULARITIES:
+            bucket = f"datetime((CAST(strftime('%%s', created) AS INTEGER) / {gran}) * {gran}, 'unixepoch')"
+            for field in fields:
+                schema_editor.execute(
+                    f"UPDATE {rollup_table} SET count = {rollup_table}.count - dup.count, "
+                    f"sum = {rollup_table}.sum - dup.sum "
+                    f"FROM (SELECT mac, {bucket} AS bucket, COUNT({qn(field)}) AS count, SUM({qn(field)}) AS sum "
+                    f"FROM {table} WHERE granularity IS NULL AND {qn(field)} IS NOT NULL AND {duplicates(table)} "
+                    f"GROUP BY mac, {bucket}) AS dup "
+                    f"WHERE {rollup_table}.metric = '{model_name}' AND {rollup_table}.field = '{field}' "
+                    f"AND {rollup_table}.granularity = {gran} "
+                    f"AND {rollup_table}.mac = dup.mac AND {rollup_table}.bucket = dup.bucket"
+                )
+    schema_editor.execute(f"DELETE FROM {rollup_table} WHERE count <= 0")
+
+
+def delete_duplicate_metrics(apps, schema_editor):
+    """Keep only the first metric of each mac address, creation time & granularity."""
+    qn = schema_editor.quote_name
+    for model_name in ROLLUP_FIELDS:
+        table = qn(apps.get_model("metrics", model_name)._meta.db_table)
+        schema_editor.execute(f"DELETE FROM {table} WHERE {duplicates(table)}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0011_latestmetric'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates_from_rollups, migrations.RunPython.noop),
+        migrations.RunPython(delete_duplicate_metrics, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dataratemetric',
+            constraint=models.UniqueConstraint(condition=models.Q(('granularity__isnull', True)), fields=('mac', 'created'), name='dataratemetric_unique_raw'),
+        ),
+        migrations.AddConstraint(
+            model_name='dataratemetric',
+            constraint=models.UniqueConstraint(condition=models.Q(('granularity__isnull', False)), fields=('mac', 'created', 'granularity'), name='dataratemetric_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='datausagemetric',
+            constraint=models.UniqueConstraint(condition=models.Q(('granularity__isnull', True)), fields=('mac', 'created'), name='datausagemetric_unique_raw'),
+        ),
+        migrations.AddConstraint(
+            model_name='datausagemetric',
+            constraint=models.UniqueConstraint(condition=models.Q(('granularity__isnull', False)), fields=('mac', 'created', 'granularity'), name='datausagemetric_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='failuresmetric',
+            constraint=models.UniqueConstraint(condition=models.Q(('granularity__isnull', True)), fields=('mac', 'created'), name='failuresmetric_unique_raw'),
+        ),
+        migrations.AddConstraint(
+            model_name='failuresmetric',
+            constraint=models.UniqueConstraint(condition=models.Q(('granularity__isnull', False)), fields=('mac', 'created', 'granularity'), name='failuresmetric_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='resourcesmetric',
+            constraint=models.UniqueConstraint(condition=models.Q(('granularity__isnull', True)), fields=('mac', 'created'), name='resourcesmetric_unique_raw'),
+        ),
+        migrations.AddConstraint(
+            model_name='resourcesmetric',
+            constraint=models.UniqueConstraint(condition=models.Q(('granularity__isnull', False)), fields=('mac', 'created', 'granularity'), name='resourcesmetric_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='rttmetric',
+            constraint=models.UniqueConstraint(condition=models.Q(('granularity__isnull', True)), fields=('mac', 'created'), name='rttmetric_unique_raw'),
+        ),
+        migrations.AddConstraint(
+            model_name='rttmetric',
+            constraint=models.UniqueConstraint(condition=models.Q(('granularity__isnull', False)), fields=('mac', 'created', 'granularity'), name='rttmetric_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='uptimemetric',
+            constraint=models.UniqueConstraint(condition=models.Q(('granularity__isnull', True)), fields=('mac', 'created'), name='uptimemetric_unique_raw'),
+        ),
+        migrations.AddConstraint(
+            model_name='uptimemetric',
+            constraint=models.UniqueConstraint(condition=models.Q(('granularity__isnull', False)), fields=('mac', 'created', 'granularity'), name='uptimemetric_unique'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1 on 2026-10-18 18:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0012_metric_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='dataratemetric',
+            name='stats',
+        ),
+        migrations.RemoveField(
+            model_name='datausagemetric',
+            name='stats',
+        ),
+        migrations.RemoveField(
+            model_name='failuresmetric',
+            name='stats',
+        ),
+        migrations.RemoveField(
+            model_name='resourcesmetric',
+            name='stats',
+        ),
+        migrations.RemoveField(
+            model_name='rttmetric',
+            name='stats',
+        ),
+        migrations.RemoveField(
+            model_name='uptimemetric',
+            name='stats',
+        ),
+    ]
@@ -1,8 +1,53 @@
-from django.db import models
-from django.db.models import Avg, Sum, Min
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Iterable, Type
+
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Case, F, Min, Q, Sum, When
+from django.db.models.functions import Cast, Coalesce
 from django.utils import timezone
 from macaddress.fields import MACAddressField
 
+from .chunks import decode_chunk, encode_chunk
+from .sketch import DDSketch, decode_sketches
+
+
+@dataclass
+class FieldStats:
+    """Count, sum, min & max of a metric field's samples."""
+
+    count: int
+    sum: float
+    min: float
+    max: float
+
+    def value(self, metric_type: Type["Metric"], fn: str) -> float:
+        """Get the aggregated value of a field with these stats."""
+        if fn in metric_type.SUM_FIELDS:
+            return self.sum
+        if fn in metric_type.MIN_FIELDS:
+            return self.min
+        return self.sum / self.count
+
+
+class Epoch(models.Func):
+    """Whole seconds since the unix epoch of a datetime expression."""
+
+    output_field = models.BigIntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        template = "CAST(strftime('%%%%s', %(expressions)s) AS INTEGER)"
+        return self.as_sql(compiler, connection, template=template, **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        template = "CAST(FLOOR(EXTRACT(EPOCH FROM %(expressions)s)) AS BIGINT)"
+        return self.as_sql(compiler, connection, template=template, **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        template = "FLOOR(UNIX_TIMESTAMP(%(expressions)s))"
+        return self.as_sql(compiler, connection, template=template, **extra_context)
+
 
 class MetricsQuerySet(models.QuerySet):
     """Custom queryset for metrics models.
@@ -10,24 +55,134 @@ class MetricsQuerySet(models.QuerySet):
     Capable of creating new metrics from many aggregated ones.
     """
 
-    def aggregate_fields(self):
-        """Aggregate fields values based on SUM_FIELDS, AVG_FIELDS & MIN_FIELDS."""
+    def aggregate_expressions(self) -> dict[str, models.Expression]:
+        """Get aggregate expressions for SUM_FIELDS, AVG_FIELDS & MIN_FIELDS.
+
+        Averages are weighted by the sample count of aggregated metrics.
+        """
+        weight = Coalesce("sample_count", 1)
         sum_kwargs = {fn: Sum(fn) for fn in self.model.SUM_FIELDS}
-        avg_kwargs = {fn: Avg(fn) for fn in self.model.AVG_FIELDS}
+        avg_kwargs = {
+            fn: Cast(Sum(F(fn) * weight), models.FloatField())
+            / Sum(Case(When(**{f"{fn}__isnull": False}, then=weight)))
+            for fn in self.model.AVG_FIELDS
+        }
         min_kwargs = {fn: Min(fn) for fn in self.model.MIN_FIELDS}
-        return self.aggregate(**sum_kwargs, **avg_kwargs, **min_kwargs)
+        return {**sum_kwargs, **avg_kwargs, **min_kwargs}
 
-    def create_aggregated(self, **fields):
-        """Create a metric aggregated from this manager's metrics.
+    def aggregate_buckets(self, start: int, interval: int):
+        """Aggregate fields values per mac address and time bucket.
 
-        :param fields: Extra field values. Typically needs to contain at least
-            the 'mac' and 'created' fields, since these won't be aggregated.
+        Buckets are `interval` seconds wide and start at the `start` timestamp,
+        each row contains the 'mac', the 'bucket' index and the aggregated fields.
         """
-        return self.create(**fields, **self.aggregate_fields())
-
-
-class MetricsManager(models.Manager):
-    """Custom manager for metrics."""
+        bucket = (Epoch("created") - start) / interval
+        return (
+            self.annotate(bucket=bucket)
+            .order_by()  # Default ordering would be added to the GROUP BY
+            .values("mac", "bucket")
+            .annotate(**self.aggregate_expressions())
+        )
+
+    def bucket_sketches(self, interval: int) -> dict[tuple, dict[str, DDSketch]]:
+        """Merge the quantile sketches of metrics per mac & time bucket.
+
+        Buckets are `interval` seconds wide and aligned to the unix epoch,
+        the results are keyed by (mac, bucket start).
+        """
+        fields = ("mac", "created", "sample_count", "sketches", *self.model.SKETCH_FIELDS)
+        sketches = defaultdict(dict)
+        for metric in self.only(*fields).order_by().iterator():
+            ts = int(metric.created.timestamp())
+            bucket = datetime.fromtimestamp(ts - ts % interval, tz=dt_timezone.utc)
+            merged = sketches[(metric.mac, bucket)]
+            for fn, sketch in metric.field_sketches().items():
+                if fn in merged:
+                    merged[fn].merge(sketch)
+                else:
+                    merged[fn] = sketch
+        return sketches
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Create metrics in bulk, raw metrics are also added to the rollups."""
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            MetricRollup.objects.add_metrics(objs)
+            LatestMetric.objects.add_metrics(objs)
+        return objs
+
+    def ingest(self, objs: Iterable["Metric"]) -> list["Metric"]:
+        """Create metrics in bulk, skipping the ones that already exist.
+
+        Metrics are unique per mac address, creation time & granularity (see
+        Metric.Meta.constraints), so ingesting the same metrics again has no
+        effect. Raw metrics of buckets that have already been aggregated are
+        skipped too. Only new metrics are added to the rollups. Returns the new
+        metrics.
+        """
+        mac_field = self.model._meta.get_field("mac")
+        new = {}
+        for obj in objs:
+            new.setdefault((mac_field.get_prep_value(obj.mac), obj.created, obj.granularity), obj)
+        if not new:
+            return []
+        macs = {mac for mac, _, _ in new}
+        start = min(created for _, created, _ in new)
+        end = max(created for _, created, _ in new)
+        margin = timedelta(seconds=Metric.GRANULARITY_ORDER[-1].value)
+        with transaction.atomic(using=self.db):
+            existing = self.filter(mac__in=macs, created__range=(start, end))
+            for mac, created, granularity in existing.values_list("mac", "created", "granularity"):
+                new.pop((mac_field.get_prep_value(mac), created, granularity), None)
+            aggregated = {
+                (mac_field.get_prep_value(mac), created, granularity)
+                for mac, created, granularity in self.filter(
+                    mac__in=macs, granularity__isnull=False, created__range=(start - margin, end + margin)
+                ).values_list("mac", "created", "granularity")
+            }
+            if aggregated:
+                new = {
+                    key: obj for key, obj in new.items()
+                    if key[2] is not None or not is_aggregated(key[0], key[1], aggregated)
+                }
+            objs = self._insert_new(list(new.values()))
+            MetricRollup.objects.add_metrics(objs)
+            LatestMetric.objects.add_metrics(objs)
+        return objs
+
+    def _insert_new(self, objs: list["Metric"]) -> list["Metric"]:
+        """Insert metrics in bulk, returning the ones that were inserted.
+
+        Conflicts can still happen with concurrent writers, in that case the
+        metrics are inserted one by one to find out which ones were skipped.
+        """
+        try:
+            with transaction.atomic(using=self.db):
+                return super().bulk_create(objs)
+        except IntegrityError:
+            inserted = []
+            for obj in objs:
+                try:
+                    with transaction.atomic(using=self.db):
+                        super().bulk_create([obj])
+                except IntegrityError:
+                    continue
+                inserted.append(obj)
+            return inserted
+
+
+def is_aggregated(mac: int, created: datetime, aggregated: set[tuple]) -> bool:
+    """Check whether a raw metric's bucket is in a set of aggregated (mac, created, granularity)."""
+    timestamp = int(created.timestamp())
+    for gran in Metric.GRANULARITY_ORDER:
+        bucket = datetime.fromtimestamp(timestamp - timestamp % gran.value, tz=dt_timezone.utc)
+        if (mac, bucket + timedelta(seconds=gran.value) / 2, gran.value) in aggregated:
+            return True
+    return False
+
+
+class MetricsManager(models.Manager.from_queryset(MetricsQuerySet)):
+    """Custom manager for metrics, exposes the MetricsQuerySet methods."""
 
     def get_queryset(self) -> MetricsQuerySet:
         """Use the custom MetricsQuerySet."""
@@ -54,7 +209,31 @@ class Metric(models.Model):
     class Meta:
         """Metric metadata."""
 
+        abstract = True
         ordering = ["created"]
+        indexes = [
+            # Series of a node at a granularity, e.g. metrics.views.FilterMixin
+            models.Index(fields=["mac", "granularity", "created"], name="%(class)s_mac_gran"),
+            # Series of a node across granularities, when filtering on mac & time only
+            models.Index(fields=["mac", "created"], name="%(class)s_mac_created"),
+            # Metrics of a granularity, when aggregating & expiring metrics
+            models.Index(fields=["granularity", "created"], name="%(class)s_retention"),
+        ]
+        constraints = [
+            # One metric per mac address, creation time & granularity, see
+            # MetricsQuerySet.ingest. Raw metrics have a null granularity, which
+            # isn't considered equal to another null in a unique constraint.
+            models.UniqueConstraint(
+                fields=["mac", "created"],
+                condition=Q(granularity__isnull=True),
+                name="%(class)s_unique_raw",
+            ),
+            models.UniqueConstraint(
+                fields=["mac", "created", "granularity"],
+                condition=Q(granularity__isnull=False),
+                name="%(class)s_unique",
+            ),
+        ]
 
     GRANULARITY_ORDER = [
         Granularity.HOURLY,
@@ -65,6 +244,11 @@ class Metric(models.Model):
     SUM_FIELDS: set[str] = set()
     AVG_FIELDS: set[str] = set()
     MIN_FIELDS: set[str] = set()
+    # Fields for which aggregated metrics keep quantile sketches
+    SKETCH_FIELDS: set[str] = set()
+    # Fields that must be set for a metric to be kept as the latest value
+    LATEST_REQUIRED_FIELDS: set[str] = set()
+    QUANTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
 
     # Custom manager
     objects = MetricsManager()
@@ -73,17 +257,65 @@ class Metric(models.Model):
     mac = MACAddressField()
     # granularity = None means that no aggregation has been applied
     granularity = models.IntegerField(choices=Granularity, null=True, blank=True)
+    # Aggregated metrics keep their number of samples, so that averages can be
+    # weighted when they're aggregated again (see aggregate_expressions)
+    sample_count = models.PositiveIntegerField(null=True, blank=True)
+    # Serialized quantile sketches of SKETCH_FIELDS, see metrics.sketch
+    sketches = models.BinaryField(null=True, blank=True)
+
+    @classmethod
+    def rollup_fields(cls) -> set[str]:
+        """Get the names of fields that are aggregated."""
+        return cls.SUM_FIELDS | cls.AVG_FIELDS | cls.MIN_FIELDS
+
+    @classmethod
+    def from_stats(cls, stats: dict[str, FieldStats], **fields) -> "Metric":
+        """Create an (unsaved) aggregated metric from field stats."""
+        return cls(
+            **fields,
+            **{fn: s.value(cls, fn) for fn, s in stats.items()},
+            sample_count=max((s.count for s in stats.values()), default=0),
+        )
+
+    def field_sketches(self) -> dict[str, DDSketch]:
+        """Get the quantile sketches of each (non-null) field in SKETCH_FIELDS."""
+        if self.sketches is not None:
+            return decode_sketches(self.sketches)
+        # Raw metrics, or metrics aggregated before sketches were kept
+        weight = self.sample_count or 1
+        result = {}
+        for fn in self.SKETCH_FIELDS:
+            value = getattr(self, fn)
+            if value is not None:
+                result[fn] = DDSketch()
+                result[fn].add(float(value), weight)
+        return result
+
+    def quantiles(self) -> dict[str, dict[str, float]] | None:
+        """Get the QUANTILES of each sketched field, None for raw metrics."""
+        if self.sketches is None:
+            return None
+        return {
+            fn: {name: sketch.quantile(q) for name, q in self.QUANTILES.items()}
+            for fn, sketch in self.field_sketches().items()
+        }
 
     def save(self, *args, **kwargs):
         if self.created is None:
             self.created = timezone.now()
-        super().save(*args, **kwargs)
+        adding = self._state.adding
+        with transaction.atomic(using=kwargs.get("using") or router.db_for_write(type(self))):
+            super().save(*args, **kwargs)
+            if adding:
+                MetricRollup.objects.add_metrics([self])
+                LatestMetric.objects.add_metrics([self])
 
 
 class ResourcesMetric(Metric):
     """Metric for system resources (memor, cpu usage)."""
 
     AVG_FIELDS = {"memory", "cpu"}
+    SKETCH_FIELDS = {"memory", "cpu"}
 
     memory = models.FloatField()
     cpu = models.FloatField(blank=True, null=True)
@@ -109,6 +341,7 @@ class RTTMetric(Metric):
     """Metric for round trip time, gathered during periodic pings."""
 
     AVG_FIELDS = {"rtt_min", "rtt_avg", "rtt_max"}
+    SKETCH_FIELDS = {"rtt_avg", "rtt_max"}
 
     rtt_min = models.FloatField(null=True, blank=True)
     rtt_avg = models.FloatField(null=True, blank=True)
@@ -134,6 +367,7 @@ class DataRateMetric(Metric):
     """Metric for a node's transfer/receive speed."""
 
     AVG_FIELDS = {"tx_rate", "rx_rate"}
+    LATEST_REQUIRED_FIELDS = {"tx_rate", "rx_rate"}
 
     tx_rate = models.IntegerField(null=True, blank=True)
     rx_rate = models.IntegerField(null=True, blank=True)
@@ -165,3 +399,300 @@ class FailuresMetric(Metric):
 
     def __str__(self):
         return f"Metric: Failures [{self.created}]"
+
+
+class MetricRollupQuerySet(models.QuerySet):
+    """Custom queryset for metric rollups."""
+
+    def add_metrics(self, metrics: Iterable[Metric]) -> None:
+        """Add raw metrics to the rollups of every granularity.
+
+        The metrics are first combined per rollup in memory, and then
+        upserted with a single statement.
+        """
+        mac_field = self.model._meta.get_field("mac")
+        states = {}
+        for metric in metrics:
+            # Aggregated metrics have already been added as raw metrics
+            if metric.granularity is not None:
+                continue
+            mac = mac_field.get_prep_value(metric.mac)
+            timestamp = int(metric.created.timestamp())
+            for fn in metric.rollup_fields():
+                value = getattr(metric, fn)
+                if value is None:
+                    continue
+                value = float(value)
+                for gran in Metric.GRANULARITY_ORDER:
+                    bucket = timestamp - timestamp % gran.value
+                    key = (metric._meta.model_name, fn, mac, gran.value, bucket)
+                    state = states.get(key)
+                    if state is None:
+                        states[key] = [1, value, value, value]
+                    else:
+                        state[0] += 1
+                        state[1] += value
+                        state[2] = min(state[2], value)
+                        state[3] = max(state[3], value)
+        if states:
+            self._upsert(states)
+
+    def _upsert(self, states: dict[tuple, list]) -> None:
+        """Insert rollup states, or merge them into existing ones."""
+        db = router.db_for_write(self.model)
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        columns = ["metric", "field", "mac", "granularity", "bucket", "count", "sum", "min", "max"]
+        if connection.vendor == "postgresql":
+            least, greatest = "LEAST", "GREATEST"
+        else:
+            least, greatest = "MIN", "MAX"
+        count, sum_, min_, max_ = (qn(c) for c in columns[-4:])
+        sql = (
+            f"INSERT INTO {table} ({', '.join(qn(c) for c in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON CONFLICT ({', '.join(qn(c) for c in UNIQUE_ROLLUP_FIELDS)}) DO UPDATE SET "
+            f"{count} = {table}.{count} + excluded.{count}, "
+            f"{sum_} = {table}.{sum_} + excluded.{sum_}, "
+            f"{min_} = {least}({table}.{min_}, excluded.{min_}), "
+            f"{max_} = {greatest}({table}.{max_}, excluded.{max_})"
+        )
+        bucket_field = self.model._meta.get_field("bucket")
+        params = [
+            (
+                metric,
+                field,
+                mac,
+                gran,
+                bucket_field.get_db_prep_value(
+                    datetime.fromtimestamp(bucket, tz=dt_timezone.utc), connection
+                ),
+                *state,
+            )
+            for (metric, field, mac, gran, bucket), state in states.items()
+        ]
+        with transaction.atomic(using=db), connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+
+    def to_metrics(self, metric_type: Type[Metric]) -> list[Metric]:
+        """Build (unsaved) aggregated metrics from rollups, one per mac & bucket."""
+        stats = defaultdict(dict)
+        for rollup in self.filter(metric=metric_type._meta.model_name).order_by("bucket"):
+            key = (rollup.mac, rollup.bucket, rollup.granularity)
+            stats[key][rollup.field] = rollup.field_stats()
+        return [
+            metric_type.from_stats(
+                field_stats,
+                mac=mac,
+                created=bucket + timedelta(seconds=granularity) / 2,
+                granularity=granularity,
+            )
+            for (mac, bucket, granularity), field_stats in stats.items()
+        ]
+
+
+UNIQUE_ROLLUP_FIELDS = ["metric", "granularity", "mac", "bucket", "field"]
+
+
+class MetricRollup(models.Model):
+    """Running aggregate of a metric field, per mac address & time bucket.
+
+    Rollups are updated as raw metrics are inserted, so that aggregated
+    series are available before the metrics themselves are aggregated.
+    """
+
+    class Meta:
+        """MetricRollup metadata."""
+
+        constraints = [
+            models.UniqueConstraint(fields=UNIQUE_ROLLUP_FIELDS, name="unique_metric_rollup")
+        ]
+
+    objects = MetricRollupQuerySet.as_manager()
+
+    metric = models.CharField(max_length=32, help_text="Model name of the metric type")
+    field = models.CharField(max_length=32, help_text="Name of the aggregated field")
+    mac = MACAddressField()
+    granularity = models.IntegerField(choices=Metric.Granularity)
+    bucket = models.DateTimeField(help_text="Start of the time bucket")
+    count = models.BigIntegerField(help_text="Number of (non-null) samples")
+    sum = models.FloatField()
+    min = models.FloatField()
+    max = models.FloatField()
+
+    def field_stats(self) -> FieldStats:
+        """Get the field stats of this rollup."""
+        return FieldStats(self.count, self.sum, self.min, self.max)
+
+    def __str__(self):
+        return f"Rollup: {self.metric}.{self.field} [{self.bucket}]"
+
+
+class MetricChunkQuerySet(models.QuerySet):
+    """Query set for chunks of packed raw metrics."""
+
+    def add_metrics(self, metric_type: Type[Metric], metrics: Iterable[Metric]) -> int:
+        """Pack raw metrics into their (mac, day) chunks, returns how many were packed.
+
+        Metrics are merged into the existing chunk for their mac & day, if any.
+        """
+        groups = defaultdict(list)
+        for metric in metrics:
+            day = metric.created.astimezone(dt_timezone.utc).date()
+            groups[(metric.mac, day)].append(metric)
+        if not groups:
+            return 0
+        name = metric_type._meta.model_name
+        existing = self.filter(
+            metric=name,
+            mac__in={mac for mac, _ in groups},
+            day__in={day for _, day in groups},
+        )
+        chunks = {(chunk.mac, chunk.day): chunk for chunk in existing}
+        new_chunks, updated_chunks = [], []
+        for (mac, day), group in groups.items():
+            chunk = chunks.get((mac, day))
+            if chunk is None:
+                chunk = MetricChunk(metric=name, mac=mac, day=day)
+                new_chunks.append(chunk)
+            else:
+                group = chunk.to_metrics(metric_type) + group
+                updated_chunks.append(chunk)
+            group.sort(key=lambda m: m.created)
+            chunk.count = len(group)
+            chunk.data = encode_chunk(metric_type, group)
+        self.bulk_create(new_chunks)
+        self.bulk_update(updated_chunks, ["count", "data"])
+        return sum(len(group) for group in groups.values())
+
+    def to_metrics(self, metric_type: Type[Metric]) -> list[Metric]:
+        """Unpack chunks into (unsaved) raw metrics, ordered by mac & time."""
+        chunks = self.filter(metric=metric_type._meta.model_name).order_by("mac", "day")
+        return [metric for chunk in chunks for metric in chunk.to_metrics(metric_type)]
+
+
+class MetricChunk(models.Model):
+    """Raw metrics of a mac address for a day, packed into a compressed blob.
+
+    See metrics.chunks for the encoding.
+    """
+
+    class Meta:
+        """MetricChunk metadata."""
+
+        constraints = [
+            models.UniqueConstraint(fields=["metric", "mac", "day"], name="unique_metric_chunk")
+        ]
+
+    objects = MetricChunkQuerySet.as_manager()
+
+    metric = models.CharField(max_length=32, help_text="Model name of the metric type")
+    mac = MACAddressField()
+    day = models.DateField(help_text="UTC day of the metrics")
+    count = models.PositiveIntegerField(help_text="Number of metrics in the chunk")
+    data = models.BinaryField()
+
+    def to_metrics(self, metric_type: Type[Metric]) -> list[Metric]:
+        """Unpack the metrics in this chunk."""
+        return decode_chunk(metric_type, self.data, self.mac)
+
+    def __str__(self):
+        return f"Chunk: {self.metric} [{self.day}]"
+
+
+class LatestMetricQuerySet(models.QuerySet):
+    """Query set for the latest metrics of each mac address."""
+
+    def add_metrics(self, metrics: Iterable[Metric]) -> None:
+        """Keep the newest of the given raw metrics, if newer than the stored ones."""
+        mac_field = self.model._meta.get_field("mac")
+        latest = {}
+        for metric in metrics:
+            if metric.granularity is not None:
+                continue
+            values = {fn: getattr(metric, fn) for fn in sorted(metric.rollup_fields())}
+            if any(values[fn] is None for fn in metric.LATEST_REQUIRED_FIELDS):
+                continue
+            key = (metric._meta.model_name, mac_field.get_prep_value(metric.mac))
+            if key not in latest or metric.created > latest[key][0]:
+                latest[key] = (metric.created, values)
+        if latest:
+            self._upsert(latest)
+
+    def _upsert(self, latest: dict[tuple, tuple]) -> None:
+        """Insert latest metrics, or replace older ones."""
+        db = router.db_for_write(self.model)
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        columns = ["metric", "mac", "created", "values"]
+        created, values = qn("created"), qn("values")
+        sql = (
+            f"INSERT INTO {table} ({', '.join(qn(c) for c in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON CONFLICT ({qn('metric')}, {qn('mac')}) DO UPDATE SET "
+            f"{created} = excluded.{created}, {values} = excluded.{values} "
+            f"WHERE excluded.{created} > {table}.{created}"
+        )
+        created_field = self.model._meta.get_field("created")
+        values_field = self.model._meta.get_field("values")
+        params = [
+            (
+                metric,
+                mac,
+                created_field.get_db_prep_value(created, connection),
+                values_field.get_db_prep_value(values, connection),
+            )
+            for (metric, mac), (created, values) in latest.items()
+        ]
+        with transaction.atomic(using=db), connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+
+    def latest_metrics(self, macs, metric_types: Iterable[Type[Metric]]) -> dict[Type[Metric], dict]:
+        """Get the latest metric of each type for each of the given MAC addresses in a single query.
+
+        :return: The (unsaved) latest metrics as {metric type: {mac: metric}}
+        """
+        metric_types = {metric_type._meta.model_name: metric_type for metric_type in metric_types}
+        result = {metric_type: {} for metric_type in metric_types.values()}
+        for latest in self.filter(metric__in=metric_types, mac__in=macs):
+            metric_type = metric_types[latest.metric]
+            result[metric_type][latest.mac] = latest.to_metric(metric_type)
+        return result
+
+
+class LatestMetric(models.Model):
+    """Latest raw metric of a type for a mac address.
+
+    Kept up to date as metrics are inserted, so that the latest metrics of
+    nodes can be looked up by key instead of searching the metric tables.
+    """
+
+    class Meta:
+        """LatestMetric metadata."""
+
+        constraints = [
+            models.UniqueConstraint(fields=["metric", "mac"], name="unique_latest_metric")
+        ]
+
+    objects = LatestMetricQuerySet.as_manager()
+
+    metric = models.CharField(max_length=32, help_text="Model name of the metric type")
+    mac = MACAddressField()
+    created = models.DateTimeField(help_text="The date & time of the metric")
+    values = models.JSONField(help_text="The aggregated fields of the metric")
+
+    def to_metric(self, metric_type: Type[Metric]) -> Metric:
+        """Build the (unsaved) metric."""
+        return metric_type(
+            mac=self.mac,
+            created=self.created,
+            **{
+                fn: metric_type._meta.get_field(fn).to_python(value)
+                for fn, value in self.values.items()
+            },
+        )
+
+    def __str__(self):
+        return f"Latest: {self.metric} [{self.created}]"
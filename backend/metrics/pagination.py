@@ -0,0 +1,93 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class MetricsPagination(BasePagination):
+    """Keyset pagination of metrics, ordered by (created, id).
+
+    Each page seeks past the last (created, id) of the previous page instead
+    of counting past an offset, so a series filtered by mac (and granularity)
+    is read from the metric indexes no matter how deep the page is. Pages
+    don't skip or repeat metrics that share a creation time.
+    """
+
+    page_size = 1000
+    page_size_query_param = "page_size"
+    max_page_size = 10000
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request) -> int:
+        """Get the requested page size, bounded by max_page_size."""
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request) -> tuple | None:
+        """Get the (created, id) of the last metric of the previous page."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            created, pk = urlsafe_b64decode(encoded.encode()).decode().rsplit("|", 1)
+            created = parse_datetime(created)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created, pk
+
+    def encode_cursor(self, created: str, pk: int) -> str:
+        """Encode the (created, id) of the last metric of a page."""
+        return urlsafe_b64encode(f"{created}|{pk}".encode()).decode()
+
+    def get_page_queryset(self, queryset, request):
+        """Get the metrics of the requested page, plus one to tell if there's a next page."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        qs = queryset.order_by("created", "id")
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            created, pk = cursor
+            qs = qs.filter(Q(created__gt=created) | Q(created=created, id__gt=pk))
+        return qs[:self.page_size + 1]
+
+    def set_next(self, keys: list[tuple[str, int]]) -> None:
+        """Set the cursor of the next page from the (created, id) of the fetched metrics."""
+        self.next_key = keys[self.page_size - 1] if len(keys) > self.page_size else None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Get the metrics of the requested page."""
+        page = list(self.get_page_queryset(queryset, request))
+        self.set_next([(metric.created.isoformat(), metric.pk) for metric in page])
+        return page[:self.page_size]
+
+    def get_next_link(self) -> str | None:
+        """Get the link to the next page, None if this is the last page."""
+        if self.next_key is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(*self.next_key))
+
+    def get_paginated_response(self, data):
+        """Wrap a page of serialized metrics with the link to the next page."""
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
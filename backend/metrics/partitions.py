@@ -0,0 +1,179 @@
+"""Monthly partitions of packed raw metrics.
+
+The chunks (see metrics.chunks) of closed months are moved out of the metrics
+database, into one SQLite file per metric type and month. Reads only open the
+partitions of the months they overlap, and expired months are dropped by
+unlinking their file, instead of deleting their rows from the metrics database.
+"""
+
+from contextlib import closing
+from datetime import date, timedelta
+from functools import reduce
+from operator import or_
+from pathlib import Path
+import re
+import sqlite3
+from typing import Type
+
+from django.conf import settings
+from django.db.models import Q
+
+from .chunks import decode_chunk, encode_chunk
+from .models import Metric, MetricChunk
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunk (
+    mac INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (mac, day)
+) WITHOUT ROWID
+"""
+# Archived chunks are deleted in batches, to stay below SQLite's limit on query parameters
+DELETE_BATCH_SIZE = 250
+FILENAME = re.compile(r"(\w+)-(\d{4})-(\d{2})\.sqlite3")
+
+
+def next_month(month: date) -> date:
+    """Get the first day of the month after the given one."""
+    return (month.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def partition_path(metric_type: Type[Metric], month: date) -> Path:
+    """Get the file of a metric type's partition for a month."""
+    return Path(settings.METRICS_PARTITION_DIR) / f"{metric_type._meta.model_name}-{month:%Y-%m}.sqlite3"
+
+
+def partitions(
+    metric_type: Type[Metric],
+    min_day: date | None = None,
+    max_day: date | None = None,
+) -> list[date]:
+    """Get the (first days of the) months with a partition of a metric type, that overlap the given days."""
+    directory = Path(settings.METRICS_PARTITION_DIR)
+    if not directory.is_dir():
+        return []
+    months = []
+    for path in directory.iterdir():
+        match = FILENAME.fullmatch(path.name)
+        if match is None or match.group(1) != metric_type._meta.model_name:
+            continue
+        month = date(int(match.group(2)), int(match.group(3)), 1)
+        if min_day is not None and next_month(month) <= min_day:
+            continue
+        if max_day is not None and month > max_day:
+            continue
+        months.append(month)
+    return sorted(months)
+
+
+def merge_chunk(metric_type: Type[Metric], mac, old: bytes, new: bytes) -> tuple[int, bytes]:
+    """Merge two chunks of the same mac & day, returns the merged count & data."""
+    metrics = {m.created: m for m in decode_chunk(metric_type, old, mac)}
+    metrics.update((m.created, m) for m in decode_chunk(metric_type, new, mac))
+    merged = sorted(metrics.values(), key=lambda m: m.created)
+    return len(merged), encode_chunk(metric_type, merged)
+
+
+def archive_month(metric_type: Type[Metric], month: date) -> int:
+    """Move the chunks of a metric type for a month from the metrics database into its partition.
+
+    Chunks that are already in the partition are merged, so archiving a month
+    again (e.g. after a failure) doesn't duplicate metrics. Returns the number
+    of archived chunks.
+    """
+    chunks = MetricChunk.objects.filter(
+        metric=metric_type._meta.model_name, day__gte=month, day__lt=next_month(month)
+    )
+    mac_field = MetricChunk._meta.get_field("mac")
+    path = partition_path(metric_type, month)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    archived = []
+    with closing(sqlite3.connect(path)) as connection, connection:
+        connection.execute(SCHEMA)
+        for chunk in chunks.order_by("mac", "day").iterator():
+            key = (mac_field.get_prep_value(chunk.mac), chunk.day.isoformat())
+            count, data = chunk.count, bytes(chunk.data)
+            existing = connection.execute(
+                "SELECT data FROM chunk WHERE mac = ? AND day = ?", key
+            ).fetchone()
+            if existing is not None:
+                count, data = merge_chunk(metric_type, chunk.mac, existing[0], data)
+            connection.execute("INSERT OR REPLACE INTO chunk VALUES (?, ?, ?, ?)", (*key, count, data))
+            archived.append(Q(pk=chunk.pk, count=chunk.count))
+    # Only deleted once the partition has been committed. Chunks that were
+    # written or merged into in the meantime are left for the next run.
+    for i in range(0, len(archived), DELETE_BATCH_SIZE):
+        MetricChunk.objects.filter(reduce(or_, archived[i:i + DELETE_BATCH_SIZE])).delete()
+    return len(archived)
+
+
+def archive_closed_months(today: date) -> int:
+    """Archive the chunks of every metric type for each month before the current one.
+
+    Returns the number of archived chunks.
+    """
+    archived = 0
+    for metric_type in Metric.__subclasses__():
+        closed = MetricChunk.objects.filter(
+            metric=metric_type._meta.model_name, day__lt=today.replace(day=1)
+        )
+        for month in closed.dates("day", "month"):
+            archived += archive_month(metric_type, month)
+    return archived
+
+
+def read_chunks(
+    metric_type: Type[Metric],
+    mac=None,
+    min_day: date | None = None,
+    max_day: date | None = None,
+) -> list[MetricChunk]:
+    """Get the (unsaved) chunks of a metric type from the partitions that overlap the given days."""
+    mac_field = MetricChunk._meta.get_field("mac")
+    name = metric_type._meta.model_name
+    conditions, params = [], []
+    if mac is not None:
+        conditions.append("mac = ?")
+        params.append(mac_field.get_prep_value(mac_field.to_python(mac)))
+    if min_day is not None:
+        conditions.append("day >= ?")
+        params.append(min_day.isoformat())
+    if max_day is not None:
+        conditions.append("day <= ?")
+        params.append(max_day.isoformat())
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"SELECT mac, day, count, data FROM chunk {where} ORDER BY mac, day"
+    chunks = []
+    for month in partitions(metric_type, min_day, max_day):
+        uri = f"{partition_path(metric_type, month).resolve().as_uri()}?mode=ro"
+        with closing(sqlite3.connect(uri, uri=True)) as connection:
+            chunks.extend(
+                MetricChunk(
+                    metric=name,
+                    mac=mac_field.to_python(mac),
+                    day=date.fromisoformat(day),
+                    count=count,
+                    data=data,
+                )
+                for mac, day, count, data in connection.execute(sql, params)
+            )
+    return chunks
+
+
+def drop_partitions(metric_type: Type[Metric], before: date) -> int:
+    """Unlink a metric type's partitions of months that ended before the given day.
+
+    Returns the number of dropped chunks.
+    """
+    dropped = 0
+    for month in partitions(metric_type, max_day=before - timedelta(days=1)):
+        if next_month(month) > before:
+            continue
+        path = partition_path(metric_type, month)
+        with closing(sqlite3.connect(path)) as connection:
+            (count,) = connection.execute("SELECT COUNT(*) FROM chunk").fetchone()
+        path.unlink()
+        dropped += count
+    return dropped
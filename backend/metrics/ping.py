@@ -1,24 +1,40 @@
 import subprocess
+from typing import Iterable
 
+from django.conf import settings
 
-def ping(ip: str,
-         count: int = 5,
-         interval: int = 25,
-         nbytes: int = 56,
-         timeout: int = 800) -> dict:
-    command = [
-        "/bin/fping",
+from . import probe
+
+FPING = "/bin/fping"
+
+# Maximum number of targets passed to a single fping process
+BATCH_CHUNK_SIZE = 1000
+
+
+def fping_command(targets: list[str],
+                  count: int = 5,
+                  interval: int = 25,
+                  nbytes: int = 56,
+                  timeout: int = 800) -> list[str]:
+    """Build an fping command that pings each target and prints a summary."""
+    return [
+        FPING,
         "-e",  # show elapsed (round-trip) time of packets
         "-c %s" % count,  # count of pings to send to each target,
         "-p %s" % interval,  # interval between sending pings(in ms)
         "-b %s" % nbytes,  # amount of ping data to send
         "-t %s" % timeout,  # individual target initial timeout (in ms)
         "-q",
-        ip,
+        *targets,
     ]
-    p = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    # fpings shows statistics on stderr
-    output = p.stderr.decode("utf-8")
+
+
+def parse_fping_stats(output: str) -> dict:
+    """Parse the statistics part of an fping summary.
+
+    The statistics look like 'xmt/rcv/%loss = 5/5/0%, min/avg/max = 0.1/0.2/0.3',
+    the min/avg/max part is missing if no replies were received.
+    """
     try:
         parts = output.split("=")
         if len(parts) > 2:
@@ -35,3 +51,68 @@ def ping(ip: str,
     if result["reachable"]:
         result["rtt"] = {"rtt_min": float(min), "rtt_avg": float(avg), "rtt_max": float(max)}
     return result
+
+
+def parse_fping_summary(output: str) -> dict[str, dict]:
+    """Parse the per-target '-q' summary lines of a multi-target fping run.
+
+    Lines that aren't summaries (e.g. ICMP errors) are ignored.
+    """
+    results = {}
+    for line in output.splitlines():
+        target, sep, stats = line.partition(" : ")
+        if not sep or "xmt/rcv/%loss" not in stats:
+            continue
+        try:
+            results[target.strip()] = parse_fping_stats(stats)
+        except ValueError:
+            continue
+    return results
+
+
+def ping(ip: str,
+         count: int = 5,
+         interval: int = 25,
+         nbytes: int = 56,
+         timeout: int = 800) -> dict:
+    command = fping_command([ip], count, interval, nbytes, timeout)
+    p = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # fpings shows statistics on stderr
+    output = p.stderr.decode("utf-8")
+    return parse_fping_stats(output)
+
+
+def ping_many(ips: Iterable[str],
+              count: int = 5,
+              interval: int = 25,
+              nbytes: int = 56,
+              timeout: int = 800,
+              chunk_size: int = BATCH_CHUNK_SIZE) -> dict[str, dict]:
+    """Ping many targets at once, with one fping process per chunk of targets.
+
+    The chunks are pinged concurrently. Returns a dict keyed by IP with the same
+    results :func:`ping` would return for that IP. Targets that fping doesn't
+    report on (e.g. unresolvable hosts) are left out of the results.
+    """
+    targets = list(dict.fromkeys(ips))
+    processes = []
+    for i in range(0, len(targets), chunk_size):
+        command = fping_command(targets[i:i + chunk_size], count, interval, nbytes, timeout)
+        processes.append(
+            subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        )
+    results = {}
+    for p in processes:
+        _, stderr = p.communicate()
+        # fpings shows statistics on stderr
+        results.update(parse_fping_summary(stderr.decode("utf-8")))
+    return results
+
+
+def ping_all(ips: Iterable[str]) -> dict[str, dict]:
+    """Ping many targets with the backend configured by settings.PING_BACKEND."""
+    if settings.PING_BACKEND == "asyncio":
+        return probe.ping_many(ips, concurrency=settings.PING_CONCURRENCY)
+    if settings.PING_BACKEND == "fping":
+        return ping_many(ips)
+    raise ValueError(f"Unknown ping backend '{settings.PING_BACKEND}'")
@@ -0,0 +1,149 @@
+"""Asyncio ICMP prober, an alternative to running fping in a subprocess.
+
+Probes are sent from unprivileged ICMP sockets (``SOCK_DGRAM``/``IPPROTO_ICMP``),
+so the process needs to be in ``net.ipv4.ping_group_range`` but doesn't need
+raw socket privileges. Results have the same shape as :func:`metrics.ping.ping`.
+"""
+
+import asyncio
+import os
+import socket
+import struct
+import time
+from typing import Iterable, Protocol
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+# Maximum number of hosts probed at the same time
+DEFAULT_CONCURRENCY = 256
+
+
+class ProbeTransport(Protocol):
+    """Sends a single probe to a host."""
+
+    async def probe(self, ip: str, seq: int, nbytes: int, timeout: float) -> float | None:
+        """Send a probe, returns the round trip time in ms or None if it was lost."""
+
+
+def icmp_checksum(data: bytes) -> int:
+    """Internet checksum (RFC 1071) of an ICMP packet."""
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def echo_request(ident: int, seq: int, nbytes: int) -> bytes:
+    """Build an ICMP echo request packet."""
+    payload = os.urandom(nbytes)
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    checksum = icmp_checksum(header + payload)
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum, ident, seq)
+    return header + payload
+
+
+class IcmpTransport:
+    """Send ICMP echo requests from unprivileged datagram sockets."""
+
+    async def probe(self, ip: str, seq: int, nbytes: int, timeout: float) -> float | None:
+        """Send an echo request and wait for its reply."""
+        loop = asyncio.get_running_loop()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP) as sock:
+            sock.setblocking(False)
+            # The kernel only delivers replies from the connected address
+            # and rewrites the identifier, so we only need to match seq
+            await loop.sock_connect(sock, (ip, 0))
+            start = time.perf_counter()
+            await loop.sock_sendall(sock, echo_request(0, seq, nbytes))
+            try:
+                await asyncio.wait_for(self.wait_for_reply(sock, seq), timeout)
+            except asyncio.TimeoutError:
+                return None
+            return (time.perf_counter() - start) * 1000
+
+    async def wait_for_reply(self, sock: socket.socket, seq: int) -> None:
+        """Wait for the echo reply with a matching sequence number."""
+        loop = asyncio.get_running_loop()
+        while True:
+            reply = await loop.sock_recv(sock, 2048)
+            msg_type, _, _, _, reply_seq = struct.unpack("!BBHHH", reply[:8])
+            if msg_type == ICMP_ECHO_REPLY and reply_seq == seq:
+                return
+
+
+def summarize(rtts: list[float | None]) -> dict:
+    """Summarize probe round trip times in the same format as fping results."""
+    received = [rtt for rtt in rtts if rtt is not None]
+    loss = float(round((len(rtts) - len(received)) / len(rtts) * 100))
+    result = {"reachable": int(loss < 100), "loss": loss}
+    if result["reachable"]:
+        result["rtt"] = {
+            "rtt_min": round(min(received), 2),
+            "rtt_avg": round(sum(received) / len(received), 2),
+            "rtt_max": round(max(received), 2),
+        }
+    return result
+
+
+class AsyncProber:
+    """Probe many hosts concurrently, bounded by a semaphore."""
+
+    def __init__(self,
+                 transport: ProbeTransport | None = None,
+                 count: int = 5,
+                 interval: int = 25,
+                 nbytes: int = 56,
+                 timeout: int = 800,
+                 concurrency: int = DEFAULT_CONCURRENCY):
+        self.transport = transport or IcmpTransport()
+        self.count = count
+        self.interval = interval
+        self.nbytes = nbytes
+        self.timeout = timeout
+        self.concurrency = concurrency
+
+    async def probe_host(self, ip: str, semaphore: asyncio.Semaphore) -> dict:
+        """Send `count` probes to a single host, `interval` ms apart."""
+        rtts = []
+        async with semaphore:
+            for seq in range(self.count):
+                if seq:
+                    await asyncio.sleep(self.interval / 1000)
+                try:
+                    rtt = await self.transport.probe(ip, seq, self.nbytes, self.timeout / 1000)
+                except PermissionError:
+                    # Not allowed to open ICMP sockets (see net.ipv4.ping_group_range),
+                    # don't report the whole fleet as unreachable
+                    raise
+                except OSError:
+                    # E.g. network unreachable, count it as a lost probe
+                    rtt = None
+                rtts.append(rtt)
+        return summarize(rtts)
+
+    async def probe_all(self, ips: Iterable[str]) -> dict[str, dict]:
+        """Probe all hosts, returns a dict of results keyed by IP."""
+        targets = list(dict.fromkeys(ips))
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(self.probe_host(ip, semaphore) for ip in targets))
+        return dict(zip(targets, results))
+
+    def ping_many(self, ips: Iterable[str]) -> dict[str, dict]:
+        """Synchronous entrypoint to :meth:`probe_all`."""
+        return asyncio.run(self.probe_all(ips))
+
+
+def ping_many(ips: Iterable[str],
+              count: int = 5,
+              interval: int = 25,
+              nbytes: int = 56,
+              timeout: int = 800,
+              concurrency: int = DEFAULT_CONCURRENCY) -> dict[str, dict]:
+    """Ping many targets with the asyncio prober, same interface as :func:`metrics.ping.ping_many`."""
+    prober = AsyncProber(
+        count=count, interval=interval, nbytes=nbytes, timeout=timeout, concurrency=concurrency
+    )
+    return prober.ping_many(ips)
@@ -0,0 +1,10 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class ColumnarRenderer(JSONRenderer):
+    """Renders metrics as columns of values, requested with '?format=columnar'.
+
+    The columns themselves are built by metrics.views.ColumnarMixin.
+    """
+
+    format = "columnar"
@@ -1,9 +1,65 @@
+from itertools import islice
+
+from django.db.models import BigIntegerField
+from django.db.models.functions import Cast
+from django.utils import timezone
 from rest_framework.serializers import ModelSerializer, PrimaryKeyRelatedField, SerializerMethodField
 
 from . import models
 
 
-class UptimeMetricSerializer(ModelSerializer):
+class ColumnarMixin:
+    """Serialize metrics into columns of values, straight from database rows."""
+
+    @classmethod
+    def column_fields(cls, qs) -> list[str]:
+        """Get the fields that are read from the database."""
+        return ["id", "created", "mac", "granularity", "sample_count", *sorted(qs.model.rollup_fields())]
+
+    @classmethod
+    def columns(cls, qs) -> dict[str, list]:
+        """Get a column of values for each field of the metrics in a query set."""
+        return next(cls.iter_columns(qs, chunk_size=None))
+
+    @classmethod
+    def iter_columns(cls, qs, chunk_size: int | None):
+        """Yield columns for consecutive chunks of `chunk_size` metrics.
+
+        Rows are streamed from the database, so only a chunk of metrics is
+        in memory at a time. With a chunk_size of None all metrics are read
+        in a single chunk.
+        """
+        fields = cls.column_fields(qs)
+        # Read mac addresses as integers, the model field would create an EUI per row
+        values = qs.annotate(mac_value=Cast("mac", BigIntegerField())).values_list(
+            *["mac_value" if fn == "mac" else fn for fn in fields]
+        )
+        rows = iter(values) if chunk_size is None else values.iterator(chunk_size=chunk_size)
+        mac_field = qs.model._meta.get_field("mac")
+        macs = {}
+        # Same as DateTimeField().to_representation(), with the timezone looked up once
+        tz = timezone.get_current_timezone()
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            columns = dict(zip(fields, map(list, zip(*chunk)))) if chunk else {fn: [] for fn in fields}
+            for value in set(columns["mac"]) - macs.keys():
+                macs[value] = str(mac_field.to_python(value))
+            columns["mac"] = [macs[value] for value in columns["mac"]]
+            columns["created"] = [
+                value.astimezone(tz).isoformat().replace("+00:00", "Z") for value in columns["created"]
+            ]
+            columns.update(cls.derived_columns(columns))
+            yield columns
+            if chunk_size is None or len(chunk) < chunk_size:
+                return
+
+    @classmethod
+    def derived_columns(cls, columns: dict[str, list]) -> dict[str, list]:
+        """Compute the columns of method fields from the other columns."""
+        return {}
+
+
+class UptimeMetricSerializer(ColumnarMixin, ModelSerializer):
     """Serializes UptimeMetric objects from django model to JSON."""
 
     node = PrimaryKeyRelatedField(read_only=True)
@@ -12,17 +68,17 @@ class UptimeMetricSerializer(ModelSerializer):
         """UptimeMetricSerializer metadata."""
 
         model = models.UptimeMetric
-        fields = "__all__"
+        exclude = ["sketches"]
 
 
-class FailuresMetricSerializer(ModelSerializer):
+class FailuresMetricSerializer(ColumnarMixin, ModelSerializer):
     """Serializes FailuresMetric objects from django model to JSON."""
 
     class Meta:
         """FailuresMetricSerializer metadata."""
 
         model = models.FailuresMetric
-        fields = "__all__"
+        exclude = ["sketches"]
 
     tx_retries_perc = SerializerMethodField()
 
@@ -30,44 +86,68 @@ class FailuresMetricSerializer(ModelSerializer):
         """Get tx_retries as a percentage."""
         if obj.tx_packets == 0:
             return 0
+        if obj.tx_retries is None:
+            return None
         return round(obj.tx_retries / obj.tx_packets * 100)
 
+    @classmethod
+    def derived_columns(cls, columns: dict[str, list]) -> dict[str, list]:
+        """Compute tx_retries_perc for a whole column at once."""
+        return {
+            "tx_retries_perc": [
+                0 if packets == 0 else None if retries is None else round(retries / packets * 100)
+                for retries, packets in zip(columns["tx_retries"], columns["tx_packets"])
+            ]
+        }
+
 
-class ResourcesMetricSerializer(ModelSerializer):
+class ResourcesMetricSerializer(ColumnarMixin, ModelSerializer):
     """Serializes ResourcesMetric objects from django model to JSON."""
 
     class Meta:
         """ResourcesMetricSerializer metadata."""
 
         model = models.ResourcesMetric
-        fields = "__all__"
+        exclude = ["sketches"]
+
+    quantiles = SerializerMethodField()
 
+    def get_quantiles(self, obj: models.ResourcesMetric):
+        """Get quantiles of aggregated metrics, from their sketches."""
+        return obj.quantiles()
 
-class RTTMetricSerializer(ModelSerializer):
+
+class RTTMetricSerializer(ColumnarMixin, ModelSerializer):
     """Serializes RTTMetric objects from django model to JSON."""
 
     class Meta:
         """RTTMetricSerializer metadata."""
 
         model = models.RTTMetric
-        fields = "__all__"
+        exclude = ["sketches"]
+
+    quantiles = SerializerMethodField()
+
+    def get_quantiles(self, obj: models.RTTMetric):
+        """Get quantiles of aggregated metrics, from their sketches."""
+        return obj.quantiles()
 
 
-class DataUsageMetricSerializer(ModelSerializer):
+class DataUsageMetricSerializer(ColumnarMixin, ModelSerializer):
     """Serializes DataUsageMetric objects from django model to JSON."""
 
     class Meta:
         """DataUsageMetricSerializer metadata."""
 
         model = models.DataUsageMetric
-        fields = "__all__"
+        exclude = ["sketches"]
 
 
-class DataRateMetricSerializer(ModelSerializer):
+class DataRateMetricSerializer(ColumnarMixin, ModelSerializer):
     """Serializes DataRateMetric objects from django model to JSON."""
 
     class Meta:
         """DataRateMetricSerializer metadata."""
 
         model = models.DataRateMetric
-        fields = "__all__"
+        exclude = ["sketches"]
@@ -0,0 +1,130 @@
+"""Mergeable quantile sketches for aggregated metrics.
+
+Implements DDSketch (https://arxiv.org/abs/1908.10693): values are counted
+in logarithmically sized bins, so that every quantile estimate is within a
+relative error of the true value, and sketches of different sets of samples
+can be merged by adding up their bins.
+"""
+
+import math
+import struct
+
+# Quantile estimates are within 1% of the true value
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+# Bound on the number of bins, the lowest bins are collapsed beyond this
+DEFAULT_MAX_BINS = 1024
+
+# Values at or below this are counted as zeros
+MIN_VALUE = 1e-9
+
+HEADER = struct.Struct("<dII")
+
+
+class DDSketch:
+    """Quantile sketch with relative accuracy guarantees."""
+
+    def __init__(self,
+                 relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+                 max_bins: int = DEFAULT_MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins: dict[int, int] = {}
+        self.zero_count = 0
+
+    @property
+    def count(self) -> int:
+        """The number of values added to the sketch."""
+        return self.zero_count + sum(self.bins.values())
+
+    def add(self, value: float, count: int = 1) -> None:
+        """Add a value (`count` times) to the sketch."""
+        if value <= MIN_VALUE:
+            self.zero_count += count
+            return
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > self.max_bins:
+            self.collapse()
+
+    def merge(self, other: "DDSketch") -> None:
+        """Merge another sketch into this one."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can't merge sketches with a different relative accuracy")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.collapse()
+
+    def collapse(self) -> None:
+        """Collapse the lowest bins so there are at most `max_bins` bins."""
+        excess = len(self.bins) - self.max_bins
+        if excess <= 0:
+            return
+        keys = sorted(self.bins)
+        self.bins[keys[excess]] += sum(self.bins.pop(key) for key in keys[:excess])
+
+    def quantile(self, q: float) -> float | None:
+        """Estimate the q-quantile of the added values, None if the sketch is empty."""
+        count = self.count
+        if not count:
+            return None
+        rank = q * (count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        total = self.zero_count
+        for key in sorted(self.bins):
+            total += self.bins[key]
+            if total > rank:
+                return 2 * self.gamma**key / (self.gamma + 1)
+        return 2 * self.gamma**max(self.bins) / (self.gamma + 1)
+
+    def to_bytes(self) -> bytes:
+        """Serialize the sketch."""
+        keys = sorted(self.bins)
+        n = len(keys)
+        return (
+            HEADER.pack(self.relative_accuracy, self.zero_count, n)
+            + struct.pack(f"<{n}i", *keys)
+            + struct.pack(f"<{n}I", *(self.bins[key] for key in keys))
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes, max_bins: int = DEFAULT_MAX_BINS) -> "DDSketch":
+        """Deserialize a sketch created with :meth:`to_bytes`."""
+        relative_accuracy, zero_count, n = HEADER.unpack_from(data)
+        keys = struct.unpack_from(f"<{n}i", data, HEADER.size)
+        counts = struct.unpack_from(f"<{n}I", data, HEADER.size + 4 * n)
+        sketch = cls(relative_accuracy, max_bins)
+        sketch.zero_count = zero_count
+        sketch.bins = dict(zip(keys, counts))
+        return sketch
+
+
+def encode_sketches(sketches: dict[str, DDSketch]) -> bytes:
+    """Serialize the sketches of several fields into a single blob."""
+    data = bytearray()
+    for fn, sketch in sorted(sketches.items()):
+        name = fn.encode()
+        blob = sketch.to_bytes()
+        data += struct.pack("<B", len(name)) + name + struct.pack("<I", len(blob)) + blob
+    return bytes(data)
+
+
+def decode_sketches(data: bytes) -> dict[str, DDSketch]:
+    """Deserialize a blob created with :func:`encode_sketches`."""
+    data = bytes(data)
+    sketches = {}
+    offset = 0
+    while offset < len(data):
+        (name_length,) = struct.unpack_from("<B", data, offset)
+        offset += 1
+        fn = data[offset:offset + name_length].decode()
+        offset += name_length
+        (blob_length,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        sketches[fn] = DDSketch.from_bytes(data[offset:offset + blob_length])
+        offset += blob_length
+    return sketches
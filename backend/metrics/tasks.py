@@ -1,26 +1,50 @@
-from datetime import datetime, timedelta
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
 import time
 from typing import Type
-from celery import shared_task
+from celery import chord, group, shared_task
+from celery.signals import worker_process_init, worker_process_shutdown
 from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Q
 from django.utils import timezone
 
 from monitoring.models import Node
-from sync.tasks import sync_all_devices
-from .models import UptimeMetric, RTTMetric, Metric
-from .ping import ping
+from sync.tasks import generate_alerts, sync_all_devices
+from .buffer import BufferFull, get_buffer
+from .models import UptimeMetric, RTTMetric, Metric, MetricChunk, MetricRollup
+from . import partitions
+from .ping import ping_all
+from .sketch import encode_sketches
 
 logger = get_task_logger(__name__)
 
 
-@shared_task
-def run_pings():
-    for device in Node.objects.filter(ip__isnull=False):
-        try:
-            ping_data = ping(device.ip)
-            reachable = ping_data["reachable"]
-        except ValueError:
-            reachable = False
+@worker_process_init.connect
+def start_metric_buffer(**kwargs) -> None:
+    """Flush buffered metrics in the background in each worker process."""
+    get_buffer().start()
+
+
+@worker_process_shutdown.connect
+def flush_metric_buffer(**kwargs) -> None:
+    """Write the remaining buffered metrics when a worker process stops."""
+    get_buffer().stop()
+
+
+def save_ping_results(devices: list[Node], results: dict[str, dict]) -> None:
+    """Save ping results for many devices with a handful of bulk queries.
+
+    Creates uptime & RTT metrics for each device, and updates each device's
+    reachable, last ping, status and health status.
+    """
+    now = timezone.now()
+    uptime_metrics, rtt_metrics = [], []
+    for device in devices:
+        # Devices that fping doesn't report on are treated as unreachable
+        ping_data = results.get(device.ip, {"reachable": 0, "loss": 100.0})
+        reachable = ping_data["reachable"]
         # If the ping failed the device is offline
         if not reachable:
             # If the ping fails while the device is rebooting there
@@ -31,62 +55,118 @@ def run_pings():
             # Otherwise log the time of the last successful ping. Not that a
             # successful ping is not a guarantee that the node is online, it
             # has to send the server a report first.
-            device.last_ping = timezone.now()
+            device.last_ping = now
         # Update the device reachable status
         device.reachable = reachable
         rtt_data = ping_data.pop("rtt", None)
-        UptimeMetric.objects.create(mac=device.mac, **ping_data)
+        uptime_metrics.append(UptimeMetric(mac=device.mac, created=now, **ping_data))
         if rtt_data:
-            RTTMetric.objects.create(mac=device.mac, **rtt_data)
-        # Update the device health status
-        device.update_health_status(save=False)
-        device.save(update_fields=["reachable", "last_ping", "status", "health_status"])
-        # Optionally generate alerts for this device based on the new status
-        device.generate_alert()
+            rtt_metrics.append(RTTMetric(mac=device.mac, created=now, **rtt_data))
         logger.info(f"PING {device.ip} (reachable={reachable})")
+    # Flush right away, the new RTT metrics are needed for the health statuses.
+    # If the database is locked they stay buffered for the background thread,
+    # and the statuses are checked against the previous metrics.
+    buffer = get_buffer()
+    try:
+        buffer.add(uptime_metrics + rtt_metrics)
+    except BufferFull:
+        # Statuses are still worth saving, even without their metrics
+        logger.warning("Dropped %d ping metrics, the buffer is full", len(uptime_metrics + rtt_metrics))
+    else:
+        buffer.flush(requeue=True)
+    # Update the device health statuses, the new RTT metrics will be picked up here
+    for device in Node.run_all_checks(devices):
+        device.update_health_status(save=False)
+    Node.objects.bulk_update(devices, ["reachable", "last_ping", "status", "health_status"])
+
+
+def ping_shards(shard_size: int) -> list[list[str]]:
+    """Partition the MACs of pingable devices by mesh, in shards of at most shard_size."""
+    meshes = defaultdict(list)
+    devices = Node.objects.filter(ip__isnull=False).order_by("mac")
+    for mac, mesh_id in devices.values_list("mac", "mesh_id"):
+        meshes[mesh_id].append(str(mac))
+    return [
+        macs[i:i + shard_size]
+        for macs in meshes.values()
+        for i in range(0, len(macs), shard_size)
+    ]
+
+
+@shared_task
+def run_pings():
+    """Ping all devices, with a separate task per shard of devices.
+
+    The shards are pinged in parallel, once they have all been pinged
+    alerts are generated and the devices are synced.
+    """
+    shards = ping_shards(settings.PING_SHARD_SIZE)
+    if not shards:
+        finish_pings([])
+        return
+    chord(group(ping_shard.s(macs) for macs in shards))(finish_pings.s())
+
+
+@shared_task
+def ping_shard(macs: list[str]) -> int:
+    """Ping a shard of devices and save the results, returns the number of pinged devices."""
+    devices = list(
+        Node.objects.filter(mac__in=macs, ip__isnull=False).select_related("mesh__settings")
+    )
+    results = ping_all(device.ip for device in devices)
+    save_ping_results(devices, results)
+    return len(devices)
+
+
+@shared_task
+def finish_pings(shard_sizes: list[int]) -> None:
+    """Generate alerts and sync devices after all shards have been pinged."""
+    logger.info("Pinged %d devices in %d shards", sum(shard_sizes), len(shard_sizes))
+    # Optionally generate alerts for the devices based on their new statuses
+    generate_alerts()
     # Sync all devices so that updates are passed to monitoring instances by websocket.
     # Note not calling delay() here, I'm happy to have this run on the same thread
     sync_all_devices()
 
 
 def aggregate_metrics(metric_type: Type[Metric], to_gran: Metric.Granularity) -> None:
-    """Aggregate metrics for a given metric type."""
-    from_gran = to_gran.prev_granularity()
-    from_gran_name = from_gran.name if from_gran else "None"
-    metrics = metric_type.objects.filter(granularity=from_gran)
-    old_metrics_count = metrics.count()
-    first_metric, last_metric = metrics.last(), metrics.first()
-    # Fewer than one of these metrics
-    if not (first_metric and last_metric):
-        logger.info("No %s metrics to aggregate, skipping", from_gran_name)
-        return
-    min_time = int(last_metric.created.timestamp())
-    # For example, if we're going from HOURLY to DAILY we want to find
-    # all of the hourly metrics from the beginning until one day ago.
-    # The hourly metrics from the last day can remain as hourly metrics.
+    """Aggregate metrics for a given metric type.
+
+    Rollups are kept up to date as metrics are inserted, so this only has to
+    finalize the rollups of closed buckets into aggregated metrics, and expire
+    the finer-grained metrics in those buckets. This happens in one transaction.
+    """
+    # For example, if we're going from HOURLY to DAILY we want to finalize all
+    # the daily buckets that ended more than one day ago. The hourly metrics
+    # from the last day can remain as hourly metrics.
     max_time = int((timezone.now() - timedelta(seconds=to_gran.value)).timestamp())
-    new_metrics_count = 0
-    # HISTOGRAM
-    # Bucket interval is the dest granularity's total_seconds
-    for t0_int in range(min_time, max_time, to_gran.value):
-        t0 = datetime.fromtimestamp(t0_int, tz=last_metric.created.tzinfo)
-        t1 = t0 + timedelta(seconds=to_gran.value)
-        ta = t0 + (t1 - t0) / 2
-        # These are the old metrics that are going to be aggregated
-        bucket_metrics = metrics.filter(created__gte=t0, created__lt=t1)
-        # Group by mac address
-        unique_mac_addresses = set(bucket_metrics.values_list("mac", flat=True))
-        for mac in unique_mac_addresses:
-            old_metrics = bucket_metrics.filter(mac=mac)
-            old_metrics.create_aggregated(mac=mac, created=ta, granularity=to_gran)
-            old_metrics.delete()
-            new_metrics_count += 1
+    end_time = datetime.fromtimestamp(max_time - max_time % to_gran.value, tz=dt_timezone.utc)
+    with transaction.atomic(using=router.db_for_write(metric_type)):
+        closed_rollups = MetricRollup.objects.filter(
+            metric=metric_type._meta.model_name, granularity=to_gran, bucket__lt=end_time
+        )
+        new_metrics = closed_rollups.to_metrics(metric_type)
+        old_metrics = metric_type.objects.filter(
+            Q(granularity__isnull=True) | Q(granularity__lt=to_gran), created__lt=end_time
+        )
+        if metric_type.SKETCH_FIELDS:
+            # Quantile sketches are merged from the metrics being replaced
+            sketches = old_metrics.bucket_sketches(to_gran)
+            for metric in new_metrics:
+                bucket = metric.created - timedelta(seconds=to_gran) / 2
+                metric.sketches = encode_sketches(sketches.get((metric.mac, bucket), {}))
+        metric_type.objects.bulk_create(new_metrics)
+        if settings.METRICS_CHUNK_STORAGE and to_gran == Metric.Granularity.HOURLY:
+            # Archive the raw metrics before they're deleted
+            raw_metrics = old_metrics.filter(granularity__isnull=True).order_by()
+            MetricChunk.objects.add_metrics(metric_type, raw_metrics.iterator())
+        closed_rollups.delete()
+        old_metrics_count, _ = old_metrics.delete()
     logger.info(
-        "Aggregated %d -> %d metrics for %s from %s to %s",
+        "Aggregated %d -> %d metrics for %s to %s",
         old_metrics_count,
-        new_metrics_count,
+        len(new_metrics),
         metric_type.__name__,
-        from_gran_name,
         to_gran.name,
     )
 
@@ -116,3 +196,85 @@ def aggregate_all_daily_metrics():
 def aggregate_all_monthly_metrics():
     """Aggregate to monthly metrics once a month."""
     aggregate_all_metrics(Metric.Granularity.MONTHLY)
+
+
+def retention_policy(metric_type: Type[Metric]) -> dict[str, int | None]:
+    """Get the days to keep a metric type's metrics for, per granularity."""
+    policy = dict(settings.METRICS_RETENTION["default"])
+    policy.update(settings.METRICS_RETENTION.get(metric_type._meta.model_name, {}))
+    return policy
+
+
+def delete_in_batches(qs, order_by: str, batch_size: int) -> int:
+    """Delete a query set in batches along an index, returns the number of deleted rows.
+
+    Each batch is deleted in its own transaction, so the database is only
+    ever locked for the duration of a single batch.
+    """
+    deleted = 0
+    while True:
+        pks = list(qs.order_by(order_by).values_list("pk", flat=True)[:batch_size])
+        if pks:
+            count, _ = qs.model.objects.filter(pk__in=pks).delete()
+            deleted += count
+        if len(pks) < batch_size:
+            return deleted
+
+
+def enforce_retention(metric_type: Type[Metric]) -> int:
+    """Delete a metric type's metrics that are past their retention period.
+
+    Returns the number of deleted rows.
+    """
+    now = timezone.now()
+    batch_size = settings.METRICS_RETENTION_BATCH_SIZE
+    deleted = 0
+    for granularity, days in retention_policy(metric_type).items():
+        if days is None:
+            continue
+        cutoff = now - timedelta(days=days)
+        if granularity == "CHUNKS":
+            chunks = MetricChunk.objects.filter(
+                metric=metric_type._meta.model_name, day__lt=cutoff.date()
+            )
+            deleted += delete_in_batches(chunks, "day", batch_size)
+            # Partitions are only dropped once their whole month has expired
+            deleted += partitions.drop_partitions(metric_type, cutoff.date())
+            continue
+        if granularity == "RAW":
+            metrics = metric_type.objects.filter(granularity__isnull=True, created__lt=cutoff)
+        else:
+            metrics = metric_type.objects.filter(
+                granularity=Metric.Granularity[granularity], created__lt=cutoff
+            )
+        deleted += delete_in_batches(metrics, "created", batch_size)
+    return deleted
+
+
+@shared_task
+def enforce_all_retention() -> dict[str, int]:
+    """Delete expired metrics of each metric type, returns the deleted rows per type."""
+    start_time = time.time()
+    report = {}
+    for metric_type in Metric.__subclasses__():
+        type_start_time = time.time()
+        report[metric_type.__name__] = enforce_retention(metric_type)
+        logger.info(
+            "Removed %d expired %s rows in %s",
+            report[metric_type.__name__],
+            metric_type.__name__,
+            timedelta(seconds=time.time() - type_start_time),
+        )
+    elapsed_time = timedelta(seconds=time.time() - start_time)
+    logger.info("Removed %d expired metric rows in %s", sum(report.values()), elapsed_time)
+    return report
+
+
+@shared_task
+def archive_metric_partitions() -> int:
+    """Move the packed raw metrics of closed months into their partitions."""
+    start_time = time.time()
+    archived = partitions.archive_closed_months(timezone.now().astimezone(dt_timezone.utc).date())
+    elapsed_time = timedelta(seconds=time.time() - start_time)
+    logger.info("Archived %d metric chunks in %s", archived, elapsed_time)
+    return archived
@@ -1,3 +1,1350 @@
-from django.test import TestCase
+import asyncio
+from collections import defaultdict
+import csv
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+import json
+import random
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import IntegrityError, OperationalError, connections, models
+from django.db.models import Min, Sum
+from django.db.models.functions import Coalesce
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from netaddr import EUI
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from monitoring.models import Mesh, Node
+from sync.utils import bulk_sync
+from . import chunks, downsample, partitions, ping, probe, sketch, views
+from .buffer import BufferFull, MetricBuffer
+from .models import (
+    DataRateMetric, DataUsageMetric, FailuresMetric, FieldStats, LatestMetric, Metric, MetricChunk, MetricRollup,
+    MetricsQuerySet, ResourcesMetric, RTTMetric, UptimeMetric,
+)
+from .renderers import ColumnarRenderer
+from .serializers import FailuresMetricSerializer
+from . import tasks
+from .tasks import save_ping_results
+
+
+class FakeFping:
+    """Stand-in for an fping process, prints a '-q' summary for each target."""
+
+    def __init__(self, command, **kwargs):
+        targets = command[command.index("-q") + 1:]
+        lines = []
+        for target in targets:
+            # Every third subnet is unreachable
+            if int(target.split(".")[2]) % 3 == 0:
+                lines.append(f"{target} : xmt/rcv/%loss = 5/0/100%")
+            else:
+                lines.append(
+                    f"{target} : xmt/rcv/%loss = 5/4/20%, min/avg/max = 0.51/1.22/3.04"
+                )
+        lines.append("ICMP Host Unreachable from 10.0.0.1 for ICMP Echo sent to 10.0.0.2")
+        self.stderr = "\n".join(lines).encode("utf-8")
+
+    def communicate(self):
+        return b"", self.stderr
+
+
+class FakeTransport:
+    """Probe transport that answers from a table of round trip times."""
+
+    def __init__(self, rtts: dict[str, list[float | None]]):
+        self.rtts = rtts
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def probe(self, ip, seq, nbytes, timeout):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0)
+        self.in_flight -= 1
+        if ip not in self.rtts:
+            raise OSError("Network is unreachable")
+        return self.rtts[ip][seq]
+
+
+class TestPing(SimpleTestCase):
+
+    def test_parse_single_target(self):
+        result = ping.parse_fping_stats("xmt/rcv/%loss = 5/5/0%, min/avg/max = 0.1/0.2/0.3")
+        self.assertEqual(result, {
+            "reachable": 1,
+            "loss": 0.0,
+            "rtt": {"rtt_min": 0.1, "rtt_avg": 0.2, "rtt_max": 0.3},
+        })
+        result = ping.parse_fping_stats("xmt/rcv/%loss = 5/0/100%")
+        self.assertEqual(result, {"reachable": 0, "loss": 100.0})
+        with self.assertRaises(ValueError):
+            ping.parse_fping_stats("fping: can't create socket")
+
+    def test_ping_many_parses_fleet(self):
+        ips = [f"10.{i // 250}.{i % 250}.1" for i in range(5000)]
+        with mock.patch.object(ping.subprocess, "Popen", side_effect=FakeFping) as popen:
+            results = ping.ping_many(ips)
+        # 5000 targets are split into chunks of BATCH_CHUNK_SIZE
+        self.assertEqual(popen.call_count, 5000 // ping.BATCH_CHUNK_SIZE)
+        self.assertEqual(len(results), 5000)
+        for ip in ips:
+            if int(ip.split(".")[2]) % 3 == 0:
+                self.assertEqual(results[ip], {"reachable": 0, "loss": 100.0})
+            else:
+                self.assertEqual(results[ip], {
+                    "reachable": 1,
+                    "loss": 20.0,
+                    "rtt": {"rtt_min": 0.51, "rtt_avg": 1.22, "rtt_max": 3.04},
+                })
+
+
+class TestAsyncProber(SimpleTestCase):
+
+    def test_results_match_fping_format(self):
+        transport = FakeTransport({
+            "10.0.0.1": [1.0, 2.0, None, 3.0, 4.0],
+            "10.0.0.2": [None] * 5,
+        })
+        prober = probe.AsyncProber(transport, interval=0)
+        results = prober.ping_many(["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+        self.assertEqual(results, {
+            "10.0.0.1": {
+                "reachable": 1,
+                "loss": 20.0,
+                "rtt": {"rtt_min": 1.0, "rtt_avg": 2.5, "rtt_max": 4.0},
+            },
+            "10.0.0.2": {"reachable": 0, "loss": 100.0},
+            "10.0.0.3": {"reachable": 0, "loss": 100.0},
+        })
+
+    def test_concurrency_is_bounded(self):
+        ips = [f"10.0.{i // 250}.{i % 250}" for i in range(2000)]
+        transport = FakeTransport({ip: [1.0] * 5 for ip in ips})
+        prober = probe.AsyncProber(transport, interval=0, concurrency=50)
+        results = prober.ping_many(ips)
+        self.assertEqual(len(results), 2000)
+        self.assertEqual(transport.max_in_flight, 50)
+
+    @override_settings(PING_BACKEND="asyncio")
+    def test_backend_chosen_in_settings(self):
+        with mock.patch.object(probe, "ping_many", return_value={}) as ping_many:
+            ping.ping_all(["10.0.0.1"])
+        ping_many.assert_called_once()
+
+
+class TestSketch(SimpleTestCase):
+
+    def assertRelativelyClose(self, estimate, value):
+        self.assertLessEqual(abs(estimate - value), value * sketch.DEFAULT_RELATIVE_ACCURACY)
+
+    def test_quantiles_are_accurate(self):
+        rand = random.Random(1)
+        values = [rand.lognormvariate(3, 1) for _ in range(10000)]
+        s = sketch.DDSketch()
+        for value in values:
+            s.add(value)
+        values.sort()
+        for q in (0.5, 0.95, 0.99):
+            self.assertRelativelyClose(s.quantile(q), values[int(q * (len(values) - 1))])
+
+    def test_merged_sketches_match_single_sketch(self):
+        rand = random.Random(2)
+        values = [rand.uniform(0, 500) for _ in range(1000)]
+        whole, left, right = sketch.DDSketch(), sketch.DDSketch(), sketch.DDSketch()
+        for i, value in enumerate(values):
+            whole.add(value)
+            (left if i % 2 else right).add(value)
+        left.merge(right)
+        self.assertEqual(left.bins, whole.bins)
+
+    def test_serialization(self):
+        s = sketch.DDSketch()
+        for value in (0, 1, 2, 3, 1000):
+            s.add(value)
+        data = sketch.encode_sketches({"rtt_avg": s, "rtt_max": sketch.DDSketch()})
+        decoded = sketch.decode_sketches(data)
+        self.assertEqual(decoded["rtt_avg"].bins, s.bins)
+        self.assertEqual(decoded["rtt_avg"].zero_count, 1)
+        self.assertIsNone(decoded["rtt_max"].quantile(0.5))
+
+    def test_bins_are_bounded(self):
+        s = sketch.DDSketch(max_bins=64)
+        for i in range(1, 100000, 7):
+            s.add(i / 100)
+        self.assertLessEqual(len(s.bins), 64)
+        # High quantiles remain accurate
+        self.assertRelativelyClose(s.quantile(0.99), 990)
+
+
+class TestChunks(SimpleTestCase):
+
+    def test_round_trip(self):
+        start = timezone.now()
+        metrics = [
+            DataRateMetric(
+                mac="00:00:00:00:00:01",
+                created=start + timedelta(minutes=5 * i, microseconds=i),
+                tx_rate=i * 1000 if i % 3 else None,
+                rx_rate=2**40 + i,
+            )
+            for i in range(288)
+        ]
+        decoded = chunks.decode_chunk(DataRateMetric, chunks.encode_chunk(DataRateMetric, metrics), EUI(1))
+        self.assertEqual(
+            [(m.created, m.tx_rate, m.rx_rate) for m in decoded],
+            [(m.created, m.tx_rate, m.rx_rate) for m in metrics],
+        )
+
+    def test_floats_are_packed_as_float32(self):
+        metrics = [
+            RTTMetric(created=timezone.now(), rtt_min=0.1, rtt_avg=None, rtt_max=1.5),
+        ]
+        (decoded,) = chunks.decode_chunk(RTTMetric, chunks.encode_chunk(RTTMetric, metrics), EUI(1))
+        self.assertAlmostEqual(decoded.rtt_min, 0.1, places=6)
+        self.assertIsNone(decoded.rtt_avg)
+        self.assertEqual(decoded.rtt_max, 1.5)
+
+
+class TestDownsample(SimpleTestCase):
+
+    def test_lttb_keeps_endpoints_and_spikes(self):
+        xs = list(range(1000))
+        ys = [1.0] * 1000
+        ys[567] = 100.0
+        selected = downsample.lttb(xs, ys, 20)
+        self.assertEqual(len(selected), 20)
+        self.assertEqual(selected, sorted(selected))
+        self.assertEqual((selected[0], selected[-1]), (0, 999))
+        self.assertIn(567, selected)
+
+    def test_lttb_small_series(self):
+        self.assertEqual(downsample.lttb([1, 2, 3], [1, 2, 3], 10), [0, 1, 2])
+
+    def test_parse_bucket(self):
+        self.assertEqual(downsample.parse_bucket("15m"), 900)
+        self.assertEqual(downsample.parse_bucket("1d"), 86400)
+        self.assertIsNone(downsample.parse_bucket("15"))
+        self.assertIsNone(downsample.parse_bucket("0h"))
+
+
+class TestSavePingResults(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    def ping_devices(self, n: int) -> tuple[int, int]:
+        """Save ping results for n new devices, returns the number of queries run per db."""
+        mesh = Mesh.objects.create(name=f"mesh{n}")
+        mesh.settings.check_rtt = 10
+        mesh.settings.save()
+        for i in range(n):
+            Node.objects.create(mac=f"00:00:00:00:{n:02x}:{i:02x}", name=f"{n}-{i}", ip=f"10.0.{n}.{i}", mesh=mesh)
+        devices = list(Node.objects.filter(mesh=mesh).select_related("mesh__settings"))
+        results = {
+            f"10.0.{n}.{i}": {"reachable": 1, "loss": 0.0, "rtt": {"rtt_min": 1.0, "rtt_avg": 2.0, "rtt_max": 3.0}}
+            for i in range(n)
+            if i % 2
+        }
+        with CaptureQueriesContext(connections["default"]) as default_queries:
+            with CaptureQueriesContext(connections["metrics_db"]) as metrics_queries:
+                save_ping_results(devices, results)
+        return len(default_queries), len(metrics_queries)
+
+    def test_results_are_saved(self):
+        self.ping_devices(4)
+        self.assertEqual(UptimeMetric.objects.count(), 4)
+        self.assertEqual(UptimeMetric.objects.filter(reachable=True).count(), 2)
+        self.assertEqual(RTTMetric.objects.count(), 2)
+        offline = Node.objects.get(ip="10.0.4.0")
+        self.assertEqual(offline.status, Node.Status.OFFLINE)
+        self.assertFalse(offline.reachable)
+        online = Node.objects.get(ip="10.0.4.1")
+        self.assertTrue(online.reachable)
+        self.assertIsNotNone(online.last_ping)
+        self.assertEqual(online.health_status, Node.HealthStatus.OK)
+
+    def test_query_count_is_constant(self):
+        self.assertEqual(self.ping_devices(5), self.ping_devices(50))
+
+    def test_locked_database_keeps_metrics_buffered(self):
+        buffer = MetricBuffer(size=1000, interval=60, max_size=10000)
+        locked = OperationalError("database is locked")
+        with mock.patch("metrics.tasks.get_buffer", return_value=buffer):
+            with mock.patch.object(MetricsQuerySet, "ingest", side_effect=locked):
+                with self.assertLogs("metrics.buffer", "WARNING"):
+                    self.ping_devices(4)
+        # The devices are still updated, the metrics are written on the next flush
+        self.assertEqual(Node.objects.filter(reachable=True).count(), 2)
+        self.assertFalse(UptimeMetric.objects.exists())
+        self.assertEqual(buffer.count, 6)
+        buffer.flush()
+        self.assertEqual((UptimeMetric.objects.count(), RTTMetric.objects.count()), (4, 2))
+
+    def test_full_buffer_still_saves_statuses(self):
+        buffer = MetricBuffer(size=1000, interval=60, max_size=10)
+        buffer.add([UptimeMetric(mac="00:00:00:00:00:01", reachable=True, loss=0)] * 8)
+        locked = OperationalError("database is locked")
+        with mock.patch("metrics.tasks.get_buffer", return_value=buffer):
+            with mock.patch.object(MetricsQuerySet, "ingest", side_effect=locked):
+                with self.assertLogs("metrics.tasks", "WARNING"):
+                    self.ping_devices(4)
+        self.assertEqual(Node.objects.filter(reachable=True).count(), 2)
+        self.assertEqual(buffer.count, 8)
+
+
+class TestRunPings(TestCase):
+
+    def setUp(self):
+        for name, n in (("small", 3), ("large", 5)):
+            mesh = Mesh.objects.create(name=name)
+            for i in range(n):
+                Node.objects.create(mac=f"00:00:00:00:{n:02x}:{i:02x}", name=f"{name}-{i}", ip=f"10.0.{n}.{i}", mesh=mesh)
+        Node.objects.create(mac="00:00:00:00:00:01", name="unknown", ip="10.0.0.1")
+        Node.objects.create(mac="00:00:00:00:00:02", name="no-ip", mesh=mesh)
+
+    @override_settings(PING_SHARD_SIZE=2)
+    def test_devices_are_sharded_by_mesh(self):
+        with mock.patch.object(tasks, "chord") as chord:
+            tasks.run_pings()
+        header = chord.call_args.args[0]
+        shards = sorted(task.args[0] for task in header.tasks)
+        self.assertEqual(shards, [
+            ["00:00:00:00:00:01"],
+            ["00:00:00:00:03:00", "00:00:00:00:03:01"],
+            ["00:00:00:00:03:02"],
+            ["00:00:00:00:05:00", "00:00:00:00:05:01"],
+            ["00:00:00:00:05:02", "00:00:00:00:05:03"],
+            ["00:00:00:00:05:04"],
+        ])
+        # The callback is called once all shards have been pinged
+        callback = chord.return_value.call_args.args[0]
+        self.assertEqual(callback.task, tasks.finish_pings.name)
+
+
+class TestAggregateMetrics(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    metric_types = [UptimeMetric, RTTMetric, DataUsageMetric]
+
+    def setUp(self):
+        self.now = timezone.now()
+        patcher = mock.patch.object(timezone, "now", return_value=self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def seed(self) -> list[Metric]:
+        """Create a few days of five-minutely metrics for a few nodes."""
+        rand = random.Random(42)
+        start = self.now - timedelta(days=3, seconds=rand.randrange(3600))
+        metrics = []
+        for i in range(3 * 24 * 12):
+            for mac in ("00:00:00:00:00:01", "00:00:00:00:00:02", "00:00:00:00:00:03"):
+                # Skip some metrics so that buckets are uneven
+                if rand.random() < 0.2:
+                    continue
+                created = start + timedelta(minutes=5 * i, seconds=rand.uniform(0, 60))
+                reachable = rand.random() < 0.9
+                metrics.append(UptimeMetric(
+                    mac=mac, created=created, reachable=reachable, loss=0 if reachable else 100
+                ))
+                metrics.append(RTTMetric(
+                    mac=mac,
+                    created=created,
+                    rtt_min=rand.uniform(0, 1),
+                    rtt_avg=rand.uniform(1, 2),
+                    rtt_max=rand.uniform(2, 10),
+                ))
+                metrics.append(DataUsageMetric(
+                    mac=mac, created=created, tx_bytes=rand.randrange(10**9), rx_bytes=rand.randrange(10**9)
+                ))
+        # Some metrics are created one at a time, others in bulk
+        for metric in metrics[:100]:
+            metric.save()
+        for metric_type in self.metric_types:
+            metric_type.objects.bulk_create(m for m in metrics[100:] if isinstance(m, metric_type))
+        return metrics
+
+    def expected(self, metrics: list[Metric], metric_type) -> list[tuple]:
+        """Aggregate raw metrics directly, in the closed buckets of each granularity."""
+        now = self.now.timestamp()
+        hourly_end = (now - 3600) - (now - 3600) % 3600
+        daily_end = (now - 86400) - (now - 86400) % 86400
+        buckets = defaultdict(list)
+        for metric in metrics:
+            if not isinstance(metric, metric_type):
+                continue
+            ts = metric.created.timestamp()
+            if ts < daily_end:
+                gran = Metric.Granularity.DAILY
+            elif ts < hourly_end:
+                gran = Metric.Granularity.HOURLY
+            else:
+                buckets[(metric.mac, metric.created, None)].append(metric)
+                continue
+            bucket = datetime.fromtimestamp(ts - ts % gran + gran / 2, tz=dt_timezone.utc)
+            buckets[(metric.mac, bucket, gran)].append(metric)
+        rows = []
+        for (mac, created, gran), bucket_metrics in buckets.items():
+            values = {}
+            for fn in metric_type.SUM_FIELDS:
+                values[fn] = sum(getattr(m, fn) for m in bucket_metrics)
+            for fn in metric_type.AVG_FIELDS:
+                values[fn] = sum(getattr(m, fn) for m in bucket_metrics) / len(bucket_metrics)
+            for fn in metric_type.MIN_FIELDS:
+                values[fn] = min(getattr(m, fn) for m in bucket_metrics)
+            # E.g. integer fields are truncated when saved
+            values = {fn: metric_type._meta.get_field(fn).to_python(v) for fn, v in values.items()}
+            rows.append((EUI(mac), created, gran, *(values[fn] for fn in sorted(values))))
+        return self.rounded(rows)
+
+    def rounded(self, rows) -> list[tuple]:
+        return sorted(
+            tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows
+        )
+
+    def snapshot(self, metric_type) -> list[tuple]:
+        fields = ["mac", "created", "granularity", *sorted(metric_type.rollup_fields())]
+        return self.rounded(metric_type.objects.values_list(*fields))
+
+    def test_closed_buckets_are_aggregated(self):
+        metrics = self.seed()
+        for gran in (Metric.Granularity.HOURLY, Metric.Granularity.DAILY):
+            for metric_type in self.metric_types:
+                tasks.aggregate_metrics(metric_type, gran)
+        for metric_type in self.metric_types:
+            # Sanity check that metrics were actually aggregated
+            self.assertTrue(metric_type.objects.filter(granularity=Metric.Granularity.DAILY).exists())
+            self.assertTrue(metric_type.objects.filter(granularity=Metric.Granularity.HOURLY).exists())
+            self.assertEqual(self.snapshot(metric_type), self.expected(metrics, metric_type))
+        # Rollups of the finalized buckets are removed, the open ones remain
+        self.assertFalse(MetricRollup.objects.filter(
+            granularity=Metric.Granularity.DAILY, bucket__lt=self.now - timedelta(days=2)
+        ).exists())
+        self.assertTrue(MetricRollup.objects.filter(granularity=Metric.Granularity.MONTHLY).exists())
+
+    def test_live_series_from_rollups(self):
+        metrics = self.seed()
+        rollups = MetricRollup.objects.filter(granularity=Metric.Granularity.DAILY)
+        live = rollups.to_metrics(RTTMetric)
+        rtts = [m for m in metrics if isinstance(m, RTTMetric)]
+        self.assertEqual(len(live), len({(m.mac, m.created.date()) for m in rtts}))
+        self.assertAlmostEqual(
+            sum(m.rtt_max for m in live if str(m.mac) == "00:00:00:00:00:01"),
+            sum(
+                sum(m.rtt_max for m in group) / len(group)
+                for group in self.group_by_day(rtts, "00:00:00:00:00:01")
+            ),
+        )
+
+    def test_live_endpoint(self):
+        self.seed()
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="test"))
+        response = client.get("/metrics/rtt/live/", {"mac": "00:00:00:00:00:02", "granularity": "DAILY"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 4)
+        self.assertEqual(response.data[0]["granularity"], Metric.Granularity.DAILY)
+        # The time range is clamped, so buckets from now are out of range
+        min_time = int((self.now - timedelta(days=100)).timestamp())
+        response = client.get("/metrics/rtt/live/", {"granularity": "DAILY", "min_time": min_time})
+        self.assertEqual(response.data, [])
+
+    def test_aggregated_quantiles(self):
+        metrics = self.seed()
+        for gran in (Metric.Granularity.HOURLY, Metric.Granularity.DAILY):
+            tasks.aggregate_metrics(RTTMetric, gran)
+        rtts = [m for m in metrics if isinstance(m, RTTMetric)]
+        daily = RTTMetric.objects.filter(mac="00:00:00:00:00:01", granularity=Metric.Granularity.DAILY)
+        self.assertTrue(daily.exists())
+        for metric in daily:
+            start = metric.created - timedelta(days=1) / 2
+            values = sorted(
+                m.rtt_max for m in rtts
+                if str(m.mac) == "00:00:00:00:00:01" and start <= m.created < start + timedelta(days=1)
+            )
+            quantiles = metric.quantiles()["rtt_max"]
+            for name, q in Metric.QUANTILES.items():
+                exact = values[int(q * (len(values) - 1))]
+                self.assertLessEqual(abs(quantiles[name] - exact), exact * sketch.DEFAULT_RELATIVE_ACCURACY)
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="test"))
+        response = client.get("/metrics/rtt/", {"mac": "00:00:00:00:00:01", "granularity": "DAILY"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("p99", response.data["results"][0]["quantiles"]["rtt_max"])
+        self.assertNotIn("sketches", response.data["results"][0])
+
+    @override_settings(METRICS_CHUNK_STORAGE=True)
+    def test_raw_metrics_are_packed_into_chunks(self):
+        metrics = self.seed()
+        uptimes = sorted((EUI(m.mac), m.created, m.reachable, m.loss) for m in metrics if isinstance(m, UptimeMetric))
+
+        def stored():
+            packed = MetricChunk.objects.to_metrics(UptimeMetric)
+            remaining = UptimeMetric.objects.filter(granularity__isnull=True)
+            return sorted((m.mac, m.created, m.reachable, m.loss) for m in [*packed, *remaining])
+
+        tasks.aggregate_metrics(UptimeMetric, Metric.Granularity.HOURLY)
+        # Raw metrics were packed into daily chunks before they were deleted
+        self.assertEqual(stored(), uptimes)
+        chunk_count = MetricChunk.objects.count()
+        self.assertEqual(chunk_count, len({(m[0], m[1].date()) for m in uptimes}))
+        # Aggregating again merges into the existing chunks
+        timezone.now.return_value = self.now + timedelta(hours=2)
+        tasks.aggregate_metrics(UptimeMetric, Metric.Granularity.HOURLY)
+        self.assertFalse(UptimeMetric.objects.filter(granularity__isnull=True).exists())
+        self.assertEqual(stored(), uptimes)
+        self.assertEqual(MetricChunk.objects.count(), chunk_count)
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="test"))
+        response = client.get("/metrics/uptime/raw/", {"mac": "00:00:00:00:00:01"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), len([m for m in uptimes if m[0] == EUI(1)]))
+
+    def test_reaggregation_matches_raw(self):
+        metrics = self.seed()
+        for metric_type in self.metric_types:
+            tasks.aggregate_metrics(metric_type, Metric.Granularity.HOURLY)
+        for metric_type in self.metric_types:
+            samples = [m for m in metrics if isinstance(m, metric_type) and str(m.mac) == "00:00:00:00:00:01"]
+            expected = {}
+            for fn in metric_type.SUM_FIELDS:
+                expected[fn] = sum(getattr(m, fn) for m in samples)
+            for fn in metric_type.AVG_FIELDS:
+                expected[fn] = sum(getattr(m, fn) for m in samples) / len(samples)
+            for fn in metric_type.MIN_FIELDS:
+                expected[fn] = min(getattr(m, fn) for m in samples)
+            # Hourly metrics and the remaining raw metrics are merged together,
+            # averages are weighted by the sample count
+            qs = metric_type.objects.filter(mac="00:00:00:00:00:01")
+            self.assertTrue(qs.filter(granularity=Metric.Granularity.HOURLY).exists())
+            self.assertTrue(qs.filter(granularity__isnull=True).exists())
+            self.assertEqual(qs.aggregate(n=Sum(Coalesce("sample_count", 1)))["n"], len(samples))
+            (row,) = qs.aggregate_buckets(0, 10**10)
+            for fn, value in expected.items():
+                # Only the stored (e.g. truncated integer) averages are left to work with
+                if fn in metric_type.AVG_FIELDS and not isinstance(metric_type._meta.get_field(fn), models.FloatField):
+                    continue
+                self.assertAlmostEqual(row[fn], value, places=6, msg=fn)
+            # The monthly rollups, which aren't aggregated yet, hold the exact values
+            rollups = MetricRollup.objects.filter(
+                metric=metric_type._meta.model_name, mac="00:00:00:00:00:01", granularity=Metric.Granularity.MONTHLY
+            )
+            for fn, value in expected.items():
+                totals = rollups.filter(field=fn).aggregate(count=Sum("count"), sum=Sum("sum"), min=Min("min"))
+                stats = FieldStats(totals["count"], totals["sum"], totals["min"], None)
+                self.assertAlmostEqual(stats.value(metric_type, fn), value, places=6, msg=fn)
+
+    def group_by_day(self, metrics, mac) -> list[list[Metric]]:
+        groups = defaultdict(list)
+        for m in metrics:
+            if m.mac == mac:
+                groups[m.created.date()].append(m)
+        return list(groups.values())
+
+
+@override_settings(
+    METRICS_RETENTION={
+        "default": {"RAW": 2, "CHUNKS": 2, "HOURLY": 30, "DAILY": None},
+        "uptimemetric": {"RAW": 1},
+    },
+    METRICS_RETENTION_BATCH_SIZE=7,
+)
+class TestRetention(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    def create_metrics(self, metric_type, granularity, days: list[int], **fields):
+        now = timezone.now()
+        metric_type.objects.bulk_create(
+            metric_type(
+                mac="00:00:00:00:00:01",
+                created=now - timedelta(days=d, seconds=i),
+                granularity=granularity,
+                **fields,
+            )
+            for i, d in enumerate(days)
+        )
+
+    def test_expired_metrics_are_deleted(self):
+        self.create_metrics(RTTMetric, None, [0, 1, 3, 3, 4], rtt_avg=1.0)
+        self.create_metrics(RTTMetric, Metric.Granularity.HOURLY, [1, 29, *[31] * 20], rtt_avg=1.0)
+        self.create_metrics(RTTMetric, Metric.Granularity.DAILY, [100, 1000], rtt_avg=1.0)
+        self.create_metrics(UptimeMetric, None, [0, 1.5, 3], reachable=True, loss=0)
+        MetricChunk.objects.create(metric="rttmetric", mac=EUI(1), day=timezone.now().date() - timedelta(days=5), count=0, data=b"")
+        with CaptureQueriesContext(connections["metrics_db"]) as queries:
+            report = tasks.enforce_all_retention()
+        self.assertEqual(report["RTTMetric"], 3 + 20 + 1)
+        self.assertEqual(report["UptimeMetric"], 2)
+        self.assertEqual(RTTMetric.objects.count(), 2 + 2 + 2)
+        self.assertFalse(MetricChunk.objects.exists())
+        # The 20 expired hourly metrics are deleted in batches
+        deletes = [q for q in queries if q["sql"].startswith('DELETE FROM "metrics_rttmetric"')]
+        self.assertEqual(len(deletes), 4)
+
+
+class TestPartitions(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(METRICS_PARTITION_DIR=directory.name))
+        self.start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+
+    def pack(self, metric_type, days: list[int], **fields) -> list[Metric]:
+        """Pack a metric per hour over the given days (since the start) for two nodes."""
+        metrics = [
+            metric_type(mac=EUI(mac), created=self.start + timedelta(days=d, hours=h), **fields)
+            for mac in (1, 2)
+            for d in days
+            for h in range(24)
+        ]
+        MetricChunk.objects.add_metrics(metric_type, metrics)
+        return metrics
+
+    def test_closed_months_are_archived(self):
+        january = self.pack(RTTMetric, list(range(31)), rtt_avg=1.0)
+        self.pack(RTTMetric, [31, 45, 60], rtt_avg=2.0)
+        self.pack(UptimeMetric, [10], reachable=True, loss=0)
+        # March is the current month
+        archived = partitions.archive_closed_months(date(2026, 3, 10))
+        self.assertEqual(archived, 2 * 31 + 2 * 2 + 2)
+        self.assertEqual(partitions.partitions(RTTMetric), [date(2026, 1, 1), date(2026, 2, 1)])
+        self.assertEqual(list(MetricChunk.objects.values_list("day", flat=True).distinct()), [date(2026, 3, 2)])
+        # Reads only open the partitions they overlap
+        with mock.patch("metrics.partitions.sqlite3.connect", wraps=partitions.sqlite3.connect) as connect:
+            feb = partitions.read_chunks(RTTMetric, "00:00:00:00:00:01", min_day=date(2026, 2, 10))
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual([chunk.day for chunk in feb], [date(2026, 2, 15)])
+        self.assertEqual(len(feb[0].to_metrics(RTTMetric)), 24)
+        jan = partitions.read_chunks(RTTMetric, max_day=date(2026, 1, 31))
+        unpacked = sorted((m.mac, m.created, m.rtt_avg) for chunk in jan for m in chunk.to_metrics(RTTMetric))
+        self.assertEqual(unpacked, sorted((m.mac, m.created, m.rtt_avg) for m in january))
+        # Archiving late chunks merges them without duplicating metrics
+        self.pack(RTTMetric, [0, 1], rtt_avg=1.0)
+        self.assertEqual(partitions.archive_closed_months(date(2026, 3, 10)), 4)
+        jan = partitions.read_chunks(RTTMetric, max_day=date(2026, 1, 31))
+        self.assertEqual(sum(chunk.count for chunk in jan), len(january))
+
+    def test_chunks_changed_while_archiving_are_kept(self):
+        self.pack(RTTMetric, [0], rtt_avg=1.0)
+        partitions.archive_closed_months(date(2026, 2, 1))
+        self.pack(RTTMetric, [0], rtt_avg=1.0)
+        merge_chunk = partitions.merge_chunk
+        late = RTTMetric(mac=EUI(1), created=self.start + timedelta(minutes=30), rtt_avg=2.0)
+
+        def merge_and_pack(metric_type, mac, *args):
+            if mac == EUI(1):
+                # A late metric is packed into the chunk while it's being archived
+                MetricChunk.objects.add_metrics(RTTMetric, [late])
+            return merge_chunk(metric_type, mac, *args)
+
+        with mock.patch("metrics.partitions.merge_chunk", merge_and_pack):
+            self.assertEqual(partitions.archive_closed_months(date(2026, 2, 1)), 2)
+        chunk = MetricChunk.objects.get()
+        self.assertEqual((chunk.mac, chunk.count), (EUI(1), 25))
+        self.assertEqual(partitions.archive_closed_months(date(2026, 2, 1)), 1)
+        jan = partitions.read_chunks(RTTMetric, "00:00:00:00:00:01")
+        self.assertEqual(sum(chunk.count for chunk in jan), 25)
+
+    def test_expired_partitions_are_dropped(self):
+        self.pack(RTTMetric, [0, 31], rtt_avg=1.0)
+        self.pack(UptimeMetric, [0], reachable=True, loss=0)
+        partitions.archive_closed_months(date(2026, 3, 1))
+        # Only whole months are dropped
+        self.assertEqual(partitions.drop_partitions(RTTMetric, date(2026, 2, 15)), 2)
+        self.assertEqual(partitions.partitions(RTTMetric), [date(2026, 2, 1)])
+        self.assertEqual(partitions.partitions(UptimeMetric), [date(2026, 1, 1)])
+        with override_settings(METRICS_RETENTION={"default": {"CHUNKS": None}, "rttmetric": {"CHUNKS": 2}}):
+            report = tasks.enforce_all_retention()
+        self.assertEqual(report["RTTMetric"], 2)
+        self.assertEqual(partitions.partitions(RTTMetric), [])
+        self.assertEqual(partitions.partitions(UptimeMetric), [date(2026, 1, 1)])
+
+    def test_raw_endpoint_reads_partitions(self):
+        self.pack(UptimeMetric, [30, 31], reachable=True, loss=0)
+        partitions.archive_closed_months(date(2026, 2, 10))
+        self.pack(UptimeMetric, [32], reachable=True, loss=10)
+        UptimeMetric.objects.create(mac=EUI(1), created=self.start + timedelta(days=33), reachable=False, loss=100)
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="test"))
+        response = client.get("/metrics/uptime/raw/", {
+            "mac": "00:00:00:00:00:01",
+            "min_time": int((self.start + timedelta(days=31)).timestamp()),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m["loss"] for m in response.data], [0] * 23 + [10] * 24 + [100])
+        # Without pagination, the time range is clamped to a week
+        response = client.get("/metrics/uptime/raw/", {
+            "mac": "00:00:00:00:00:01",
+            "min_time": int((self.start + timedelta(days=26)).timestamp()),
+            "max_time": int((self.start + timedelta(days=40)).timestamp()),
+        })
+        self.assertEqual([m["loss"] for m in response.data], [0] * 48 + [10] * 24)
+
+
+class TestLatestMetrics(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.mesh = Mesh.objects.create(name="mesh")
+
+    def test_latest_metric_is_kept(self):
+        mac = EUI("00:00:00:00:00:01")
+        RTTMetric.objects.bulk_create([
+            RTTMetric(mac=mac, created=self.now - timedelta(minutes=5), rtt_avg=1.0),
+            RTTMetric(mac=mac, created=self.now, rtt_avg=2.0),
+        ])
+        # Older and aggregated metrics don't replace the latest one
+        RTTMetric.objects.create(mac=mac, created=self.now - timedelta(minutes=1), rtt_avg=3.0)
+        RTTMetric.objects.create(mac=mac, created=self.now + timedelta(minutes=1), rtt_avg=4.0, granularity=3600)
+        # Data rates are only kept when both rates are known
+        DataRateMetric.objects.create(mac=mac, created=self.now - timedelta(minutes=1), tx_rate=10, rx_rate=20)
+        DataRateMetric.objects.create(mac=mac, created=self.now, tx_rate=None, rx_rate=30)
+        node = Node(mac=mac)
+        self.assertEqual(node.last_rtt_metric.created, self.now)
+        self.assertEqual(node.last_rtt_metric.rtt_avg, 2.0)
+        self.assertEqual(node.last_rate_metric.tx_rate, 10)
+        self.assertIsNone(node.last_resource_metric)
+        ResourcesMetric.objects.create(mac=mac, created=self.now, memory=0.5, cpu=0.25)
+        node = Node(mac=mac)
+        self.assertEqual((node.get_mem(), node.get_cpu()), (0.5, 0.25))
+        self.assertEqual(LatestMetric.objects.count(), 3)
+
+    def test_prefetch_runs_a_single_query(self):
+        nodes = []
+        for i in range(20):
+            nodes.append(Node.objects.create(mac=f"00:00:00:00:01:{i:02x}", name=str(i), mesh=self.mesh))
+            RTTMetric.objects.create(mac=nodes[-1].mac, created=self.now, rtt_avg=float(i))
+        nodes = list(Node.objects.filter(mesh=self.mesh).order_by("mac"))
+        with self.assertNumQueries(1, using="metrics_db"):
+            Node.prefetch_last_metrics(nodes)
+            self.assertEqual([node.get_rtt() for node in nodes], [float(i) for i in range(20)])
+            self.assertIsNone(nodes[0].last_rate_metric)
+        latest = LatestMetric.objects.latest_metrics([node.mac for node in nodes[:2]], [RTTMetric, UptimeMetric])
+        self.assertEqual(set(latest[RTTMetric]), {nodes[0].mac, nodes[1].mac})
+        self.assertEqual(latest[UptimeMetric], {})
+
+    def test_node_list_prefetches_last_metrics(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="test"))
+        for i in range(10):
+            Node.objects.create(mac=f"00:00:00:00:02:{i:02x}", name=str(i), mesh=self.mesh)
+        with CaptureQueriesContext(connections["metrics_db"]) as queries:
+            response = client.get("/monitoring/devices/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+
+
+class TestRunAllChecks(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.now = timezone.now()
+        meshes = [Mesh.objects.create(name=f"mesh{i}") for i in range(10)]
+        Node.objects.bulk_create(
+            Node(
+                mac=EUI(i),
+                name=str(i),
+                mesh=meshes[i % 10] if i % 100 else None,
+                last_contact=cls.now,
+                ip="10.0.0.1",
+            )
+            for i in range(10_000)
+        )
+        ResourcesMetric.objects.bulk_create(
+            ResourcesMetric(mac=EUI(i), created=cls.now, memory=(i % 100) / 100, cpu=0.1)
+            for i in range(10_000)
+        )
+        RTTMetric.objects.bulk_create(
+            RTTMetric(mac=EUI(i), created=cls.now, rtt_avg=float(i % 1000))
+            for i in range(0, 10_000, 2)
+        )
+
+    def count_queries(self, nodes) -> tuple[int, int]:
+        with CaptureQueriesContext(connections["default"]) as default:
+            with CaptureQueriesContext(connections["metrics_db"]) as metrics:
+                nodes = Node.run_all_checks(nodes)
+                for node in nodes:
+                    node.get_health_status()
+        return len(default), len(metrics)
+
+    def test_constant_queries(self):
+        """Checking 10k nodes takes as many queries as checking 10 nodes."""
+        macs = [EUI(i) for i in range(10)]
+        self.assertEqual(self.count_queries(Node.objects.filter(mac__in=macs)), (1, 1))
+        self.assertEqual(self.count_queries(Node.objects.all()), (1, 1))
+        # Lists of nodes get their mesh settings prefetched instead
+        self.assertEqual(self.count_queries(list(Node.objects.all())), (2, 1))
+
+    def test_same_results_as_single_node(self):
+        macs = [EUI(i) for i in (0, 1, 2, 3, 150, 199)]
+        nodes = Node.run_all_checks(Node.objects.filter(mac__in=macs).order_by("mac"))
+        for node in nodes:
+            single = Node.objects.get(mac=node.mac)
+            self.assertEqual(node.check_results, single.check_results)
+            self.assertEqual(node.get_health_status(), single.get_health_status())
+        # Nodes without a mesh have no settings to check against
+        self.assertIn(None, [result.passed for result in nodes[0].check_results])
+
+
+class TestMetricBuffer(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    def setUp(self):
+        self.created = timezone.now()
+
+    def metrics(self, n: int, mac: str = "00:00:00:00:00:01") -> list[Metric]:
+        metrics = []
+        for i in range(n):
+            self.created += timedelta(seconds=1)
+            metrics.append(RTTMetric(mac=mac, created=self.created, rtt_avg=float(i)))
+        return metrics
+
+    def test_flushes_every_n_metrics(self):
+        buffer = MetricBuffer(size=10, interval=60, max_size=100)
+        buffer.add(self.metrics(5))
+        buffer.add([UptimeMetric(mac="00:00:00:00:00:01", reachable=True, loss=0)])
+        self.assertFalse(RTTMetric.objects.exists())
+        with CaptureQueriesContext(connections["metrics_db"]) as queries:
+            buffer.add(self.metrics(4))
+        inserts = [q for q in queries if "INSERT" in q["sql"]]
+        # One insert per metric type, plus its rollups & latest metrics
+        self.assertEqual(len(inserts), 2 * 3)
+        self.assertEqual(RTTMetric.objects.count(), 9)
+        self.assertEqual(UptimeMetric.objects.count(), 1)
+        self.assertIsNotNone(LatestMetric.objects.latest_metrics([EUI(1)], [RTTMetric])[RTTMetric])
+        self.assertEqual(buffer.count, 0)
+
+    def test_flushes_every_t_seconds(self):
+        buffer = MetricBuffer(size=100, interval=5, max_size=1000)
+        with mock.patch("metrics.buffer.time.monotonic", return_value=100.0) as monotonic:
+            buffer.add(self.metrics(2))
+            monotonic.return_value = 104.0
+            buffer.add(self.metrics(2))
+            self.assertFalse(RTTMetric.objects.exists())
+            monotonic.return_value = 105.0
+            self.assertTrue(buffer.is_due())
+            buffer.add(self.metrics(1))
+        self.assertEqual(RTTMetric.objects.count(), 5)
+        self.assertEqual(buffer.count, 0)
+        buffer.stop()
+
+    def test_backpressure_when_locked(self):
+        buffer = MetricBuffer(size=5, interval=60, max_size=10)
+        locked = OperationalError("database is locked")
+        with mock.patch.object(MetricsQuerySet, "ingest", side_effect=locked):
+            # Metrics are kept for the next flush
+            with self.assertLogs("metrics.buffer", "WARNING"):
+                buffer.add(self.metrics(8))
+            self.assertEqual(buffer.count, 8)
+            with self.assertRaises(BufferFull):
+                buffer.add(self.metrics(3))
+            self.assertEqual(buffer.count, 8)
+        # Adding to a full buffer flushes it first
+        buffer.add(self.metrics(3))
+        self.assertEqual(RTTMetric.objects.count(), 8)
+        buffer.flush()
+        self.assertEqual(RTTMetric.objects.count(), 11)
+        self.assertEqual(list(RTTMetric.objects.order_by("id").values_list("rtt_avg", flat=True)[:3]), [0.0, 1.0, 2.0])
+
+    def test_rejects_incomplete_metrics(self):
+        buffer = MetricBuffer(size=10, interval=60, max_size=100)
+        with self.assertRaisesMessage(ValueError, "ResourcesMetric for 00:00:00:00:00:01 misses memory"):
+            buffer.add([ResourcesMetric(mac="00:00:00:00:00:01", cpu=1.0)])
+        self.assertEqual(buffer.count, 0)
+
+    def test_failing_type_doesnt_drop_others(self):
+        buffer = MetricBuffer(size=100, interval=60, max_size=1000)
+        buffer.add(self.metrics(3))
+        buffer.add([UptimeMetric(mac="00:00:00:00:00:01", reachable=True, loss=0)])
+        ingest = MetricsQuerySet.ingest
+
+        def failing_ingest(qs, objs):
+            if qs.model is UptimeMetric:
+                raise IntegrityError("NOT NULL constraint failed")
+            return ingest(qs, objs)
+
+        with mock.patch.object(MetricsQuerySet, "ingest", failing_ingest), self.assertLogs("metrics.buffer", "ERROR"):
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(RTTMetric.objects.count(), 3)
+        self.assertFalse(UptimeMetric.objects.exists())
+        self.assertEqual(buffer.count, 0)
+
+    def test_bulk_sync_buffers_metrics(self):
+        now = timezone.now()
+
+        @bulk_sync(DataRateMetric)
+        def sync_rates(cursor):
+            for i, mac in enumerate(cursor):
+                yield {"mac": mac, "tx_rate": i, "rx_rate": i}, {"created": now}
+
+        buffer = MetricBuffer(size=1000, interval=60, max_size=10000)
+        with mock.patch("sync.utils.get_buffer", return_value=buffer):
+            sync_rates(["00:00:00:00:00:01", "00:00:00:00:00:02"])
+            self.assertEqual(buffer.count, 2)
+            buffer.flush()
+            # Syncing again doesn't duplicate metrics
+            sync_rates(["00:00:00:00:00:01", "00:00:00:00:00:02"])
+            self.assertEqual(buffer.flush(), 0)
+        # Metrics of different nodes at the same time are all kept
+        self.assertEqual(DataRateMetric.objects.filter(created=now).count(), 2)
+
+
+class TestIngest(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    def setUp(self):
+        self.start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+
+    def rtt(self, minutes: int, rtt_avg: float = 1.0, **fields) -> RTTMetric:
+        return RTTMetric(mac="00:00:00:00:00:01", created=self.start + timedelta(minutes=minutes), rtt_avg=rtt_avg, **fields)
+
+    def test_ingest_is_idempotent(self):
+        created = RTTMetric.objects.ingest([self.rtt(0), self.rtt(5), self.rtt(5, 2.0)])
+        self.assertEqual(len(created), 2)
+        self.assertEqual(RTTMetric.objects.ingest([self.rtt(0), self.rtt(5)]), [])
+        created = RTTMetric.objects.ingest([self.rtt(5), self.rtt(10, 3.0)])
+        self.assertEqual([m.rtt_avg for m in created], [3.0])
+        self.assertEqual(RTTMetric.objects.count(), 3)
+        # Skipped metrics aren't added to the rollups
+        rollup = MetricRollup.objects.get(field="rtt_avg", granularity=Metric.Granularity.HOURLY)
+        self.assertEqual((rollup.count, rollup.sum), (3, 5.0))
+
+    def test_concurrent_inserts_are_not_rolled_up(self):
+        # Insert a metric behind ingest's back, as a concurrent writer would
+        models.QuerySet.bulk_create(RTTMetric.objects.all(), [self.rtt(0)])
+        with mock.patch.object(MetricsQuerySet, "values_list", return_value=[]):
+            created = RTTMetric.objects.ingest([self.rtt(0, 2.0), self.rtt(5, 3.0)])
+        self.assertEqual([m.rtt_avg for m in created], [3.0])
+        self.assertEqual(RTTMetric.objects.count(), 2)
+        rollup = MetricRollup.objects.get(field="rtt_avg", granularity=Metric.Granularity.HOURLY)
+        self.assertEqual((rollup.count, rollup.sum), (1, 3.0))
+
+    def test_aggregated_buckets_are_skipped(self):
+        RTTMetric.objects.create(
+            mac="00:00:00:00:00:01", created=self.start + timedelta(minutes=30), rtt_avg=1.0,
+            granularity=Metric.Granularity.HOURLY,
+        )
+        created = RTTMetric.objects.ingest([self.rtt(10), self.rtt(70)])
+        self.assertEqual([m.created for m in created], [self.start + timedelta(minutes=70)])
+        with self.assertRaises(IntegrityError):
+            RTTMetric.objects.bulk_create([self.rtt(70)])
+
+
+class TestUniqueMetricsMigration(TransactionTestCase):
+
+    databases = {"default", "metrics_db"}
+
+    def migrate(self, target: str):
+        executor = MigrationExecutor(connections["metrics_db"])
+        executor.migrate([("metrics", target)])
+        return executor.loader.project_state([("metrics", target)]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connections["metrics_db"])
+        executor.migrate(executor.loader.graph.leaf_nodes("metrics"))
+
+    def test_duplicates_are_removed_from_rollups(self):
+        apps = self.migrate("0004_standalone_metric_tables")
+        OldRTTMetric = apps.get_model("metrics", "RTTMetric")
+        start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        OldRTTMetric.objects.using("metrics_db").bulk_create([
+            OldRTTMetric(mac=EUI(1), created=start, rtt_min=1.0, rtt_avg=2.0, rtt_max=3.0),
+            OldRTTMetric(mac=EUI(1), created=start + timedelta(minutes=5), rtt_min=1.0, rtt_avg=4.0, rtt_max=5.0),
+            # Synced twice
+            OldRTTMetric(mac=EUI(1), created=start + timedelta(minutes=5), rtt_min=1.0, rtt_avg=4.0, rtt_max=5.0),
+        ])
+        self.migrate("0011_latestmetric")
+        rollups = MetricRollup.objects.filter(field="rtt_avg").values_list("count", "sum", "max")
+        self.assertEqual(list(rollups), [(3, 10.0, 4.0)] * 3)
+        self.migrate("0012_metric_unique")
+        self.assertEqual(RTTMetric.objects.count(), 2)
+        self.assertEqual(list(rollups.all()), [(2, 6.0, 4.0)] * 3)
+
+
+class TestQueryPlans(TestCase):
+    """Hot metrics queries should search the metric indexes, never scan whole tables."""
+
+    databases = {"default", "metrics_db"}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.now = timezone.now()
+        cls.mac = "00:00:00:00:00:05"
+        RTTMetric.objects.bulk_create(
+            RTTMetric(
+                mac=f"00:00:00:00:00:{i:02x}",
+                created=cls.now - timedelta(minutes=5 * j),
+                granularity=None if j < 100 else Metric.Granularity.HOURLY,
+                rtt_avg=1.0,
+            )
+            for i in range(50)
+            for j in range(200)
+        )
+
+    def query_plans(self, func) -> list[str]:
+        """Get the query plan of each query made by func."""
+        connection = connections["metrics_db"]
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        plans = []
+        for query in queries:
+            if not query["sql"].startswith(("SELECT", "DELETE")):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                plans.append("\n".join(row[-1] for row in cursor.fetchall()))
+        self.assertTrue(plans)
+        return plans
+
+    def assertSearches(self, func):
+        for plan in self.query_plans(func):
+            self.assertNotRegex(plan, r"(^|\n)SCAN metrics_", plan)
+            self.assertRegex(plan, r"SEARCH metrics_\w+ USING (COVERING )?INDEX", plan)
+
+    def test_filtered_series(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="test"))
+        min_time = int((self.now - timedelta(days=1)).timestamp())
+        self.assertSearches(lambda: client.get("/metrics/rtt/", {"mac": self.mac, "min_time": min_time}))
+        self.assertSearches(
+            lambda: client.get("/metrics/rtt/", {"mac": self.mac, "min_time": min_time, "granularity": "HOURLY"})
+        )
+
+    def test_last_metric(self):
+        node = Node(mac=self.mac)
+        self.assertSearches(lambda: node.last_rtt_metric)
+        (plan,) = self.query_plans(lambda: Node(mac=self.mac).last_rtt_metric)
+        self.assertNotIn("TEMP B-TREE", plan)
+        self.assertSearches(lambda: LatestMetric.objects.latest_metrics([self.mac], [RTTMetric]))
+
+    def test_aggregation_and_retention(self):
+        self.assertSearches(lambda: tasks.aggregate_metrics(RTTMetric, Metric.Granularity.DAILY))
+        self.assertSearches(lambda: tasks.enforce_retention(RTTMetric))
+
+
+class TestDownsampledEndpoints(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    @classmethod
+    def setUpTestData(cls):
+        # 30 days of five-minutely metrics, with one spike
+        start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        cls.metrics = [
+            RTTMetric(
+                mac="00:00:00:00:00:01",
+                created=start + timedelta(minutes=5 * i),
+                rtt_min=1.0,
+                rtt_avg=500.0 if i == 4321 else 2.0 + i % 7,
+                rtt_max=10.0,
+            )
+            for i in range(30 * 24 * 12)
+        ]
+        RTTMetric.objects.bulk_create(cls.metrics)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="test"))
+
+    def test_points(self):
+        response = self.client.get("/metrics/rtt/", {"mac": "00:00:00:00:00:01", "points": 500})
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.data), 500)
+        self.assertGreater(len(response.data), 250)
+        avg = sum(m["rtt_avg"] for m in response.data) / len(response.data)
+        expected = sum(m.rtt_avg for m in self.metrics) / len(self.metrics)
+        self.assertAlmostEqual(avg, expected, delta=0.5)
+
+    def test_bucket(self):
+        response = self.client.get("/metrics/rtt/", {"bucket": "1d"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 30)
+        self.assertAlmostEqual(
+            response.data[0]["rtt_avg"],
+            sum(m.rtt_avg for m in self.metrics[:288]) / 288,
+        )
+
+    def test_lttb(self):
+        response = self.client.get(
+            "/metrics/rtt/", {"points": 100, "downsample": "lttb", "field": "rtt_avg"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 100)
+        # LTTB selects actual samples, including the spike
+        self.assertIn(500.0, [m["rtt_avg"] for m in response.data])
+        self.assertIsNotNone(response.data[0]["id"])
+
+    def test_lttb_selects_in_chunks(self):
+        """The selected metrics are read in chunks, which stay below SQLite's parameter limit."""
+        params = {"points": 100, "downsample": "lttb", "field": "rtt_avg"}
+        expected = self.client.get("/metrics/rtt/", params).data
+        with mock.patch.object(views.DownsampleMixin, "LTTB_CHUNK_SIZE", 30):
+            with CaptureQueriesContext(connections["metrics_db"]) as queries:
+                response = self.client.get("/metrics/rtt/", params)
+        self.assertEqual(response.data, expected)
+        self.assertEqual(len([q for q in queries if '"id" IN' in q["sql"]]), 4)
+
+
+class TestTierPlanning(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.now = datetime(2026, 3, 1, 12, 30, tzinfo=dt_timezone.utc)
+        hour = timedelta(hours=1)
+        day = timedelta(days=1)
+        midnight = cls.now.replace(hour=0, minute=0)
+        # Daily metrics until two days ago, hourly metrics since then & raw
+        # metrics for the last hour, like the aggregation tasks leave them
+        RTTMetric.objects.bulk_create(
+            RTTMetric(mac="00:00:00:00:00:01", created=midnight - day * i - day / 2,
+                      granularity=Metric.Granularity.DAILY, rtt_avg=1.0)
+            for i in range(1, 90)
+        )
+        RTTMetric.objects.bulk_create(
+            RTTMetric(mac="00:00:00:00:00:01", created=cls.now.replace(minute=0) - hour * i - hour / 2,
+                      granularity=Metric.Granularity.HOURLY, rtt_avg=2.0)
+            for i in range(1, 36)
+        )
+        RTTMetric.objects.bulk_create(
+            RTTMetric(mac="00:00:00:00:00:01", created=cls.now - timedelta(minutes=5 * i), rtt_avg=3.0)
+            for i in range(12)
+        )
+
+    def filtered(self, **params) -> list[RTTMetric]:
+        view = views.RTTViewSet(request=Request(APIRequestFactory().get("/", params)), format_kwarg=None)
+        return list(view.filter_queryset(view.get_queryset()))
+
+    def test_coarsest_tier_within_budget(self):
+        min_time = int((self.now - timedelta(days=30)).timestamp())
+        max_time = int(self.now.timestamp()) + 60
+        metrics = self.filtered(min_time=min_time, max_time=max_time, points=100)
+        # Daily metrics, followed by the hourly & raw metrics since the last daily bucket
+        last_daily = max(m.created for m in metrics if m.granularity == Metric.Granularity.DAILY)
+        self.assertTrue(all(
+            m.granularity == Metric.Granularity.DAILY or m.created > last_daily for m in metrics
+        ))
+        self.assertEqual(len([m for m in metrics if m.granularity == Metric.Granularity.DAILY]), 28)
+        self.assertEqual(len([m for m in metrics if m.granularity == Metric.Granularity.HOURLY]), 35)
+        self.assertEqual(len([m for m in metrics if m.granularity is None]), 12)
+
+    def test_finer_tiers_for_short_ranges(self):
+        min_time = int((self.now - timedelta(hours=30)).timestamp())
+        metrics = self.filtered(min_time=min_time, max_time=int(self.now.timestamp()) + 60, points=100)
+        self.assertEqual(len(metrics), 28 + 12)
+        # Only hourly & raw metrics exist for the range, even if they exceed the budget
+        metrics = self.filtered(min_time=min_time, points=20)
+        self.assertEqual(len(metrics), 28 + 12)
+        # An explicit granularity is respected
+        metrics = self.filtered(min_time=min_time, points=100, granularity="HOURLY")
+        self.assertEqual(len(metrics), 28)
+        # Everything fits in the budget
+        self.assertEqual(len(self.filtered(points=1000)), 89 + 35 + 12)
+
+    def test_invalid_points_are_ignored(self):
+        self.assertEqual(len(self.filtered(points=0)), 89 + 35 + 12)
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="test"))
+        response = client.get("/metrics/rtt/", {"points": -5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 89 + 35 + 12)
+
+
+class TestColumnarFormat(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="test"))
+
+    def create_failures(self, n: int, granularity=None):
+        start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        FailuresMetric.objects.bulk_create(
+            FailuresMetric(
+                mac=f"00:00:00:00:00:{i % 10:02x}",
+                created=start + timedelta(minutes=5 * i),
+                granularity=granularity,
+                tx_packets=i % 50,
+                rx_packets=i,
+                tx_retries=None if i % 13 == 0 else i % 7,
+                tx_dropped=i % 3,
+            )
+            for i in range(n)
+        )
+
+    def test_columns_match_serialized_rows(self):
+        self.create_failures(200)
+        rows = self.client.get("/metrics/failures/", {"mac": "00:00:00:00:00:01"}).data["results"]
+        response = self.client.get("/metrics/failures/", {"mac": "00:00:00:00:00:01", "format": "columnar"})
+        self.assertEqual(response.status_code, 200)
+        columns = response.json()["results"]
+        self.assertEqual(len(columns["created"]), len(rows))
+        for fn, values in columns.items():
+            self.assertEqual(values, [row[fn] for row in rows], fn)
+
+    def test_downsampled_columns(self):
+        self.create_failures(1000)
+        response = self.client.get(
+            "/metrics/failures/", {"mac": "00:00:00:00:00:01", "points": 10, "format": "columnar"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.json()["tx_packets"]), 10)
+
+    def test_invalid_downsampling_columns(self):
+        """Invalid points or buckets don't downsample, the columns are paginated instead."""
+        self.create_failures(20)
+        for params in ({"points": 1}, {"bucket": "xx"}):
+            response = self.client.get("/metrics/failures/", {**params, "format": "columnar"})
+            self.assertEqual(response.status_code, 200, params)
+            self.assertEqual(len(response.json()["results"]["created"]), 20, params)
+
+    def test_large_payload(self):
+        """At 100k rows, columns are read as value tuples in a single query, without
+        creating metric instances, and match the (much larger) serialized rows."""
+        self.create_failures(100_000, granularity=Metric.Granularity.HOURLY)
+        qs = FailuresMetric.objects.all()
+        json_payload = JSONRenderer().render(FailuresMetricSerializer(qs, many=True).data)
+        no_instances = mock.patch.object(FailuresMetric, "from_db", side_effect=AssertionError("metric instance"))
+        with no_instances, self.assertNumQueries(1, using="metrics_db"):
+            columnar_payload = ColumnarRenderer().render(FailuresMetricSerializer.columns(qs))
+        self.assertLess(len(columnar_payload) * 2, len(json_payload), (len(columnar_payload), len(json_payload)))
+        rows, columns = json.loads(json_payload), json.loads(columnar_payload)
+        self.assertEqual(len(columns["created"]), 100_000)
+        for fn, values in columns.items():
+            self.assertEqual(values, [row[fn] for row in rows], fn)
+
+
+class TestPaginationAndExport(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    @classmethod
+    def setUpTestData(cls):
+        # Metrics of a ping cycle share their creation time
+        start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        UptimeMetric.objects.bulk_create(
+            UptimeMetric(
+                mac=f"00:00:00:00:{i // 256:02x}:{i % 256:02x}",
+                created=start + timedelta(minutes=5 * (i // 1000)),
+                reachable=i % 2,
+                loss=i % 100,
+            )
+            for i in range(2500)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="test"))
+
+    def test_pages(self):
+        ids = []
+        url = "/metrics/uptime/?page_size=600"
+        pages = 0
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(m["id"] for m in response.data["results"])
+            url = response.data["next"]
+            pages += 1
+        self.assertEqual(pages, 5)
+        self.assertEqual(ids, sorted(UptimeMetric.objects.values_list("id", flat=True)))
+
+    def test_columnar_pages(self):
+        response = self.client.get("/metrics/uptime/", {"format": "columnar", "page_size": 1800})
+        first = response.json()
+        self.assertEqual(len(first["results"]["id"]), 1800)
+        second = self.client.get(first["next"]).json()
+        self.assertIsNone(second["next"])
+        self.assertEqual(first["results"]["id"] + second["results"]["id"], list(range(1, 2501)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/metrics/uptime/", {"cursor": "nope"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_export_ndjson(self):
+        with mock.patch.object(views.ExportMixin, "EXPORT_CHUNK_SIZE", 1000):
+            response = self.client.get("/metrics/uptime/export/", {"mac": "00:00:00:00:00:07"})
+            self.assertEqual(response["Content-Type"], "application/x-ndjson")
+            lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual(row["mac"], "00:00:00:00:00:07")
+        self.assertEqual(row["loss"], 7)
+
+    def test_export_csv(self):
+        with mock.patch.object(views.ExportMixin, "EXPORT_CHUNK_SIZE", 1000):
+            response = self.client.get("/metrics/uptime/export/", {"output": "csv"})
+            rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:3], ["id", "created", "mac"])
+        self.assertEqual(len(rows), 2501)
+        self.assertEqual([int(row[0]) for row in rows[1:]], list(range(1, 2501)))
+
+
+class TestBatchEndpoint(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    @classmethod
+    def setUpTestData(cls):
+        mesh = Mesh.objects.create(name="mesh")
+        start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        rtts, uptimes = [], []
+        for i in range(5):
+            mac = f"00:00:00:00:00:{i:02x}"
+            Node.objects.create(mac=mac, name=f"node{i}", ip=f"10.0.0.{i}", mesh=mesh if i < 3 else None)
+            for j in range(24):
+                created = start + timedelta(minutes=10 * j)
+                rtts.append(RTTMetric(mac=mac, created=created, rtt_avg=float(i + j)))
+                uptimes.append(UptimeMetric(mac=mac, created=created, reachable=True, loss=j % 2 * 50))
+        RTTMetric.objects.bulk_create(rtts)
+        UptimeMetric.objects.bulk_create(uptimes)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="test"))
+
+    def test_mesh_series_in_buckets(self):
+        with CaptureQueriesContext(connections["metrics_db"]) as queries:
+            response = self.client.get("/metrics/batch/", {"mesh": "mesh", "types": "rtt,uptime", "bucket": "1h"})
+        self.assertEqual(response.status_code, 200)
+        # One query per metric type
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(set(response.data), {"rtt", "uptime"})
+        self.assertEqual(set(response.data["rtt"]), {"00:00:00:00:00:00", "00:00:00:00:00:01", "00:00:00:00:00:02"})
+        rtt = response.data["rtt"]["00:00:00:00:00:02"]
+        self.assertEqual(len(rtt["created"]), 4)
+        self.assertEqual(rtt["rtt_avg"], [2 + 2.5, 2 + 8.5, 2 + 14.5, 2 + 20.5])
+        self.assertEqual(response.data["uptime"]["00:00:00:00:00:00"]["loss"], [25.0] * 4)
+
+    def test_raw_series_for_macs(self):
+        response = self.client.get("/metrics/batch/", {
+            "macs": "00:00:00:00:00:03,00:00:00:00:00:04",
+            "min_time": int(datetime(2026, 1, 1, 3, tzinfo=dt_timezone.utc).timestamp()),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 6)
+        rtt = response.data["rtt"]["00:00:00:00:00:04"]
+        self.assertEqual(rtt["rtt_avg"], [float(4 + j) for j in range(19, 24)])
+        self.assertEqual(response.data["failures"], {})
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get("/metrics/batch/", {"macs": "nope"}).status_code, 400)
+        self.assertEqual(self.client.get("/metrics/batch/", {"types": "rtt,nope"}).status_code, 400)
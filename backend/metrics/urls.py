@@ -11,4 +11,4 @@ router.register("data_usage", views.DataUsageViewSet)
 router.register("data_rate", views.DataRateViewSet)
 router.register("failures", views.FailuresViewSet)
 
-urlpatterns = [path("", include(router.urls))]
+urlpatterns = [path("", include(router.urls)), path("batch/", views.batch)]
@@ -1,77 +1,508 @@
-from datetime import datetime
+from collections import defaultdict
+import csv
+from datetime import datetime, timedelta, timezone
+import io
+import json
+
+from django.db.models import Max, Min, Q
+from django.http import StreamingHttpResponse
+from netaddr import AddrFormatError, EUI
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import DateTimeField
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
+from monitoring.models import Node
+from . import downsample
 from . import models
+from . import pagination
+from . import partitions
+from . import renderers
 from . import serializers
 
 
+def parse_timestamp(value: str | None) -> datetime | None:
+    """Parse a unix timestamp query parameter, None if it's missing or invalid."""
+    try:
+        return datetime.fromtimestamp(int(value), tz=timezone.utc)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def parse_time_range(params, max_range: timedelta) -> tuple[datetime, datetime]:
+    """Parse the 'min_time' & 'max_time' query parameters, at most max_range apart.
+
+    A missing (or too distant) max_time is max_range after min_time, a missing
+    min_time is max_range before max_time, which is now if both are missing.
+    """
+    min_time = parse_timestamp(params.get(FilterMixin.MIN_TIME_FIELD))
+    max_time = parse_timestamp(params.get(FilterMixin.MAX_TIME_FIELD))
+    try:
+        if min_time is None:
+            max_time = max_time or datetime.now(tz=timezone.utc)
+            return max_time - max_range, max_time
+        if max_time is None or max_time - min_time > max_range:
+            max_time = min_time + max_range
+    except OverflowError:
+        raise ValidationError({FilterMixin.MIN_TIME_FIELD: "Time out of range"})
+    return min_time, max_time
+
+
 class FilterMixin:
-    """Allow filtering a view's query set."""
+    """Allow filtering a view's query set.
+
+    If no granularity is requested, a '?points=' budget is used to read the
+    coarsest metrics needed for the requested time range, see :meth:`plan_tiers`.
+    """
 
     MAC_FIELD = "mac"
     MIN_TIME_FIELD = "min_time"
+    MAX_TIME_FIELD = "max_time"
     GRANULARITY_FIELD = "granularity"
+    POINTS_FIELD = "points"
 
     def filter_queryset(self, qs):
-        """Filter against a 'min_time' parameter in the request query."""
+        """Filter against 'mac', 'min_time', 'max_time' & 'granularity' parameters in the request query."""
         qs = super().filter_queryset(qs)
         mac = self.request.query_params.get(self.MAC_FIELD)
-        min_time = self.request.query_params.get(self.MIN_TIME_FIELD)
+        min_time = parse_timestamp(self.request.query_params.get(self.MIN_TIME_FIELD))
+        max_time = parse_timestamp(self.request.query_params.get(self.MAX_TIME_FIELD))
         granularity = self.request.query_params.get(self.GRANULARITY_FIELD)
         if mac is not None:
             qs = qs.filter(mac=mac)
         if min_time is not None:
-            try:
-                min_time_int = int(min_time)
-                qs = qs.filter(created__gt=datetime.fromtimestamp(min_time_int))
-            except ValueError:
-                pass
+            qs = qs.filter(created__gt=min_time)
+        if max_time is not None:
+            qs = qs.filter(created__lt=max_time)
         if granularity is not None:
             try:
                 g = models.Metric.Granularity[granularity]
-                qs = qs.filter(granularity=g)
+                return qs.filter(granularity=g)
             except KeyError:
                 pass
-        return qs
+        try:
+            points = int(self.request.query_params.get(self.POINTS_FIELD))
+        except (TypeError, ValueError):
+            return qs
+        # Budgets without any points are ignored, like invalid numbers
+        if points < 1:
+            return qs
+        return self.plan_tiers(qs, points, min_time, max_time)
+
+    def plan_tiers(self, qs, points: int, min_time: datetime | None, max_time: datetime | None):
+        """Read the coarsest metrics needed to fit a time range in a point budget.
+
+        Raw metrics are read if there are few enough of them, otherwise the
+        finest granularity with at most `points` buckets in the time range is
+        picked. Older metrics only exist at that granularity (or coarser),
+        recent metrics that haven't been aggregated to it yet are read at their
+        finer granularity, so that together they form one continuous series.
+        """
+        if qs[:points + 1].count() <= points:
+            return qs
+        if min_time is None:
+            min_time = qs.aggregate(Min("created"))["created__min"]
+        if max_time is None:
+            max_time = datetime.now(tz=timezone.utc)
+        span = (max_time - min_time).total_seconds()
+        tiers = models.Metric.GRANULARITY_ORDER
+        granularity = next((g for g in tiers if span / g <= points), tiers[-1])
+        last_created = qs.filter(granularity__gte=granularity).aggregate(Max("created"))["created__max"]
+        if last_created is None:
+            return qs
+        # Aggregated metrics are created in the middle of their bucket
+        boundary = last_created + timedelta(seconds=granularity) / 2
+        return qs.filter(Q(granularity__gte=granularity) | Q(created__gte=boundary))
+
+
+class LiveMixin:
+    """Serve up-to-the-minute aggregated metrics from the rollups.
+
+    Buckets are limited to a time range of at most LIVE_MAX_RANGE.
+    """
+
+    LIVE_MAX_RANGE = timedelta(days=62)
+
+    @action(detail=False)
+    def live(self, request):
+        """Aggregated metrics for buckets that haven't been finalized yet."""
+        metric_type = self.get_queryset().model
+        mac = request.query_params.get(FilterMixin.MAC_FIELD)
+        min_time, max_time = parse_time_range(request.query_params, self.LIVE_MAX_RANGE)
+        granularity = request.query_params.get(FilterMixin.GRANULARITY_FIELD, "HOURLY")
+        try:
+            g = models.Metric.Granularity[granularity]
+        except KeyError:
+            g = models.Metric.Granularity.HOURLY
+        rollups = models.MetricRollup.objects.filter(granularity=g)
+        if mac is not None:
+            rollups = rollups.filter(mac=mac)
+        rollups = rollups.filter(bucket__gt=min_time, bucket__lt=max_time)
+        serializer = self.get_serializer(rollups.to_metrics(metric_type), many=True)
+        return Response(serializer.data)
+
+
+class RawMixin:
+    """Serve raw metrics, including those that were packed into chunks.
+
+    Metrics are limited to a time range of at most RAW_MAX_RANGE, since
+    they're read without pagination.
+    """
+
+    RAW_MAX_RANGE = timedelta(days=7)
+
+    @action(detail=False)
+    def raw(self, request):
+        """Raw metrics from chunks, followed by those that haven't been packed yet."""
+        metric_type = self.get_queryset().model
+        mac = request.query_params.get(FilterMixin.MAC_FIELD)
+        min_datetime, max_datetime = parse_time_range(request.query_params, self.RAW_MAX_RANGE)
+        min_day, max_day = min_datetime.date(), max_datetime.date()
+        chunks = models.MetricChunk.objects.filter(
+            metric=metric_type._meta.model_name, day__gte=min_day, day__lte=max_day
+        )
+        metrics = self.get_queryset().filter(
+            granularity__isnull=True, created__gt=min_datetime, created__lt=max_datetime
+        )
+        if mac is not None:
+            chunks = chunks.filter(mac=mac)
+            metrics = metrics.filter(mac=mac)
+        # Chunks of closed months are in the partitions that overlap the time range
+        chunks = [*partitions.read_chunks(metric_type, mac, min_day, max_day), *chunks]
+        chunks.sort(key=lambda chunk: (int(chunk.mac), chunk.day))
+        unpacked = [metric for chunk in chunks for metric in chunk.to_metrics(metric_type)]
+        unpacked = [m for m in unpacked if min_datetime < m.created < max_datetime]
+        serializer = self.get_serializer([*unpacked, *metrics], many=True)
+        return Response(serializer.data)
+
+
+class DownsampleMixin:
+    """Allow downsampling a view's series to a bounded number of points.
+
+    '?points=N' limits each mac's series to at most N points, '?bucket=15m'
+    sets the minimum bucket size. Points are averaged over time buckets,
+    unless '?downsample=lttb' is given, in which case N of the series'
+    points are selected with LTTB based on the '?field=' values.
+    """
 
+    BUCKET_FIELD = "bucket"
+    DOWNSAMPLE_FIELD = "downsample"
+    LTTB_FIELD = "field"
+    LTTB_CHUNK_SIZE = 500
 
-class UptimeViewSet(FilterMixin, ModelViewSet):
+    def get_downsampling(self, request) -> tuple[int | None, int | None]:
+        """Get the requested (points, bucket), both None if the series isn't downsampled."""
+        try:
+            points = int(request.query_params.get(FilterMixin.POINTS_FIELD))
+        except (TypeError, ValueError):
+            points = None
+        if points is not None and points < 2:
+            points = None
+        bucket = downsample.parse_bucket(request.query_params.get(self.BUCKET_FIELD, ""))
+        return points, bucket
+
+    def list(self, request, *args, **kwargs):
+        """List metrics, downsampled if requested."""
+        points, bucket = self.get_downsampling(request)
+        if points is None and bucket is None:
+            return super().list(request, *args, **kwargs)
+        qs = self.filter_queryset(self.get_queryset())
+        if request.query_params.get(self.DOWNSAMPLE_FIELD) == "lttb" and points is not None:
+            metrics = self.lttb_metrics(qs, points)
+        else:
+            metrics = self.bucket_metrics(qs, points, bucket)
+        serializer = self.get_serializer(metrics, many=True)
+        return Response(serializer.data)
+
+    def bucket_metrics(self, qs, points: int | None, bucket: int | None) -> "list[models.Metric]":
+        """Average metrics over epoch-aligned time buckets, in the database."""
+        span = qs.aggregate(start=Min("created"), end=Max("created"))
+        if span["start"] is None:
+            return []
+        interval = downsample.bucket_interval(
+            (span["end"] - span["start"]).total_seconds(), points, bucket
+        )
+        rows = qs.aggregate_buckets(0, interval).order_by("mac", "bucket")
+        return [
+            qs.model(
+                mac=row.pop("mac"),
+                created=datetime.fromtimestamp(
+                    row.pop("bucket") * interval + interval / 2, tz=timezone.utc
+                ),
+                **row,
+            )
+            for row in rows
+        ]
+
+    def lttb_metrics(self, qs, points: int) -> "list[models.Metric]":
+        """Select the metrics in each mac's series with LTTB."""
+        field = self.request.query_params.get(self.LTTB_FIELD)
+        if field not in qs.model.rollup_fields():
+            field = sorted(qs.model.rollup_fields())[0]
+        series = defaultdict(list)
+        rows = qs.exclude(**{f"{field}__isnull": True}).order_by("mac", "created")
+        for pk, mac, created, value in rows.values_list("pk", "mac", "created", field):
+            series[mac].append((pk, created.timestamp(), float(value)))
+        pks = []
+        for rows in series.values():
+            _, xs, ys = zip(*rows)
+            pks.extend(rows[i][0] for i in downsample.lttb(list(xs), list(ys), points))
+        # In chunks, many macs could select more pks than (SQLite) query parameters
+        metrics = []
+        for i in range(0, len(pks), self.LTTB_CHUNK_SIZE):
+            metrics.extend(qs.filter(pk__in=pks[i:i + self.LTTB_CHUNK_SIZE]))
+        return sorted(metrics, key=lambda metric: (metric.mac, metric.created))
+
+
+class ColumnarMixin:
+    """Allow rendering metrics as columns of values with '?format=columnar'.
+
+    Columns are built straight from database rows, without creating or
+    serializing a model instance per metric.
+    """
+
+    def get_renderers(self):
+        """Add the columnar renderer to the default renderers."""
+        return [*super().get_renderers(), renderers.ColumnarRenderer()]
+
+    def list(self, request, *args, **kwargs):
+        """List metrics, as columns if requested."""
+        if request.accepted_renderer.format != renderers.ColumnarRenderer.format:
+            return super().list(request, *args, **kwargs)
+        if isinstance(self, DownsampleMixin) and self.get_downsampling(request) != (None, None):
+            # Downsampled series are small, transpose their serialized rows
+            rows = super().list(request, *args, **kwargs).data
+            return Response({key: [row[key] for row in rows] for key in (rows[0] if rows else {})})
+        qs = self.filter_queryset(self.get_queryset())
+        if self.paginator is None:
+            return Response(self.get_serializer_class().columns(qs))
+        columns = self.get_serializer_class().columns(self.paginator.get_page_queryset(qs, request))
+        page_size = self.paginator.page_size
+        self.paginator.set_next(list(zip(columns["created"], columns["id"])))
+        columns = {fn: values[:page_size] for fn, values in columns.items()}
+        return self.paginator.get_paginated_response(columns)
+
+
+class ExportMixin:
+    """Allow exporting metrics as NDJSON or CSV, streamed in chunks.
+
+    Only a chunk of metrics is held in memory at a time, however many
+    metrics are exported.
+    """
+
+    EXPORT_FORMAT_FIELD = "output"
+    EXPORT_CHUNK_SIZE = 2000
+
+    @action(detail=False)
+    def export(self, request):
+        """Stream all (filtered) metrics, as '?output=ndjson' (the default) or '?output=csv'."""
+        qs = self.filter_queryset(self.get_queryset()).order_by("created", "id")
+        serializer_class = self.get_serializer_class()
+        chunks = serializer_class.iter_columns(qs, chunk_size=self.EXPORT_CHUNK_SIZE)
+        name = qs.model._meta.model_name
+        if request.query_params.get(self.EXPORT_FORMAT_FIELD) == "csv":
+            response = StreamingHttpResponse(self.csv_lines(chunks), content_type="text/csv")
+            response["Content-Disposition"] = f'attachment; filename="{name}.csv"'
+        else:
+            response = StreamingHttpResponse(self.ndjson_lines(chunks), content_type="application/x-ndjson")
+            response["Content-Disposition"] = f'attachment; filename="{name}.ndjson"'
+        return response
+
+    def ndjson_lines(self, chunks):
+        """Write each metric as a line of JSON."""
+        for columns in chunks:
+            fields = list(columns)
+            for row in zip(*columns.values()):
+                yield json.dumps(dict(zip(fields, row))) + "\n"
+
+    def csv_lines(self, chunks):
+        """Write a header line, followed by a line per metric."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        header = False
+        for columns in chunks:
+            if not header:
+                writer.writerow(columns.keys())
+                header = True
+            writer.writerows(zip(*columns.values()))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+
+class UptimeViewSet(
+    ExportMixin,
+    ColumnarMixin,
+    DownsampleMixin,
+    RawMixin,
+    LiveMixin,
+    FilterMixin,
+    ModelViewSet,
+):
     """View/Edit/Add/Delete UptimeMetric items."""
 
     queryset = models.UptimeMetric.objects.all()
     serializer_class = serializers.UptimeMetricSerializer
+    pagination_class = pagination.MetricsPagination
 
 
-class FailuresViewSet(FilterMixin, ModelViewSet):
+class FailuresViewSet(
+    ExportMixin,
+    ColumnarMixin,
+    DownsampleMixin,
+    RawMixin,
+    LiveMixin,
+    FilterMixin,
+    ModelViewSet,
+):
     """View/Edit/Add/Delete FailuresMetric items."""
 
     queryset = models.FailuresMetric.objects.all()
     serializer_class = serializers.FailuresMetricSerializer
+    pagination_class = pagination.MetricsPagination
 
 
-class RTTViewSet(FilterMixin, ModelViewSet):
+class RTTViewSet(
+    ExportMixin,
+    ColumnarMixin,
+    DownsampleMixin,
+    RawMixin,
+    LiveMixin,
+    FilterMixin,
+    ModelViewSet,
+):
     """View/Edit/Add/Delete RTTMetric items."""
 
     queryset = models.RTTMetric.objects.all()
     serializer_class = serializers.RTTMetricSerializer
+    pagination_class = pagination.MetricsPagination
 
 
-class ResourcesViewSet(FilterMixin, ModelViewSet):
+class ResourcesViewSet(
+    ExportMixin,
+    ColumnarMixin,
+    DownsampleMixin,
+    RawMixin,
+    LiveMixin,
+    FilterMixin,
+    ModelViewSet,
+):
     """View/Edit/Add/Delete ResourcesMetric items."""
 
     queryset = models.ResourcesMetric.objects.all()
     serializer_class = serializers.ResourcesMetricSerializer
+    pagination_class = pagination.MetricsPagination
 
 
-class DataUsageViewSet(FilterMixin, ModelViewSet):
+class DataUsageViewSet(
+    ExportMixin,
+    ColumnarMixin,
+    DownsampleMixin,
+    RawMixin,
+    LiveMixin,
+    FilterMixin,
+    ModelViewSet,
+):
     """View/Edit/Add/Delete DataUsageMetric items."""
 
     queryset = models.DataUsageMetric.objects.all()
     serializer_class = serializers.DataUsageMetricSerializer
+    pagination_class = pagination.MetricsPagination
 
 
-class DataRateViewSet(FilterMixin, ModelViewSet):
+class DataRateViewSet(
+    ExportMixin,
+    ColumnarMixin,
+    DownsampleMixin,
+    RawMixin,
+    LiveMixin,
+    FilterMixin,
+    ModelViewSet,
+):
     """View/Edit/Add/Delete DataRateMetric items."""
 
     queryset = models.DataRateMetric.objects.all()
     serializer_class = serializers.DataRateMetricSerializer
+    pagination_class = pagination.MetricsPagination
+
+
+# Metric types served by the batch endpoint, named like their viewsets' routes
+BATCH_METRIC_TYPES = {
+    "uptime": UptimeViewSet,
+    "rtt": RTTViewSet,
+    "resources": ResourcesViewSet,
+    "data_usage": DataUsageViewSet,
+    "data_rate": DataRateViewSet,
+    "failures": FailuresViewSet,
+}
+BATCH_MACS_FIELD = "macs"
+BATCH_MESH_FIELD = "mesh"
+BATCH_TYPES_FIELD = "types"
+
+
+def series_by_mac(columns: dict[str, list]) -> dict[str, dict[str, list]]:
+    """Split columns of metrics into columns per mac address."""
+    macs = columns.pop("mac")
+    series = {}
+    for i, mac in enumerate(macs):
+        mac_columns = series.get(mac)
+        if mac_columns is None:
+            mac_columns = series[mac] = {fn: [] for fn in columns}
+        for fn, values in columns.items():
+            mac_columns[fn].append(values[i])
+    return series
+
+
+@api_view()
+def batch(request):
+    """Series of several metric types for several nodes, in a single request.
+
+    Nodes are given as a comma separated '?macs=' list or a '?mesh=' name and
+    metric types as a comma separated '?types=' list (all types by default).
+    Series can be limited with 'min_time' & 'max_time' and averaged over
+    '?bucket=' sized buckets. Each metric type is read with a single query.
+    """
+    params = request.query_params
+    if BATCH_MESH_FIELD in params:
+        mesh_nodes = Node.objects.filter(mesh_id=params[BATCH_MESH_FIELD])
+        macs = list(mesh_nodes.values_list("mac", flat=True))
+    else:
+        macs = [mac for mac in params.get(BATCH_MACS_FIELD, "").split(",") if mac]
+        try:
+            macs = [EUI(mac) for mac in macs]
+        except (AddrFormatError, TypeError, ValueError):
+            raise ValidationError({BATCH_MACS_FIELD: "Invalid mac address"})
+    types = params.get(BATCH_TYPES_FIELD)
+    types = types.split(",") if types else list(BATCH_METRIC_TYPES)
+    unknown_types = set(types) - BATCH_METRIC_TYPES.keys()
+    if unknown_types:
+        raise ValidationError({BATCH_TYPES_FIELD: f"Unknown metric types: {sorted(unknown_types)}"})
+    min_time = parse_timestamp(params.get(FilterMixin.MIN_TIME_FIELD))
+    max_time = parse_timestamp(params.get(FilterMixin.MAX_TIME_FIELD))
+    bucket = downsample.parse_bucket(params.get(DownsampleMixin.BUCKET_FIELD, ""))
+    created = DateTimeField()
+    result = {}
+    for metric_type in types:
+        viewset = BATCH_METRIC_TYPES[metric_type]
+        qs = viewset.queryset.filter(mac__in=macs)
+        if min_time is not None:
+            qs = qs.filter(created__gt=min_time)
+        if max_time is not None:
+            qs = qs.filter(created__lt=max_time)
+        if bucket is None:
+            result[metric_type] = series_by_mac(viewset.serializer_class.columns(qs))
+            continue
+        rows = list(qs.aggregate_buckets(0, bucket).order_by("mac", "bucket"))
+        fields = sorted(qs.model.rollup_fields())
+        result[metric_type] = series_by_mac({
+            "mac": [str(row["mac"]) for row in rows],
+            "created": [
+                created.to_representation(
+                    datetime.fromtimestamp(row["bucket"] * bucket + bucket / 2, tz=timezone.utc)
+                )
+                for row in rows
+            ],
+            **{fn: [row[fn] for row in rows] for fn in fields},
+        })
+    return Response(result)
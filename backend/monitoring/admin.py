@@ -10,6 +10,7 @@ class NodeAdmin(admin.ModelAdmin):
 
 
 admin.site.register(models.Alert)
+admin.site.register(models.AlertEvent)
 admin.site.register(models.Mesh)
 admin.site.register(models.Service)
 admin.site.register(models.WlanConf)
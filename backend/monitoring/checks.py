@@ -1,6 +1,8 @@
 from dataclasses import dataclass, asdict
-from typing import TYPE_CHECKING, Any
+import operator
+from typing import TYPE_CHECKING, Any, Callable
 from django.conf import settings
+from django.utils import timezone
 
 if TYPE_CHECKING:
     from .models import Node
@@ -8,6 +10,32 @@ else:
     Node = Any
 
 
+# Comparisons of declarative checks
+OPERATORS = {
+    "lt": operator.lt,
+    "lte": operator.le,
+    "gt": operator.gt,
+    "gte": operator.ge,
+}
+
+
+def check_func(check: dict) -> Callable:
+    """Get the function that runs a check in Python.
+
+    Checks are either declared with an "op" comparing the node's value to its
+    mesh's setting (or the time since the value with "age"), or have a "func"
+    taking the value (and setting).
+    """
+    if "func" in check:
+        return check["func"]
+    if "op" not in check:
+        return bool
+    compare = OPERATORS[check["op"]]
+    if check.get("age"):
+        return lambda v, s: compare(timezone.now() - v, s)
+    return compare
+
+
 @dataclass
 class CheckResult:
     """The result for a particular device check."""
@@ -26,7 +54,7 @@ class CheckResults(list[CheckResult]):
         """Run checks for a node and return the results."""
         results = cls()
         for check in settings.DEVICE_CHECKS:
-            check_func = check.get("func", bool)
+            func = check_func(check)
             key = check["key"]
             setting_value = None
             # Metric is an attribute of the node
@@ -37,10 +65,12 @@ class CheckResults(list[CheckResult]):
                 get_func = getattr(node, f"get_{check['key']}")
                 value = get_func()
             if "setting" in check:
-                setting_value = getattr(node.mesh.settings, check["setting"])
+                # Nodes that aren't in a mesh (yet) have no settings
+                mesh_settings = getattr(node.mesh, "settings", None)
+                setting_value = getattr(mesh_settings, check["setting"], None)
                 # Pass the setting value to the check func as well as the metric
                 if value is not None and setting_value is not None:
-                    passed = check_func(value, setting_value)
+                    passed = func(value, setting_value)
                     feedbackType = passed
                 else:
                     passed = None
@@ -48,7 +78,7 @@ class CheckResults(list[CheckResult]):
             else:
                 # Just pass the metric, the check doesn't depend on settings
                 if value is not None:
-                    passed = check_func(value)
+                    passed = func(value)
                     feedbackType = passed
                 else:
                     passed = None
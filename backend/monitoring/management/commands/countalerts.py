@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from monitoring.models import Node
+
+
+class Command(BaseCommand):
+
+    help = "Recount the unresolved alerts of all nodes, e.g. after loaddata."
+
+    def handle(self, *args, **options):
+        count = Node.objects.count_unresolved_alerts()
+        self.stdout.write(f"Recounted the unresolved alerts of {count} nodes")
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:31
+
+from datetime import datetime, timezone as dt_timezone
+import re
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+# Legacy events were prefixed with the (UTC) time they were added at, the
+# text of upgrades with the time of the alert they were upgraded with too
+LEGACY_TIMESTAMP = re.compile(r"_(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)_ ")
+
+
+def legacy_events(text, modified):
+    """Split the text of a legacy alert into (created, text) events, oldest first."""
+    events = []
+    for line in reversed(text.splitlines()):
+        created = None
+        while match := LEGACY_TIMESTAMP.match(line):
+            if created is None:
+                created = datetime.strptime(match[1], "%Y-%m-%d %H:%M:%S").replace(tzinfo=dt_timezone.utc)
+            line = line[match.end():]
+        if line:
+            events.append((created or modified, line))
+    return events
+
+
+def backfill_alert_events(apps, schema_editor):
+    """Keep the history of existing alerts, which is in their text, as their events."""
+    Alert = apps.get_model("monitoring", "Alert")
+    AlertEvent = apps.get_model("monitoring", "AlertEvent")
+    db = schema_editor.connection.alias
+    AlertEvent.objects.using(db).bulk_create(
+        (
+            AlertEvent(alert_id=alert.pk, created=created, text=text)
+            for alert in Alert.objects.using(db).iterator()
+            for created, text in legacy_events(alert.text, alert.modified)
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0005_remove_meshsettings_check_download_speed_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('text', models.CharField(max_length=255)),
+                ('alert', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='monitoring.alert')),
+            ],
+            options={
+                'ordering': ['-created', '-id'],
+                'indexes': [models.Index(fields=['alert', '-created'], name='alert_event_alert_created')],
+            },
+        ),
+        migrations.RunPython(backfill_alert_events, migrations.RunPython.noop),
+    ]
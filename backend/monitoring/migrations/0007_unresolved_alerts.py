@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:34
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_unresolved_alerts(apps, schema_editor):
+    """Set the number of unresolved alerts of existing nodes."""
+    Alert = apps.get_model("monitoring", "Alert")
+    Node = apps.get_model("monitoring", "Node")
+    db = schema_editor.connection.alias
+    unresolved = (
+        Alert.objects.using(db)
+        .exclude(status=4)
+        .filter(node=OuterRef("pk"))
+        .order_by()
+        .values("node")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    Node.objects.using(db).update(num_unresolved_alerts=Coalesce(Subquery(unresolved), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0006_alertevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='num_unresolved_alerts',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='The number of unresolved alerts of this device, kept up to date when alerts are saved'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(condition=models.Q(('status', 4), _negated=True), fields=['node', 'type', 'created'], name='alert_unresolved_node'),
+        ),
+        migrations.RunPython(count_unresolved_alerts, migrations.RunPython.noop),
+    ]
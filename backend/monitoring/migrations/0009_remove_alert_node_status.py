@@ -0,0 +1,17 @@
+# Generated by Django 5.1 on 2026-10-18 18:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0008_alert_node_status'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='alert',
+            name='alert_node_status',
+        ),
+    ]
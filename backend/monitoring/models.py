@@ -1,12 +1,21 @@
+from collections import defaultdict
+
+from django.conf import settings
 from django.utils.functional import cached_property
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import OuterRef, Subquery, prefetch_related_objects
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
 from django.contrib.auth.models import User
 from django.utils import timezone
 from macaddress.fields import MACAddressField
 
-from metrics.models import ResourcesMetric, RTTMetric, DataRateMetric
+from metrics.models import LatestMetric, ResourcesMetric, RTTMetric, DataRateMetric
 from .checks import CheckResults
 
+# Metric types of which nodes keep the last metric, see Node.last_metrics
+LAST_METRIC_TYPES = [DataRateMetric, ResourcesMetric, RTTMetric]
+
 
 class WlanConf(models.Model):
     """Fireless configuration."""
@@ -59,6 +68,22 @@ class MeshSettings(models.Model):
     check_hourly_uptime = models.IntegerField(null=True, blank=True)
 
 
+class NodeQuerySet(models.QuerySet):
+    """Custom queryset for nodes."""
+
+    def count_unresolved_alerts(self) -> int:
+        """Update the number of unresolved alerts of the nodes in a single UPDATE."""
+        unresolved = (
+            Alert.objects.unresolved()
+            .filter(node=OuterRef("pk"))
+            .order_by()
+            .values("node")
+            .annotate(count=models.Count("pk"))
+            .values("count")
+        )
+        return self.update(num_unresolved_alerts=Coalesce(Subquery(unresolved), 0))
+
+
 class Node(models.Model):
     """Database table for network devices.
 
@@ -179,6 +204,16 @@ class Node(models.Model):
     created = models.DateTimeField(
         auto_now_add=True, help_text="The date & time this device was created"
     )
+    num_unresolved_alerts = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="The number of unresolved alerts of this device, kept up to date when alerts are saved",
+    )
+
+    objects = NodeQuerySet.as_manager()
+
+    # Number of alerts served with a node
+    LATEST_ALERTS = 10
 
     @property
     def online(self) -> bool:
@@ -191,22 +226,57 @@ class Node(models.Model):
         self.status = Node.Status.ONLINE if is_online else Node.Status.OFFLINE
 
     @cached_property
+    def last_metrics(self) -> dict:
+        """Get the last data rate, resources & RTT metrics for this node."""
+        latest = LatestMetric.objects.latest_metrics([self.mac], LAST_METRIC_TYPES)
+        return {metric_type: metrics.get(self.mac) for metric_type, metrics in latest.items()}
+
+    @classmethod
+    def prefetch_last_metrics(cls, nodes: list["Node"]) -> None:
+        """Fetch the last metrics for many nodes with a single query.
+
+        This populates the cached last_metrics property of each node, which
+        would otherwise run a query per node.
+        """
+        latest = LatestMetric.objects.latest_metrics([node.mac for node in nodes], LAST_METRIC_TYPES)
+        for node in nodes:
+            node.last_metrics = {
+                metric_type: metrics.get(node.mac) for metric_type, metrics in latest.items()
+            }
+
+    @classmethod
+    def run_all_checks(cls, nodes: "models.QuerySet[Node] | list[Node]") -> list["Node"]:
+        """Run the health checks of many nodes with a constant number of queries.
+
+        The nodes' mesh settings are loaded along with them, and their last
+        metrics with a single query, after which all checks are evaluated in
+        memory. This populates the cached check_results property of each node,
+        from which get_health_status() is computed.
+        """
+        if isinstance(nodes, models.QuerySet):
+            nodes = list(nodes.select_related("mesh__settings"))
+        else:
+            nodes = list(nodes)
+            prefetch_related_objects(nodes, "mesh__settings")
+        cls.prefetch_last_metrics(nodes)
+        for node in nodes:
+            node.check_results = CheckResults.run_checks(node)
+        return nodes
+
+    @property
     def last_rate_metric(self) -> DataRateMetric | None:
         """Get the last data rate metric for this node."""
-        qs = DataRateMetric.objects.filter(
-            mac=self.mac, tx_rate__isnull=False, rx_rate__isnull=False
-        )
-        return qs.order_by("-created").first()
+        return self.last_metrics[DataRateMetric]
 
-    @cached_property
+    @property
     def last_resource_metric(self) -> ResourcesMetric | None:
         """Get the last resource for this node."""
-        return ResourcesMetric.objects.filter(mac=self.mac).order_by("-created").first()
+        return self.last_metrics[ResourcesMetric]
 
-    @cached_property
+    @property
     def last_rtt_metric(self) -> RTTMetric | None:
         """Get the last RTT for this node."""
-        return RTTMetric.objects.filter(mac=self.mac).order_by("-created").first()
+        return self.last_metrics[RTTMetric]
 
     @cached_property
     def check_results(self) -> CheckResults:
@@ -253,15 +323,41 @@ class Node(models.Model):
         if save:
             self.save(update_fields=["health_status"])
 
+    def save(self, *args, **kwargs):
+        """Save this node, without overwriting its number of unresolved alerts.
+
+        That number is only updated by alerts (see NodeQuerySet.count_unresolved_alerts),
+        which a stale instance would otherwise overwrite.
+        """
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "num_unresolved_alerts"
+            ]
+        super().save(*args, **kwargs)
+
+    def latest_alerts(self) -> list["Alert"]:
+        """Get the first LATEST_ALERTS alerts of this node, with their newest events."""
+        if hasattr(self, "prefetched_alerts"):
+            return self.prefetched_alerts
+        return list(Alert.objects.with_events().filter(node=self).order_by("created")[:Node.LATEST_ALERTS])
+
+    @classmethod
+    def prefetch_latest_alerts(cls, nodes: list["Node"]) -> None:
+        """Fetch the latest alerts of many nodes, and their events, with two queries."""
+        alerts = Alert.objects.with_events().order_by("created")[:cls.LATEST_ALERTS]
+        prefetch_related_objects(
+            nodes, models.Prefetch("alerts", queryset=alerts, to_attr="prefetched_alerts")
+        )
+
     def generate_alert(self) -> bool:
         """Generate an alert for this node, returns False if no alert is generated."""
         alert = Alert.from_node(self)
         # No alert was generated for this node, nothing to do
         if not alert:
             # Since there is no alert for this node, mark all previous alerts as resolved
-            unresolved_alerts = Alert.objects.filter(node=self).exclude(
-                status=Alert.Status.RESOLVED
-            )
+            unresolved_alerts = Alert.objects.unresolved().filter(node=self)
             for a in unresolved_alerts:
                 a.resolve()
             return False
@@ -271,9 +367,50 @@ class Node(models.Model):
         return f"Node {self.name} ({self.mac})"
 
 
+class AlertQuerySet(models.QuerySet):
+    """Queryset of alerts, with their events."""
+
+    def unresolved(self) -> "AlertQuerySet":
+        """Filter alerts that are not resolved (yet), which are indexed by node."""
+        return self.exclude(status=Alert.Status.RESOLVED)
+
+    def with_events(self, events: int | None = None) -> "AlertQuerySet":
+        """Prefetch the newest events of each alert, all of them at once.
+
+        :param events: The number of events to prefetch for each alert,
+            Alert.MESSAGE_EVENTS by default.
+        """
+        events = AlertEvent.objects.all()[:events or Alert.MESSAGE_EVENTS]
+        return self.prefetch_related(
+            models.Prefetch("events", queryset=events, to_attr="prefetched_events")
+        )
+
+
+class AlertStatus(models.IntegerChoices):
+    """Alert status choices, outside of Alert so that its indexes can use them."""
+
+    NEW = 1, "New"
+    UPGRADED = 2, "Upgraded"
+    RENAME = 3, "Rename"
+    RESOLVED = 4, "Resolved"
+
+
 class Alert(models.Model):
     """Alert sent to network managers."""
 
+    class Meta:
+        """Alert metadata."""
+
+        indexes = [
+            # See AlertQuerySet.unresolved(), databases without partial indexes
+            # (e.g. MySQL) ignore the condition and index all alerts instead
+            models.Index(
+                fields=["node", "type", "created"],
+                condition=~models.Q(status=AlertStatus.RESOLVED),
+                name="alert_unresolved_node",
+            ),
+        ]
+
     class Level(models.IntegerChoices):
         """Alert level choices."""
 
@@ -288,13 +425,7 @@ class Alert(models.Model):
         UPTIME_LOW = 2, "Uptime Low"
         DATA_USAGE_HIGH = 3, "Data Usage High"
 
-    class Status(models.IntegerChoices):
-        """Alert type choices."""
-
-        NEW = 1, "New"
-        UPGRADED = 2, "Upgraded"
-        RENAME = 3, "Rename"
-        RESOLVED = 4, "Resolved"
+    Status = AlertStatus
 
     TITLE_OFFLINE = "Node is offline"
     TITLE_HEALTH_BAD = "Node's health is bad"
@@ -303,6 +434,9 @@ class Alert(models.Model):
     TEXT_OFFLINE = "The device is unreachable by ping"
     TEXT_HEALTH_BAD_OR_CRITICAL = "The following health checks failed: {}"
 
+    # Fields changed by upgrade(), rename() & resolve()
+    UPDATE_FIELDS = ["text", "level", "title", "modified", "status"]
+
     level = models.SmallIntegerField(choices=Level.choices)
     status = models.SmallIntegerField(choices=Status.choices, default=Status.NEW)
     type = models.SmallIntegerField(choices=Type.choices)
@@ -317,10 +451,14 @@ class Alert(models.Model):
         Mesh, on_delete=models.CASCADE, related_name="alerts", null=True, blank=True
     )
 
+    objects = AlertQuerySet.as_manager()
+
+    # Number of (newest) events in messages
+    MESSAGE_EVENTS = 10
+
     @classmethod
     def from_node(cls, node: Node) -> "Alert | None":
         """Generate an alert from a node's status."""
-        timestamp = timezone.now().strftime("%Y-%m-%d %H:%M:%S")
         if node.status == Node.Status.OFFLINE:
             # Level is critical, it should override any health check warnings.
             # Pretty useless to do health checks if the node is offline.
@@ -328,7 +466,7 @@ class Alert(models.Model):
                 level=Alert.Level.CRITICAL,
                 type=Alert.Type.NODE_STATUS,
                 title=Alert.TITLE_OFFLINE,
-                text=f"_{timestamp}_ {Alert.TEXT_OFFLINE}",
+                text=Alert.TEXT_OFFLINE,
                 node=node,
                 mesh=node.mesh,
             )
@@ -341,7 +479,7 @@ class Alert(models.Model):
                     level=Alert.Level.CRITICAL,
                     type=Alert.Type.NODE_STATUS,
                     title=Alert.TITLE_HEALTH_CRITICAL,
-                    text=f"_{timestamp}_ {Alert.TEXT_HEALTH_BAD_OR_CRITICAL.format(health_checks_failed)}",
+                    text=Alert.TEXT_HEALTH_BAD_OR_CRITICAL.format(health_checks_failed),
                     node=node,
                     mesh=node.mesh,
                 )
@@ -353,16 +491,33 @@ class Alert(models.Model):
                     level=Alert.Level.ERROR,
                     type=Alert.Type.NODE_STATUS,
                     title=Alert.TITLE_HEALTH_BAD,
-                    text=f"_{timestamp}_ {Alert.TEXT_HEALTH_BAD_OR_CRITICAL.format(health_checks_failed)}",
+                    text=Alert.TEXT_HEALTH_BAD_OR_CRITICAL.format(health_checks_failed),
                     node=node,
                     mesh=node.mesh,
                 )
         return None
 
-    def add_event(self, text: str) -> str:
-        """Add a timestamped event to the alert text."""
-        timestamp = timezone.now().strftime("%Y-%m-%d %H:%M:%S")
-        return f"_{timestamp}_ {text}\n{self.text}"
+    @cached_property
+    def new_events(self) -> list["AlertEvent"]:
+        """Events added to this alert since it was last saved."""
+        return []
+
+    def add_event(self, text: str) -> None:
+        """Add a timestamped event to the alert, which is saved with save_events()."""
+        self.new_events.append(AlertEvent(alert=self, text=text))
+
+    @classmethod
+    def save_events(cls, alerts: list["Alert"]) -> None:
+        """Insert the new events of (saved) alerts in bulk."""
+        AlertEvent.objects.bulk_create([event for alert in alerts for event in alert.new_events])
+        for alert in alerts:
+            alert.new_events.clear()
+
+    def save_with_events(self, **kwargs) -> None:
+        """Save this alert and its new events in a transaction."""
+        with transaction.atomic(using=router.db_for_write(Alert)):
+            self.save(**kwargs)
+            Alert.save_events([self])
 
     def generate(self, node: Node | None = None) -> bool:
         """Generate this alert if it is worse than previous alerts of the same type.
@@ -377,81 +532,202 @@ class Alert(models.Model):
 
         :returns: True if the new alert was generated.
         """
-        unresolved_alerts = Alert.objects.filter(type=self.type).exclude(
-            status=Alert.Status.RESOLVED
-        )
+        unresolved_alerts = Alert.objects.unresolved().filter(type=self.type)
         if node:
             unresolved_alerts = unresolved_alerts.filter(node=node)
+        result, changed = self.reconcile(list(unresolved_alerts))
+        with transaction.atomic(using=router.db_for_write(Alert)):
+            for alert in changed:
+                if alert.pk is None:
+                    alert.save()
+                else:
+                    alert.save(update_fields=Alert.UPDATE_FIELDS)
+            Alert.save_events(changed)
+        return result
+
+    def reconcile(self, unresolved_alerts: list["Alert"]) -> tuple[bool, list["Alert"]]:
+        """Apply this alert to the unresolved alerts of the same type, without saving.
+
+        :returns: True if the new alert was generated, and the alerts to save
+            (this alert, if it is new, is the only one without a pk).
+        """
         # Only generate a new alert if the current state is worse than
         # that of an alert triggered last (or there are no previous alerts).
         # Otherwise we would be generating new alerts for the same state,
         # e.g. generating a WARNING alert for a node that has already got an
         # unresolved WARNING.
-        latest_alert = unresolved_alerts.order_by("-created").first()
+        latest_alert = max(unresolved_alerts, key=lambda a: a.created, default=None)
         result = True
+        changed = []
         # Case 1: There is no previous alert, so a new alert is generated
         # regardless of what the status may have been before
         if not latest_alert:
-            self.save()
+            self.add_event(self.text)
+            changed.append(self)
         # Case 2: A new alert is generated because is is worse than the previous alerts
         elif self.level > latest_alert.level:
-            latest_alert.upgrade(self)
+            latest_alert.upgrade(self, save=False)
+            changed.append(latest_alert)
         # Case 3: The new report is as bad as previous ones, but may have
         # changed its reasons, so we generate a new one anyway.
         elif self.level == latest_alert.level and self.title != latest_alert.title:
-            latest_alert.rename(self)
+            latest_alert.rename(self, save=False)
+            changed.append(latest_alert)
         else:
             result = False
         # Mark all previous alerts that were worse than the current status as resolved.
         # E.g. if a node generated a CRITICAL alert, but is now OK, that previous alert
         # is assumed to have been resolved.
-        alerts_worse_than_current_status = unresolved_alerts.filter(
-            level__gt=self.level
-        )
-        for alert in alerts_worse_than_current_status:
-            alert.resolve()
-        return result
+        for alert in unresolved_alerts:
+            if alert.level > self.level:
+                alert.resolve(save=False)
+                changed.append(alert)
+        return result, changed
+
+    @classmethod
+    def reconcile_nodes(cls, nodes: list[Node]) -> list["Alert"]:
+        """Generate the alerts of many nodes, like Node.generate_alert() does for each.
+
+        The unresolved alerts of all nodes are loaded with a single query, and
+        the alerts that changed are written in bulk. As this bypasses save(),
+        post_save is sent for each of them afterwards, so that notifications
+        are still sent once per change.
+
+        :returns: The created and updated alerts.
+        """
+        unresolved_alerts = defaultdict(list)
+        for alert in cls.objects.unresolved().filter(node__in=nodes):
+            unresolved_alerts[alert.node_id].append(alert)
+        changed = []
+        for node in nodes:
+            alerts = unresolved_alerts[node.pk]
+            alert = cls.from_node(node)
+            if not alert:
+                # Since there is no alert for this node, mark all previous alerts as resolved
+                for a in alerts:
+                    a.resolve(save=False)
+                changed.extend(alerts)
+            else:
+                node_changed = alert.reconcile([a for a in alerts if a.type == alert.type])[1]
+                changed.extend(node_changed)
+                alerts = alerts + [a for a in node_changed if a.pk is None]
+            # As counted in the database below
+            node.num_unresolved_alerts = sum(1 for a in alerts if a.status != cls.Status.RESOLVED)
+        if not changed:
+            return changed
+        created = [alert for alert in changed if alert.pk is None]
+        updated = [alert for alert in changed if alert.pk is not None]
+        db = router.db_for_write(cls)
+        with transaction.atomic(using=db):
+            if connections[db].features.can_return_rows_from_bulk_insert:
+                cls.objects.bulk_create(created)
+            else:
+                # The events need the pks of new alerts, which bulk_create() can't
+                # set on e.g. MySQL, save() sends post_save itself
+                for alert in created:
+                    alert.save()
+                created = []
+            cls.objects.bulk_update(updated, cls.UPDATE_FIELDS, batch_size=1000)
+            cls.save_events(changed)
+            Node.objects.filter(pk__in={alert.node_id for alert in changed}).count_unresolved_alerts()
+        for alert in created:
+            post_save.send(sender=cls, instance=alert, created=True, update_fields=None, raw=False, using=db)
+        for alert in updated:
+            post_save.send(
+                sender=cls,
+                instance=alert,
+                created=False,
+                update_fields=frozenset(cls.UPDATE_FIELDS),
+                raw=False,
+                using=db,
+            )
+        return changed
+
+    def save(self, *args, **kwargs):
+        """Save this alert, and update the number of unresolved alerts of its node."""
+        with transaction.atomic(using=router.db_for_write(Alert)):
+            super().save(*args, **kwargs)
+            self.count_node_alerts()
+
+    def count_node_alerts(self) -> None:
+        """Update the number of unresolved alerts of this alert's node.
+
+        Saved alerts are counted by save() and reconcile_nodes(), deleted alerts
+        (cascades included) by a post_delete signal. QuerySet.update() sends no
+        signals, so the count_unresolved_alerts task recounts them periodically.
+        """
+        if self.node_id is not None:
+            Node.objects.filter(pk=self.node_id).count_unresolved_alerts()
 
     def upgrade(self, alert: "Alert", save: bool = True) -> None:
         """Upgrade to a more serious alert"""
         self.level = alert.level
         self.title = alert.title
-        self.text = self.add_event(alert.text)
+        self.text = alert.text
+        self.add_event(alert.text)
         self.modified = timezone.now()
         self.status = Alert.Status.UPGRADED
         if save:
-            self.save(update_fields=["text", "level", "title", "modified", "status"])
+            self.save_with_events(update_fields=["text", "level", "title", "modified", "status"])
 
     def rename(self, alert: "Alert", save: bool = True) -> None:
         """Rename to another alert."""
+        self.add_event(f"Renamed {self.title} -> {alert.title}")
         self.title = alert.title
+        self.text = alert.text
         self.modified = timezone.now()
-        self.text = self.add_event(f"Renamed {self.title} -> {alert.title}")
         self.status = Alert.Status.RENAME
         if save:
-            self.save(update_fields=["text", "title", "modified", "status"])
+            self.save_with_events(update_fields=["text", "title", "modified", "status"])
 
     def resolve(self, save: bool = True) -> None:
         """Mark this alert as resolved."""
         self.status = Alert.Status.RESOLVED
         self.modified = timezone.now()
-        self.text = self.add_event("Resolved this alert")
+        self.add_event("Resolved this alert")
         if save:
-            self.save(update_fields=["status", "modified", "text"])
+            self.save_with_events(update_fields=["status", "modified"])
 
-    def message(self) -> str:
-        """Format alert as a message string (e.g. before sending via WhatsApp)."""
+    def message(self, events: int = MESSAGE_EVENTS) -> str:
+        """Format alert as a message string (e.g. before sending via WhatsApp).
+
+        :param events: The number of (newest) events to include.
+        """
         statusName = Alert.Status(self.status).label
         levelName = Alert.Level(self.level).label
         text = f"*[{statusName} {levelName}]* {self.title}"
         if self.node:
             text += f"\nGenerated by node '{self.node.name}'"
-        return f"{text}\n{self.text}"
+        lines = [str(event) for event in self.newest_events(events)]
+        return "\n".join([text, *lines])
+
+    def newest_events(self, events: int = MESSAGE_EVENTS) -> list["AlertEvent"]:
+        """Get the newest events of this alert, prefetched by AlertQuerySet.with_events()."""
+        if hasattr(self, "prefetched_events"):
+            return self.prefetched_events[:events]
+        return list(self.events.all()[:events])
 
     def __str__(self):
         return f"Alert for {self.node} level={self.level} [{self.created}]"
 
 
+class AlertEvent(models.Model):
+    """Timestamped event in the history of an alert, which are only ever added."""
+
+    class Meta:
+        """AlertEvent metadata."""
+
+        ordering = ["-created", "-id"]
+        indexes = [models.Index(fields=["alert", "-created"], name="alert_event_alert_created")]
+
+    alert = models.ForeignKey(Alert, on_delete=models.CASCADE, related_name="events")
+    created = models.DateTimeField(default=timezone.now)
+    text = models.CharField(max_length=255)
+
+    def __str__(self):
+        return f"_{self.created:%Y-%m-%d %H:%M:%S}_ {self.text}"
+
+
 class Service(models.Model):
 
     SERVICE_TYPES = (
@@ -1,4 +1,4 @@
-from rest_framework.serializers import ModelSerializer, SerializerMethodField
+from rest_framework.serializers import ListSerializer, ModelSerializer, SerializerMethodField
 from drf_dynamic_fields import DynamicFieldsMixin
 
 from radius.models import Radacct
@@ -39,10 +39,24 @@ class MeshSerializer(ModelSerializer):
         fields = "__all__"
 
 
+class AlertEventSerializer(ModelSerializer):
+    """Serializes AlertEvent objects from django model to JSON."""
+
+    class Meta:
+        """AlertEventSerializer metadata."""
+
+        model = models.AlertEvent
+        fields = ["created", "text"]
+
+
 class AlertSerializer(ModelSerializer):
-    """Serializes Alert objects from django model to JSON."""
+    """Serializes Alert objects from django model to JSON.
+
+    Alerts should be fetched with_events(), so their newest events are prefetched.
+    """
 
     node = SerializerMethodField()
+    events = SerializerMethodField()
 
     class Meta:
         """ServiceSerializer metadata."""
@@ -56,6 +70,19 @@ class AlertSerializer(ModelSerializer):
         # that to JSON. As a workaround, I manually stringify it here.
         return str(alert.node.mac)
 
+    def get_events(self, alert: models.Alert) -> list[dict]:
+        """Get the newest events of this alert."""
+        return AlertEventSerializer(alert.newest_events(), many=True).data
+
+
+class NodeListSerializer(ListSerializer):
+    """Serializes many Node objects, running their checks and fetching their alerts in one go."""
+
+    def to_representation(self, data):
+        nodes = models.Node.run_all_checks(data.all() if hasattr(data, "all") else data)
+        models.Node.prefetch_latest_alerts(nodes)
+        return super().to_representation(nodes)
+
 
 class NodeSerializer(DynamicFieldsMixin, ModelSerializer):
     """Serializes Node objects from django model to JSON."""
@@ -65,11 +92,11 @@ class NodeSerializer(DynamicFieldsMixin, ModelSerializer):
 
         model = models.Node
         fields = "__all__"
+        list_serializer_class = NodeListSerializer
 
     neighbours = SerializerMethodField()
     checks = SerializerMethodField()
     latest_alerts = SerializerMethodField()
-    num_unresolved_alerts = SerializerMethodField()
     upload_speed = SerializerMethodField()
     download_speed = SerializerMethodField()
     client_sessions = SerializerMethodField()
@@ -80,12 +107,7 @@ class NodeSerializer(DynamicFieldsMixin, ModelSerializer):
 
     def get_latest_alerts(self, node: models.Node) -> list[dict]:
         """Get the latest alerts for this node."""
-        # TODO: Hard-coded for now
-        return AlertSerializer(node.alerts.order_by("created")[:10], many=True).data
-
-    def get_num_unresolved_alerts(self, node: models.Node) -> int:
-        """Get the number of unresolved alerts for this node."""
-        return node.alerts.exclude(status=models.Alert.Status.RESOLVED).count()
+        return AlertSerializer(node.latest_alerts(), many=True).data
 
     def get_upload_speed(self, node: models.Node) -> float | None:
         """Get node's upload speed."""
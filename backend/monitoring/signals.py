@@ -1,6 +1,7 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.conf import settings
+from django.db import transaction
 
 from .models import Mesh, MeshSettings, Alert
 from .tasks import send_alert_message
@@ -14,6 +15,13 @@ def create_settings_if_not_defined(sender, created, instance, **kwargs):
 
 
 @receiver(post_save, sender=Alert)
-def send_message_on_alert_save(sender, created, instance, **kwargs):
+def send_message_on_alert_save(sender, created, instance, using, **kwargs):
     """Send a whatsapp message after creating or modifying alerts."""
-    send_alert_message.delay(instance.pk)
+    # Once committed, so that the message includes the alert's new events
+    transaction.on_commit(lambda: send_alert_message.delay(instance.pk), using=using)
+
+
+@receiver(post_delete, sender=Alert)
+def count_node_alerts_on_alert_delete(sender, instance, **kwargs):
+    """Update the number of unresolved alerts of a node, also on cascade deletes."""
+    instance.count_node_alerts()
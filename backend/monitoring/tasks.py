@@ -30,6 +30,13 @@ def send_alert_message(alertId: int):
         send_whatsapp(text, phonenum)
 
 
+@shared_task
+def count_unresolved_alerts() -> None:
+    """Recount the unresolved alerts of all nodes, e.g. after QuerySet.update()."""
+    count = models.Node.objects.count_unresolved_alerts()
+    logger.info(f"Recounted the unresolved alerts of {count} nodes")
+
+
 @shared_task
 def send_whatsapp(body: str, number: str) -> None:
     """Send an sms from a twilio account."""
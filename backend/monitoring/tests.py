@@ -1,6 +1,16 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-from . import models
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import models, serializers
 
 
 class TestMeshModel(TestCase):
@@ -13,3 +23,240 @@ class TestMeshModel(TestCase):
         # No new settings created
         mesh.save()
         self.assertEqual(old_id, mesh.settings.id)
+
+
+class TestDeclarativeChecks(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    def setUp(self):
+        self.mesh = models.Mesh.objects.create(name="mesh")
+        self.mesh.settings.check_active = timedelta(minutes=10)
+        self.mesh.settings.save()
+        now = timezone.now()
+        for i, last_contact in enumerate([now, now - timedelta(hours=1), None]):
+            models.Node.objects.create(mac=f"00:00:00:00:00:0{i}", name=str(i), mesh=self.mesh, last_contact=last_contact)
+        models.Node.objects.create(mac="00:00:00:00:00:10", name="unknown", last_contact=now)
+        self.active_check = next(c for c in settings.DEVICE_CHECKS if c["key"] == "last_contact")
+
+    def test_declared_checks_match_lambdas(self):
+        check = {**self.active_check, "func": lambda v, s: timezone.now() - v < s}
+        declared = [node.get_health_status() for node in models.Node.objects.order_by("name")]
+        self.assertEqual(declared[:3], ["ok", "critical", "unknown"])
+        with override_settings(DEVICE_CHECKS=[check]):
+            lambdas = [node.get_health_status() for node in models.Node.objects.order_by("name")]
+        with override_settings(DEVICE_CHECKS=[self.active_check]):
+            self.assertEqual([node.get_health_status() for node in models.Node.objects.order_by("name")], lambdas)
+
+    def test_overview(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="test"))
+        with self.assertNumQueries(1):
+            response = client.get("/monitoring/overview/")
+        self.assertEqual(response.data["n_nodes"], 3)
+        self.assertEqual(response.data["n_unknown_nodes"], 1)
+        self.assertEqual(response.data["n_online_nodes"], 0)
+
+
+class TestAlertReconciliation(TestCase):
+
+    databases = {"default", "metrics_db"}
+
+    def setUp(self):
+        self.send_alert_message = self.enterContext(mock.patch("monitoring.signals.send_alert_message"))
+        self.mesh = models.Mesh.objects.create(name="mesh")
+        offline, online = models.Node.Status.OFFLINE, models.Node.Status.ONLINE
+        self.nodes = [
+            models.Node.objects.create(mac=f"00:00:00:00:00:0{i}", name=str(i), mesh=self.mesh, status=status)
+            for i, status in enumerate([offline, offline, offline, online, offline])
+        ]
+        self.create_alerts()
+
+    def create_alerts(self):
+        Alert = models.Alert
+        Alert.objects.all().delete()
+        for node, level, title in [
+            (self.nodes[1], Alert.Level.ERROR, Alert.TITLE_HEALTH_BAD),
+            (self.nodes[2], Alert.Level.CRITICAL, Alert.TITLE_HEALTH_CRITICAL),
+            (self.nodes[3], Alert.Level.ERROR, Alert.TITLE_HEALTH_BAD),
+            (self.nodes[4], Alert.Level.CRITICAL, Alert.TITLE_OFFLINE),
+        ]:
+            Alert.objects.create(node=node, mesh=self.mesh, level=level, title=title, text="", type=Alert.Type.NODE_STATUS)
+
+    def statuses(self) -> list[list[int]]:
+        return [
+            list(node.alerts.order_by("created").values_list("status", flat=True))
+            for node in self.nodes
+        ]
+
+    def test_reconcile_nodes(self):
+        self.send_alert_message.reset_mock()
+        nodes = models.Node.run_all_checks(models.Node.objects.order_by("name"))
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(7):
+            changed = models.Alert.reconcile_nodes(nodes)
+        Status = models.Alert.Status
+        self.assertEqual(
+            self.statuses(),
+            [[Status.NEW], [Status.UPGRADED], [Status.RENAME], [Status.RESOLVED], [Status.NEW]],
+        )
+        # One notification per new or changed alert
+        self.assertEqual(len(changed), 4)
+        self.assertEqual(
+            sorted(call.args[0] for call in self.send_alert_message.delay.call_args_list),
+            sorted(alert.pk for alert in changed),
+        )
+        # Nothing changes when the nodes are in the same state
+        self.assertEqual(models.Alert.reconcile_nodes(nodes), [])
+        nodes = models.Node.objects.order_by("name")
+        self.assertEqual([node.num_unresolved_alerts for node in nodes], [1, 1, 1, 0, 1])
+
+    def test_reconcile_nodes_without_returned_pks(self):
+        # e.g. MySQL, where bulk_create() doesn't set the pks of new alerts
+        features = type(connections["default"].features)
+        nodes = models.Node.run_all_checks(models.Node.objects.order_by("name"))
+        self.send_alert_message.reset_mock()
+        with mock.patch.object(
+            features, "can_return_rows_from_bulk_insert", new_callable=mock.PropertyMock, return_value=False
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                changed = models.Alert.reconcile_nodes(nodes)
+        self.assertEqual(len(changed), 4)
+        self.assertTrue(all(alert.pk is not None for alert in changed))
+        self.assertEqual(
+            sorted(call.args[0] for call in self.send_alert_message.delay.call_args_list),
+            sorted(alert.pk for alert in changed),
+        )
+        new = models.Alert.objects.get(node=self.nodes[0])
+        self.assertEqual([event.text for event in new.newest_events()], [models.Alert.TEXT_OFFLINE])
+
+    def test_same_as_generate_alert(self):
+        for node in models.Node.objects.order_by("name"):
+            node.generate_alert()
+        generated = self.statuses()
+        self.create_alerts()
+        models.Alert.reconcile_nodes(models.Node.run_all_checks(models.Node.objects.all()))
+        self.assertEqual(self.statuses(), generated)
+
+    def test_events(self):
+        Alert = models.Alert
+        node = self.nodes[3]
+        node.health_status = models.Node.HealthStatus.CRITICAL
+        node.generate_alert()
+        node.status = models.Node.Status.OFFLINE
+        node.generate_alert()
+        node.status = models.Node.Status.ONLINE
+        node.health_status = models.Node.HealthStatus.OK
+        node.generate_alert()
+        # The alert was upgraded, renamed and then resolved
+        alert = node.alerts.get()
+        # The text stays the current description, the history is in the events
+        self.assertEqual(alert.text, Alert.TEXT_OFFLINE)
+        events = [event.text for event in alert.newest_events()]
+        self.assertEqual(
+            events[:2],
+            ["Resolved this alert", f"Renamed {Alert.TITLE_HEALTH_CRITICAL} -> {Alert.TITLE_OFFLINE}"],
+        )
+        self.assertTrue(events[2].startswith("The following health checks failed"))
+        lines = alert.message(events=1).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[-1].endswith("_ Resolved this alert"))
+
+    def test_alerts_api_prefetches_events(self):
+        models.Alert.reconcile_nodes(models.Node.run_all_checks(models.Node.objects.all()))
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="test"))
+        with self.assertNumQueries(2):
+            response = client.get("/monitoring/alerts/")
+        self.assertEqual(response.status_code, 200)
+        events = {alert["id"]: alert["events"] for alert in response.data}
+        alert = models.Alert.objects.get(node=self.nodes[3])
+        self.assertEqual([event["text"] for event in events[alert.pk]], ["Resolved this alert"])
+
+    def test_unresolved_alerts_count(self):
+        node = self.nodes[1]
+        node.refresh_from_db()
+        self.assertEqual(node.num_unresolved_alerts, 1)
+        alert = node.alerts.get()
+        alert.resolve()
+        node.refresh_from_db()
+        self.assertEqual(node.num_unresolved_alerts, 0)
+        alert.status = models.Alert.Status.NEW
+        alert.save()
+        node.refresh_from_db()
+        self.assertEqual(node.num_unresolved_alerts, 1)
+        alert.delete()
+        node.refresh_from_db()
+        self.assertEqual(node.num_unresolved_alerts, 0)
+        # Saving a stale node doesn't overwrite the number
+        stale = models.Node.objects.get(pk=node.pk)
+        models.Alert.objects.create(node=node, level=1, title="", text="", type=models.Alert.Type.UPTIME_LOW)
+        stale.description = "stale"
+        stale.save()
+        node.refresh_from_db()
+        self.assertEqual((node.description, node.num_unresolved_alerts), ("stale", 1))
+        # Deleting alerts in bulk or by cascade sends post_delete
+        models.Alert.objects.filter(node=node).delete()
+        node.refresh_from_db()
+        self.assertEqual(node.num_unresolved_alerts, 0)
+        mesh = models.Mesh.objects.create(name="other")
+        models.Alert.objects.create(node=node, mesh=mesh, level=1, title="", text="", type=1)
+        mesh.delete()
+        node.refresh_from_db()
+        self.assertEqual(node.num_unresolved_alerts, 0)
+        models.Alert.objects.create(node=node, level=1, title="", text="", type=1)
+        node.refresh_from_db()
+        # The node's alert badge is a (read-only) field
+        field = serializers.NodeSerializer().fields["num_unresolved_alerts"]
+        self.assertTrue(field.read_only)
+        self.assertEqual(field.to_representation(node.num_unresolved_alerts), 1)
+
+    def test_unresolved_alerts_index(self):
+        plan = models.Alert.objects.unresolved().filter(node=self.nodes[1], type=models.Alert.Type.NODE_STATUS).explain()
+        self.assertRegex(plan, "alert_unresolved_node|alert_node_status")
+
+    def test_node_list_prefetches_alerts(self):
+        models.Alert.reconcile_nodes(models.Node.run_all_checks(models.Node.objects.all()))
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="test"))
+        with CaptureQueriesContext(connections["default"]) as queries:
+            response = client.get("/monitoring/devices/")
+        self.assertEqual(response.status_code, 200)
+        alert_queries = [q["sql"] for q in queries if 'FROM "monitoring_alert' in q["sql"]]
+        # One query for the alerts of all nodes, one for their events
+        self.assertEqual(len(alert_queries), 2)
+        node = next(node for node in response.data if node["name"] == "0")
+        self.assertEqual([event["text"] for event in node["latest_alerts"][0]["events"]], [models.Alert.TEXT_OFFLINE])
+
+
+class TestAlertEventsMigration(TransactionTestCase):
+
+    def migrate(self, target: str):
+        executor = MigrationExecutor(connections["default"])
+        executor.migrate([("monitoring", target)])
+        return executor.loader.project_state([("monitoring", target)]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connections["default"])
+        executor.migrate(executor.loader.graph.leaf_nodes("monitoring"))
+
+    def test_legacy_text_is_split_into_events(self):
+        apps = self.migrate("0005_remove_meshsettings_check_download_speed_and_more")
+        OldAlert = apps.get_model("monitoring", "Alert")
+        alert = OldAlert.objects.create(
+            level=models.Alert.Level.CRITICAL,
+            type=models.Alert.Type.NODE_STATUS,
+            title=models.Alert.TITLE_OFFLINE,
+            text="_2026-01-02 10:00:00_ Resolved this alert\n"
+            "_2026-01-01 12:30:00_ _2026-01-01 12:29:59_ The device is unreachable by ping\n"
+            "_2026-01-01 08:00:00_ The following health checks failed: rtt",
+        )
+        self.migrate("0006_alertevent")
+        events = models.AlertEvent.objects.filter(alert_id=alert.pk)
+        self.assertEqual(
+            [str(event) for event in events],
+            [
+                "_2026-01-02 10:00:00_ Resolved this alert",
+                "_2026-01-01 12:30:00_ The device is unreachable by ping",
+                "_2026-01-01 08:00:00_ The following health checks failed: rtt",
+            ],
+        )
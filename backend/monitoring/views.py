@@ -1,3 +1,4 @@
+from django.db.models import Count, Q
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
@@ -9,13 +10,14 @@ from . import serializers
 
 @api_view()
 def overview(request):
-    return Response({
-        "n_nodes": Node.objects.filter(mesh__isnull=False).count(),
-        "n_positioned_nodes": Node.objects.filter(lat__isnull=False, lon__isnull=False).count(),
-        "n_unknown_nodes": Node.objects.filter(mesh__isnull=True).count(),
-        "n_ok_nodes": Node.objects.filter(health_status=Node.HealthStatus.OK).count(),
-        "n_online_nodes": Node.objects.filter(status=Node.Status.ONLINE).count(),
-    })
+    """Count nodes in a single query."""
+    return Response(Node.objects.aggregate(
+        n_nodes=Count("pk", filter=Q(mesh__isnull=False)),
+        n_positioned_nodes=Count("pk", filter=Q(lat__isnull=False, lon__isnull=False)),
+        n_unknown_nodes=Count("pk", filter=Q(mesh__isnull=True)),
+        n_ok_nodes=Count("pk", filter=Q(health_status=Node.HealthStatus.OK)),
+        n_online_nodes=Count("pk", filter=Q(status=Node.Status.ONLINE)),
+    ))
 
 
 class NodeViewSet(ModelViewSet):
@@ -28,7 +30,7 @@ class NodeViewSet(ModelViewSet):
 class AlertsViewSet(ModelViewSet):
     """View/Edit/Add/Delete Alert items."""
 
-    queryset = models.Alert.objects.all()
+    queryset = models.Alert.objects.select_related("node").with_events()
     serializer_class = serializers.AlertSerializer
 
 
@@ -5,7 +5,7 @@ import time
 
 from mysql.connector import connect
 from django.conf import settings
-from django.utils.timezone import make_aware, now
+from django.utils.timezone import make_aware
 from django.contrib.auth.models import User
 
 from monitoring.models import Mesh, Node
@@ -74,11 +74,11 @@ JOIN aps a
 ON s.ap_id = a.id;
 """
 GET_NODE_AND_AP_RESOURCES_QUERY = """
-SELECT n.mac, l.mem_total, l.mem_free
+SELECT n.mac, l.mem_total, l.mem_free, l.modified
 FROM node_loads l
 JOIN nodes n
 ON l.node_id = n.id;
-SELECT a.mac, l.mem_total, l.mem_free
+SELECT a.mac, l.mem_total, l.mem_free, l.modified
 FROM ap_loads l
 JOIN aps a
 ON l.ap_id = a.id;
@@ -137,6 +137,7 @@ def sync_nodes(cursor):
 def sync_node_bytes_metrics(cursor):
     """Sync BytesMetric objects from the radiusdesk database."""
     latest_metric = DataUsageMetric.objects.last()
+    # Metrics at the watermark are synced again, ingesting them skips duplicates
     last_created = latest_metric.created if latest_metric else None
     for result in cursor.execute(GET_NODE_AND_AP_BYTES_QUERY, multi=True):
         for mac, tx_bytes, rx_bytes, created in result.fetchall():
@@ -154,6 +155,7 @@ def sync_node_bytes_metrics(cursor):
 def sync_node_rates_metrics(cursor):
     """Sync DataRateMetric objects from the radiusdesk database."""
     latest_metric = DataRateMetric.objects.last()
+    # Metrics at the watermark are synced again, ingesting them skips duplicates
     last_created = latest_metric.created if latest_metric else None
     for result in cursor.execute(GET_NODE_AND_AP_RATES_QUERY, multi=True):
         for mac, rx_rate, tx_rate, created in result.fetchall():
@@ -171,6 +173,7 @@ def sync_node_rates_metrics(cursor):
 def sync_node_failures_metrics(cursor):
     """Sync FailuresMetric objects from the radiusdesk database."""
     latest_metric = FailuresMetric.objects.last()
+    # Metrics at the watermark are synced again, ingesting them skips duplicates
     last_created = latest_metric.created if latest_metric else None
     for result in cursor.execute(GET_NODE_AND_AP_FAILURES_QUERY, multi=True):
         for (
@@ -196,13 +199,20 @@ def sync_node_failures_metrics(cursor):
 @bulk_sync(ResourcesMetric)
 def sync_node_resources_metrics(cursor):
     """Sync NodeLoad objects from the radiusdesk database."""
+    latest_metric = ResourcesMetric.objects.last()
+    # Metrics at the watermark are synced again, ingesting them skips duplicates
+    last_created = latest_metric.created if latest_metric else None
     for result in cursor.execute(GET_NODE_AND_AP_RESOURCES_QUERY, multi=True):
-        for node_mac, mem_total, mem_free in result.fetchall():
+        for node_mac, mem_total, mem_free, modified in result.fetchall():
+            # Loads are updated in place, so a load is only synced once
+            created_aware = make_aware(modified, TZ)
+            if last_created and created_aware < last_created:
+                continue
             yield {
                 "mac": node_mac,
                 "memory": mem_free / mem_total * 100,
                 "cpu": -1,  # Radiusdesk doesn't track CPU usage??
-            }, {"created": now()}
+            }, {"created": created_aware}
 
 
 def run():
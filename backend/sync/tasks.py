@@ -6,7 +6,7 @@ from django.conf import settings
 
 from sync.radiusdesk.sync_db import run as syncrd
 from sync.unifi.sync_db import run as syncunifi
-from monitoring.models import Node
+from monitoring.models import Alert, Node
 from monitoring.serializers import NodeSerializer
 
 logger = get_task_logger(__name__)
@@ -32,9 +32,8 @@ def sync_dbs() -> None:
 def generate_alerts(node_mac: str | None = None) -> None:
     """Generate alerts for all nodes."""
     logger.info("Generating alerts")
-    node = Node.objects.get(mac=node_mac) if node_mac else None
-    for n in ([node] if node else Node.objects.all()):
-        n.generate_alert()
+    nodes = Node.objects.filter(mac=node_mac) if node_mac else Node.objects.all()
+    Alert.reconcile_nodes(Node.run_all_checks(nodes))
 
 
 @shared_task
@@ -51,6 +51,7 @@ def sync_nodes(client):
 def sync_node_data_usage_metrics(client):
     """Sync DataUsageMetric objects from the unifi database."""
     latest_metric = DataUsageMetric.objects.last()
+    # Metrics at the watermark are synced again, ingesting them skips duplicates
     last_created = latest_metric.created if latest_metric else None
     aps = client.ace_stat.stat_hourly.find({"o": "ap"})
     for ap in aps:
@@ -68,6 +69,7 @@ def sync_node_data_usage_metrics(client):
 def sync_node_data_rate_metrics(client):
     """Sync DataRateMetric objects from the unifi database."""
     latest_metric = DataRateMetric.objects.last()
+    # Metrics at the watermark are synced again, ingesting them skips duplicates
     last_created = latest_metric.created if latest_metric else None
     aps = client.ace_stat.stat_5minutes.find({"o": "ap"})
     for ap in aps:
@@ -86,6 +88,7 @@ def sync_node_data_rate_metrics(client):
 def sync_node_failures_metrics(client):
     """Sync FailuresMetric objects from the unifi database."""
     latest_metric = FailuresMetric.objects.last()
+    # Metrics at the watermark are synced again, ingesting them skips duplicates
     last_created = latest_metric.created if latest_metric else None
     aps = client.ace_stat.stat_hourly.find({"o": "ap"})
     for ap in aps:
@@ -108,6 +111,7 @@ def sync_node_failures_metrics(client):
 def sync_node_resources_metrics(client):
     """Sync NodeLoad objects from the unifi database."""
     latest_metric = ResourcesMetric.objects.last()
+    # Metrics at the watermark are synced again, ingesting them skips duplicates
     last_created = latest_metric.created if latest_metric else None
     aps = client.ace_stat.stat_hourly.find({"o": "ap"})
     for ap in aps:
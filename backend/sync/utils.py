@@ -6,12 +6,20 @@ from django.utils.timezone import make_aware
 from django.http import HttpRequest
 import pytz
 
+from metrics.buffer import get_buffer
+from metrics.models import Metric
+
 
 def bulk_sync(ModelType: Type[models.Model], delete: bool = False):
-    """Log output for sync, with number of added, updated and deleted models."""
+    """Log output for sync, with number of added, updated and deleted models.
+
+    Metrics are only ever added, through the metric write buffer.
+    """
 
     def outer(syncfunc):
         def inner(cursor):
+            if issubclass(ModelType, Metric):
+                return buffer_metrics(cursor)
             ids_to_delete = set(ModelType.objects.values_list("pk", flat=True))
             n_added, n_updated = 0, 0
             for result in syncfunc(cursor):
@@ -36,6 +44,22 @@ def bulk_sync(ModelType: Type[models.Model], delete: bool = False):
                 f"({n_added} created, {n_updated} updated, {n_deleted} deleted)"
             )
 
+        def buffer_metrics(cursor):
+            buffer = get_buffer()
+            n_added, n_invalid = 0, 0
+            for result in syncfunc(cursor):
+                fields = {}
+                for part in result:
+                    fields.update(part or {})
+                try:
+                    buffer.add([ModelType(**fields)])
+                except ValueError as e:
+                    print(f"Skipped invalid metric: {e}")
+                    n_invalid += 1
+                    continue
+                n_added += 1
+            print(f"Updated {ModelType.__name__:>12} models ({n_added} buffered, {n_invalid} invalid)")
+
         return inner
 
     return outer